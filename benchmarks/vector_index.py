@@ -0,0 +1,109 @@
+"""
+Compare the numpy vector index with float16 / int8 codes against exact float32 search.
+
+    python -m benchmarks.vector_index [--source collection|synthetic] [--rows 50000] [--dim 1536]
+
+With `--source collection` the embeddings are read from the configured collection
+(VECTOR_STORE), otherwise random unit vectors are used. Queries are corpus vectors with
+a little noise added, held out: they are removed from the indexed corpus. For every storage mode it reports the index size on
+disk (the page cache it occupies once resident), the bytes every query scans, queries per
+second and recall@k against the float32 results. NumPy has no int8/float16 matmul, so the
+quantized scans are upcast block by block and are slower than float32: what they buy is
+memory, not throughput.
+"""
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from src.vector_index import NumpyCollection
+
+
+def load_collection_embeddings(batch_size: int = 1000) -> np.ndarray:
+    from src.db import get_chromadb_collection
+    collection = get_chromadb_collection()
+    rows, offset = [], 0
+    while True:
+        batch = collection.get(limit=batch_size, offset=offset, include=["embeddings"])
+        if not batch["ids"]:
+            break
+        rows.extend(batch["embeddings"])
+        offset += len(batch["ids"])
+    return np.asarray(rows, dtype=np.float32)
+
+
+def synthetic_embeddings(rows: int, dim: int, seed: int = 0) -> np.ndarray:
+    # a few hundred clusters, closer to real embeddings than isotropic noise
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(rows // 100, 1), dim)).astype(np.float32)
+    labels = rng.integers(0, len(centers), rows)
+    return centers[labels] + 0.5 * rng.standard_normal((rows, dim)).astype(np.float32)
+
+
+def build(path: str, embeddings: np.ndarray, quantization: str, rescore_factor: int) -> NumpyCollection:
+    collection = NumpyCollection(path, quantization=quantization, rescore_factor=rescore_factor)
+    collection.add(ids=[str(i) for i in range(len(embeddings))], embeddings=embeddings)
+    return collection
+
+
+def disk_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path) if name.endswith(".npy"))
+
+
+def scanned_bytes(collection: NumpyCollection) -> int:
+    if collection.codes is None:
+        return collection.matrix.nbytes
+    return collection.codes.nbytes + (collection.scales.nbytes if collection.scales is not None else 0)
+
+
+def run(embeddings: np.ndarray, queries: np.ndarray, k: int, batch_size: int, rescore_factor: int):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for quantization in ("none", "float16", "int8"):
+            path = os.path.join(tmp, quantization)
+            collection = build(path, embeddings, quantization, rescore_factor)
+            ids = []
+            start = time.perf_counter()
+            for i in range(0, len(queries), batch_size):
+                ids.extend(collection.query(query_embeddings=queries[i:i + batch_size], n_results=k,
+                                            include=["distances"])["ids"])
+            elapsed = time.perf_counter() - start
+            results[quantization] = (disk_bytes(path), scanned_bytes(collection), len(queries) / elapsed, ids)
+
+    _, _, baseline_qps, exact = results["none"]
+    print(f"{len(embeddings)} vectors x {embeddings.shape[1]} dims, {len(queries)} queries, k={k}, "
+          f"rescore factor {rescore_factor}")
+    print(f"{'storage':<10}{'disk MB':>10}{'scanned MB':>12}{'queries/s':>12}{'vs float32':>12}{'recall@k':>10}")
+    for quantization, (disk, scanned, qps, ids) in results.items():
+        recall = np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(exact, ids) if a])
+        print(f"{quantization:<10}{disk / 2 ** 20:>10.1f}{scanned / 2 ** 20:>12.1f}"
+              f"{qps:>12.0f}{qps / baseline_qps:>11.2f}x{recall:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark quantized vector index storage")
+    parser.add_argument("--source", choices=["collection", "synthetic"], default="synthetic")
+    parser.add_argument("--rows", type=int, default=50000, help="synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=1536, help="synthetic vector size")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=20, help="queries per collection.query call")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.source == "collection":
+        embeddings = load_collection_embeddings()
+    else:
+        embeddings = synthetic_embeddings(args.rows, args.dim)
+    if len(embeddings) < 2:
+        raise SystemExit("Not enough embeddings to benchmark")
+
+    rng = np.random.default_rng(1)
+    picked = rng.choice(len(embeddings), min(args.queries, len(embeddings) - 1), replace=False)
+    queries = embeddings[picked] + 0.1 * rng.standard_normal((len(picked), embeddings.shape[1])).astype(np.float32)
+    corpus = np.delete(embeddings, picked, axis=0)
+    run(corpus, queries, args.k, args.batch_size, args.rescore_factor)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,15 +14,26 @@ from datetime import timedelta, datetime
 import uvicorn
 from fastapi.responses import JSONResponse
 from .user_data import get_repos
+from contextlib import asynccontextmanager
 from src.db import (recommend, 
-                    get_topic_based_recommendations)
+                    get_topic_based_recommendations,
+                    init_chromadb, close_chromadb, run_chroma)
 from src.models import (User, 
                         GithubUser, 
                         get_user_collection, 
                         append_recommendations_to_db, get_user_previous_recommendations, 
                         get_user_recommendation_by_id, check_and_update_daily_limit,
-                        process_recommendations, append_user_to_db)
-from redis import Redis
+                        process_recommendations, append_user_to_db,
+                        recommendation_writer, repo_catalog)
+from src.embedding_cache import get_embedding_cache
+from src.rate_limit import rate_limit_budget
+from src.ingestion import schedule_coverage_check, run_worker, GPAT
+from src.response_cache import ResponseCache, fingerprint
+from src.cache import init_redis, close_redis, redis_get_json, redis_write
+from src.settings import (INGESTION_QUEUE_BACKEND,
+                          RESPONSE_CACHE_ENABLED,
+                          RECOMMENDATION_CACHE_TTL,
+                          USER_RECOMMENDATIONS_CACHE_TTL)
 
 # load_dotenv()
 logger = logging.getLogger(__name__)
@@ -52,7 +63,44 @@ GITHUB_CLIENT_ID = os.getenv("GITHUB_CLIENT_ID")
 GITHUB_CLIENT_SECRET = os.getenv("GITHUB_CLIENT_SECRET")
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # one pooled ChromaDB connection per worker, shared by every request
+    await run_chroma(init_chromadb)
+
+    # and one bounded Redis pool; requests fall back to Mongo while Redis is down
+    app.state.redis = init_redis()
+    try:
+        await app.state.redis.ping()
+    except Exception as e:
+        logger.error(f"Error connecting to Redis: {e}")
+
+    # with the local queue the crawl worker lives in this process
+    stop_worker = asyncio.Event()
+    worker = None
+    if INGESTION_QUEUE_BACKEND == "local" and GPAT:
+        worker = asyncio.create_task(run_worker(stop=stop_worker))
+
+    yield
+
+    if worker is not None:
+        stop_worker.set()
+        await worker
+    # recommendations already returned to users must reach Mongo before we exit
+    await recommendation_writer.close()
+    await run_chroma(close_chromadb)
+    await close_redis()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# whole recommendation responses, shared across workers through Redis
+response_cache = ResponseCache("recommendations:response:")
+
+
+def has_recommendations(response: dict) -> bool:
+    # empty answers are not cached, the coverage check may fill the corpus soon
+    return bool(response.get('recommendations'))
 
 app.add_middleware(
     CORSMiddleware,
@@ -61,7 +109,6 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-app.state.redis = Redis(host="localhost", port=6379)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -181,6 +228,16 @@ async def preflight_verify_token():
     return {"message": "Preflight response"}
 
 
+async def cache_new_recommendation(username: str, rec_id: str, recommendations: list):
+    """
+    Warm the read cache with a new recommendation and drop the user's now outdated list, in one
+    round trip. The Mongo write is batched in the background, until then other workers read it here.
+    """
+    await redis_write({f"recommendation:{rec_id}": {"recommendation_id": rec_id, "recommendations": recommendations}},
+                      delete=[f"user_recommendations:{username}"],
+                      ttl=RECOMMENDATION_CACHE_TTL)
+
+
 @app.post('/api/recommendations/')
 async def get_recommendations(request: Request, current_user: dict = Depends(get_current_user)) -> dict:
     try:
@@ -189,93 +246,100 @@ async def get_recommendations(request: Request, current_user: dict = Depends(get
         extra_topics = body.get("extra_topics", [])
         languages = body.get("languages", [])
 
-        urls = []
         user = User(username=current_user["username"], access_token=current_user["access_token"],extra_topics=extra_topics, languages=languages)
 
         user_details, languages_topics = await get_repos(user)
-        if not user_details:
-            logger.info("No repos found for user, generating topic-based recommendations")
-            urls = await get_topic_based_recommendations(user)
-        else:
-            try:
-                if extra_topics or languages:
-                    languages_topics = {'languages': languages, 'topics': extra_topics}
-                logger.info('Generating recommendations based on user details')
-                urls = await recommend(user_details=user_details, languages_topics=languages_topics)
-            except Exception as e:
-                logger.error(f"Error generating recommendations: {str(e)}")
-                urls = []
-
-        if not urls:
-            logger.info("No recommendations found")
-            return {'recommendations': [], 'message': 'No recommendations found, please mention more topics or languages'}
-        
-        unique_recommendations = process_recommendations(urls, languages_topics)
-
-        if not unique_recommendations:
-            logger.info(f"No recommendations found for user: {username}")
-            return {'recommendations': [], 'message': 'No recommendations found'}
-        
-        rec_name = f"Recommendations for {username} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        rec_id = append_recommendations_to_db(username, unique_recommendations, rec_name)
-        logger.info(f"Recommendations saved to DB with ID: {rec_id}")
-
-
-        # update_daily_limit(username) # updates the daily limit of the user.
-        return {
-            'recommendations': unique_recommendations[:20],
-            'recommendation_id': rec_id
-        }
+        if user_details and (extra_topics or languages):
+            languages_topics = {'languages': languages, 'topics': extra_topics}
+
+        # grow the corpus for what this user asked about, off the request path
+        schedule_coverage_check(languages_topics.get('languages', []), languages_topics.get('topics', []))
+
+        async def generate():
+            urls = []
+            if not user_details:
+                logger.info("No repos found for user, generating topic-based recommendations")
+                urls = await get_topic_based_recommendations(user)
+            else:
+                try:
+                    logger.info('Generating recommendations based on user details')
+                    urls = await recommend(user_details=user_details, languages_topics=languages_topics)
+                except Exception as e:
+                    logger.error(f"Error generating recommendations: {str(e)}")
+                    urls = []
+
+            if not urls:
+                logger.info("No recommendations found")
+                return {'recommendations': [], 'message': 'No recommendations found, please mention more topics or languages'}
+
+            unique_recommendations = process_recommendations(urls, languages_topics)
+
+            if not unique_recommendations:
+                logger.info(f"No recommendations found for user: {username}")
+                return {'recommendations': [], 'message': 'No recommendations found'}
+
+            rec_name = f"Recommendations for {username} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+            rec_id = append_recommendations_to_db(username, unique_recommendations, rec_name)
+            logger.info(f"Recommendations queued for DB with ID: {rec_id}")
+            await cache_new_recommendation(username, rec_id, unique_recommendations)
+
+            # update_daily_limit(username) # updates the daily limit of the user.
+            return {
+                'recommendations': unique_recommendations[:20],
+                'recommendation_id': rec_id
+            }
+
+        if not RESPONSE_CACHE_ENABLED:
+            return await generate()
+        # the profile state (repo pushed_at values) is part of the key, a push invalidates it
+        key = fingerprint("github", languages_topics.get('languages', []), languages_topics.get('topics', []),
+                          user_details, username=current_user["username"])
+        return await response_cache.get_or_compute(key, generate, should_cache=has_recommendations)
     except Exception as e:
         logger.error(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail="An error occurred while generating recommendations")
 
-import json
-
 @app.get('/api/user-recommendations')
 async def get_user_recommendations(username: str = Query(...), current_user: dict = Depends(get_current_user)):
     try:
         if username != current_user["username"]:
             raise HTTPException(status_code=403, detail="Unauthorized access")
 
-        recommendations = app.state.redis.get(f"user_recommendations:{username}")
-        if recommendations:
-            try:
-                recommendations_json = json.loads(recommendations)
-                return recommendations_json
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error: {str(e)}")
-                raise HTTPException(status_code=500, detail="Error decoding JSON from Redis")
-        
-        # Handle case where no data is found
+        cache_key = f"user_recommendations:{username}"
+        cached, = await redis_get_json(cache_key)
+        if cached is not None:
+            return cached
+
+        # Redis missed or is unavailable, read from Mongo
         user_recommendations = await get_user_previous_recommendations(username)
         if not user_recommendations:
             raise HTTPException(status_code=404, detail="No recommendations found for user")
-        
-        # Cache the recommendations
-        app.state.redis.set(f"user_recommendations:{username}", json.dumps(user_recommendations))
+
+        await redis_write({cache_key: user_recommendations}, ttl=USER_RECOMMENDATIONS_CACHE_TTL)
         return user_recommendations
-        
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail="An error occurred while fetching user recommendations")
 
 
-
 @app.get("/api/recommendation/{recommendation_id}")
 async def get_recommendation_by_id(recommendation_id: str):
     try:
-        recommendation = app.state.redis.get(f"recommendation:{recommendation_id}")
-        if recommendation:
-            rec = json.loads(recommendation)
-            return rec
-        
+        cache_key = f"recommendation:{recommendation_id}"
+        cached, = await redis_get_json(cache_key)
+        if cached is not None:
+            return cached
+
+        recommendation = await get_user_recommendation_by_id(recommendation_id)
         if not recommendation:
-            recommendation = await get_user_recommendation_by_id(recommendation_id)
-            if not recommendation:
-                raise HTTPException(status_code=404, detail="Recommendation not found")
-            app.state.redis.set(f"recommendation:{recommendation_id}", json.dumps(recommendation))
-            return recommendation
+            raise HTTPException(status_code=404, detail="Recommendation not found")
+        await redis_write({cache_key: recommendation}, ttl=RECOMMENDATION_CACHE_TTL)
+        return recommendation
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -294,22 +358,31 @@ async def get_recommendations_without_github(request: Request):
 
         username = username + generate_secure_random_string()
         languages_topics = {"languages": languages, "topics": extra_topics} # this should be topics and not extra_topics
-        urls = await recommend(languages_topics=languages_topics)
-
-        if not urls:
-            logger.info("No recommendations found")
-            return {'recommendations': [], 'message': 'No recommendations found, please mention more topics or languages'}
-        
-        unique_recommendations = process_recommendations(urls, languages_topics) #for ranking the recommendations based on the languages_topics
+        schedule_coverage_check(languages, extra_topics)
+
+        async def generate():
+            urls = await recommend(languages_topics=languages_topics)
+            if not urls:
+                return []
+            return process_recommendations(urls, languages_topics) #for ranking the recommendations based on the languages_topics
+
+        if RESPONSE_CACHE_ENABLED:
+            # anonymous requests only depend on what was asked for, they share the ranked list.
+            # The user and the stored recommendation below are per request.
+            key = fingerprint("anonymous", languages, extra_topics)
+            unique_recommendations = await response_cache.get_or_compute(key, generate, should_cache=bool)
+        else:
+            unique_recommendations = await generate()
 
         if not unique_recommendations:
             logger.info(f"No recommendations found for user: {username}")
-            return {'recommendations': [], 'message': 'No recommendations found'}
-        
+            return {'recommendations': [], 'message': 'No recommendations found, please mention more topics or languages'}
+
         await append_user_to_db(username)
         rec_name = f"Recommendations for {username} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
         rec_id = append_recommendations_to_db(username, unique_recommendations, rec_name)
-        logger.info(f"Recommendations saved to DB with ID: {rec_id}")
+        logger.info(f"Recommendations queued for DB with ID: {rec_id}")
+        await cache_new_recommendation(username, rec_id, unique_recommendations)
 
         return {
             'recommendations': unique_recommendations[:20],
@@ -324,6 +397,17 @@ async def get_recommendations_without_github(request: Request):
 async def health_check(request: Request):
     return JSONResponse({"status": "OK"})
 
+@app.get('/api/stats')
+async def stats():
+    cache = get_embedding_cache()
+    return {
+        "embedding_cache": cache.stats() if cache is not None else None,
+        "github_rate_limit": rate_limit_budget(),
+        "response_cache": response_cache.stats(),
+        "recommendation_writer": recommendation_writer.stats(),
+        "repo_catalog": repo_catalog.stats(),
+    }
+
 def generate_secure_random_string(length=7):
     """Generate a secure random string."""
     import string
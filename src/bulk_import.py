@@ -0,0 +1,163 @@
+"""
+Seed the Chroma corpus from a JSONL repository dump without going through the search API.
+
+    python -m src.bulk_import repos.jsonl [--chunk-size 500] [--checkpoint repos.jsonl.checkpoint]
+
+Each line is either a GitHub repository object (REST API / search item shape, or the
+`unique_repos` values built by search.py) or a GitHub Archive event carrying one in its
+payload; `.gz` dumps are read directly. Records are streamed and written in fixed-size
+chunks, after each chunk the byte offset is checkpointed so an interrupted import resumes
+where it stopped.
+"""
+import os
+import json
+import gzip
+import time
+import asyncio
+import logging
+import argparse
+from typing import Iterator, Optional, Tuple
+from .db import get_chromadb_collection, upsert_to_chroma_db, run_chroma
+
+logger = logging.getLogger(__name__)
+
+
+def open_dump(path: str):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def read_records(path: str, offset: int = 0) -> Iterator[Tuple[dict, int]]:
+    """Yield (record, offset just past it) for every JSON line after `offset`"""
+    with open_dump(path) as f:
+        f.seek(offset)
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            offset = f.tell()
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line), offset
+            except json.JSONDecodeError as e:
+                logger.warning(f"Skipping malformed line before offset {offset}: {e}")
+
+
+def find_repository(record: dict) -> Optional[dict]:
+    """The full repository object of a record, unwrapping GitHub Archive events"""
+    if record.get("full_name"):
+        return record
+    payload = record.get("payload") or {}
+    for repo in (payload.get("repository"),
+                 (payload.get("pull_request") or {}).get("base", {}).get("repo")):
+        if repo and repo.get("full_name"):
+            return repo
+    return None
+
+
+def normalize_record(record: dict) -> Optional[Tuple[str, dict]]:
+    """Map a dump record to the (id, repo) shape upsert_to_chroma_db takes"""
+    repo = find_repository(record)
+    if repo is None:
+        return None
+
+    topics = repo.get("topics") or []
+    if isinstance(topics, list):
+        topics = ", ".join(topics)
+    owner = repo.get("owner") or {}
+
+    repo_id = repo["id"] if repo.get("id") is not None else repo["full_name"]
+    return str(repo_id), {
+        "full_name": repo["full_name"],
+        "description": repo.get("description"),
+        "related_language_or_topic": repo.get("related_language_or_topic") or repo.get("language") or "Others",
+        "stargazers_count": repo.get("stargazers_count") or repo.get("watchers_count") or 0,
+        "forks_count": repo.get("forks_count") or 0,
+        "open_issues_count": repo.get("open_issues_count") or 0,
+        "avatar_url": repo.get("avatar_url") or owner.get("avatar_url") or "",
+        "language": repo.get("language") or "Unknown",
+        "updated_at": repo.get("updated_at") or "",
+        "topics": topics,
+    }
+
+
+def read_checkpoint(path: str) -> dict:
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"offset": 0, "rows": 0, "imported": 0}
+
+
+def write_checkpoint(path: str, checkpoint: dict):
+    # write-then-rename, a crash never leaves a half-written checkpoint behind
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+async def bulk_import(path: str,
+                      collection=None,
+                      chunk_size: int = 500,
+                      checkpoint_path: Optional[str] = None,
+                      resume: bool = True) -> dict:
+    """Stream `path` into the collection, returns the final checkpoint"""
+    checkpoint_path = checkpoint_path or path + ".checkpoint"
+    checkpoint = read_checkpoint(checkpoint_path) if resume else {"offset": 0, "rows": 0, "imported": 0}
+    if checkpoint["offset"]:
+        print(f"Resuming {path} at byte {checkpoint['offset']} ({checkpoint['rows']} rows done)")
+
+    if collection is None:
+        collection = await run_chroma(get_chromadb_collection)
+    start = time.perf_counter()
+    rows_this_run = 0
+    chunk = {}
+    chunk_rows = 0
+
+    async def flush(offset):
+        nonlocal chunk, chunk_rows, rows_this_run
+        if chunk:
+            await upsert_to_chroma_db(collection, chunk)
+        checkpoint["offset"] = offset
+        checkpoint["rows"] += chunk_rows
+        checkpoint["imported"] += len(chunk)
+        write_checkpoint(checkpoint_path, checkpoint)
+        rows_this_run += chunk_rows
+        elapsed = time.perf_counter() - start
+        print(f"{checkpoint['rows']} rows read, {checkpoint['imported']} repos imported, "
+              f"{rows_this_run / elapsed if elapsed else 0:.0f} rows/s")
+        chunk, chunk_rows = {}, 0
+
+    offset = checkpoint["offset"]
+    for record, offset in read_records(path, checkpoint["offset"]):
+        chunk_rows += 1
+        normalized = normalize_record(record)
+        if normalized is not None:
+            repo_id, repo = normalized
+            chunk[repo_id] = repo
+        if len(chunk) >= chunk_size:
+            await flush(offset)
+
+    if chunk or chunk_rows:
+        await flush(offset)
+    return checkpoint
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a JSONL repository dump into ChromaDB")
+    parser.add_argument("path", help="JSONL dump, optionally gzipped")
+    parser.add_argument("--chunk-size", type=int, default=500, help="repos embedded and upserted per chunk")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <path>.checkpoint)")
+    parser.add_argument("--no-resume", action="store_true", help="ignore an existing checkpoint")
+    args = parser.parse_args()
+
+    checkpoint = asyncio.run(bulk_import(args.path,
+                                         chunk_size=args.chunk_size,
+                                         checkpoint_path=args.checkpoint,
+                                         resume=not args.no_resume))
+    print(f"Done: {checkpoint['rows']} rows, {checkpoint['imported']} repos imported")
+
+
+if __name__ == "__main__":
+    main()
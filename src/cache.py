@@ -0,0 +1,169 @@
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+from redis import asyncio as aioredis
+from .settings import (
+    REDIS_URL,
+    REDIS_MAX_CONNECTIONS,
+    REDIS_POOL_TIMEOUT,
+    REDIS_SOCKET_TIMEOUT,
+    REDIS_CONNECT_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+_redis = None
+
+
+def init_redis():
+    """
+    Create the process-wide client on a size-bounded connection pool. The API calls this
+    at startup, other entry points get it lazily through get_redis.
+    """
+    global _redis
+    if _redis is None:
+        pool = aioredis.BlockingConnectionPool.from_url(REDIS_URL,
+                                                        max_connections=REDIS_MAX_CONNECTIONS,
+                                                        timeout=REDIS_POOL_TIMEOUT,
+                                                        socket_timeout=REDIS_SOCKET_TIMEOUT,
+                                                        socket_connect_timeout=REDIS_CONNECT_TIMEOUT)
+        _redis = aioredis.Redis(connection_pool=pool)
+    return _redis
+
+
+def get_redis():
+    """Process-wide async Redis client"""
+    return _redis if _redis is not None else init_redis()
+
+
+async def close_redis():
+    global _redis
+    if _redis is not None:
+        await _redis.aclose(close_connection_pool=True)
+        _redis = None
+
+
+async def redis_get_json(*keys: str) -> List[Optional[Any]]:
+    """JSON values of `keys` in one round trip, all None when Redis is unavailable"""
+    try:
+        values = await get_redis().mget(keys)
+    except Exception as e:
+        logger.warning(f"Error reading {keys} from Redis: {e}")
+        return [None] * len(keys)
+
+    decoded = []
+    for key, value in zip(keys, values):
+        try:
+            decoded.append(json.loads(value) if value else None)
+        except json.JSONDecodeError as e:
+            logger.error(f"Ignoring undecodable Redis value at {key}: {e}")
+            decoded.append(None)
+    return decoded
+
+
+async def redis_write(set_json: Optional[dict] = None, delete: Optional[List[str]] = None, ttl: int = 3600) -> bool:
+    """Set JSON values (with a TTL) and delete keys in one pipelined round trip, False if Redis failed"""
+    try:
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for key, value in (set_json or {}).items():
+                pipe.set(key, json.dumps(value), ex=ttl)
+            for key in delete or []:
+                pipe.delete(key)
+            await pipe.execute()
+        return True
+    except Exception as e:
+        logger.warning(f"Error writing to Redis: {e}")
+        return False
+
+
+class TTLCache:
+    """In-process LRU whose entries expire after `ttl` seconds"""
+
+    def __init__(self, ttl: float, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._entries[key] = (time.time() + (ttl or self.ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def items(self) -> List[Tuple[str, Any]]:
+        """The entries that haven't expired, least recently used first"""
+        now = time.time()
+        return [(key, value) for key, (expires_at, value) in self._entries.items() if expires_at >= now]
+
+
+class TieredCache:
+    """
+    JSON values cached in-process and, optionally, in Redis so other workers and
+    later processes can reuse them. Redis failures only cost a cache miss.
+    """
+
+    def __init__(self, prefix: str, ttl: float, use_redis: bool = False, max_entries: int = 10000):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.use_redis = use_redis
+        self.memory = TTLCache(ttl, max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.memory.get(key)
+        if value is None and self.use_redis:
+            try:
+                raw = await get_redis().get(self.prefix + key)
+            except Exception as e:
+                logger.warning(f"Error reading {self.prefix} cache from Redis: {e}")
+                raw = None
+            if raw:
+                value = json.loads(raw)
+                self.memory.set(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: Any):
+        self.memory.set(key, value)
+        if self.use_redis:
+            try:
+                await get_redis().set(self.prefix + key, json.dumps(value), ex=int(self.ttl))
+            except Exception as e:
+                logger.warning(f"Error writing {self.prefix} cache to Redis: {e}")
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class SingleFlight:
+    """Concurrent calls for the same key share one in-flight computation"""
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield so one caller being cancelled doesn't cancel the others
+        return await asyncio.shield(task)
@@ -0,0 +1,81 @@
+"""
+Shared catalog of recommended repositories. Recommendation documents only keep the ordered
+repo ids with their per-recommendation scores; the metadata of each repo is stored once, in
+the `repos` collection keyed on full_name, and hydrated back when a recommendation is read.
+"""
+import logging
+from typing import Any, Dict, List, Tuple
+from pymongo import UpdateOne
+from .cache import TTLCache
+from .settings import REPO_CATALOG_CACHE_SIZE, REPO_CATALOG_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+# fields of a recommended repo that belong to the recommendation rather than the repo
+ENTRY_FIELDS = ("score", "distance")
+
+
+def split_recommendations(recommendations: List[Dict[str, Any]]) -> Tuple[List[dict], Dict[str, dict]]:
+    """The ordered entries ({"repo_id", "score", ...}) and the catalog documents by repo id"""
+    entries, repos = [], {}
+    for rec in recommendations:
+        repo_id = rec.get("full_name")
+        if not repo_id:
+            continue
+        entries.append({"repo_id": repo_id, **{f: rec[f] for f in ENTRY_FIELDS if rec.get(f) is not None}})
+        repos[repo_id] = {key: value for key, value in rec.items() if key not in ENTRY_FIELDS}
+    return entries, repos
+
+
+class RepoCatalog:
+    """The `repos` collection behind an in-process LRU of the hottest repos"""
+
+    def __init__(self, collection, cache_size: int = REPO_CATALOG_CACHE_SIZE,
+                 cache_ttl: float = REPO_CATALOG_CACHE_TTL):
+        self.collection = collection
+        self._cache = TTLCache(cache_ttl, max_entries=cache_size)
+        self.hits = 0
+        self.misses = 0
+
+    async def upsert_many(self, repos: Dict[str, dict]):
+        """Insert or refresh the given repos in one bulk write"""
+        if not repos:
+            return
+        await self.collection.bulk_write(
+            [UpdateOne({"_id": repo_id}, {"$set": repo}, upsert=True) for repo_id, repo in repos.items()],
+            ordered=False)
+        for repo_id, repo in repos.items():
+            self._cache.set(repo_id, repo)
+
+    async def get_many(self, repo_ids: List[str]) -> Dict[str, dict]:
+        """Repos by id from the LRU, the rest in one `$in` query"""
+        found, missing = {}, []
+        for repo_id in dict.fromkeys(repo_ids):
+            repo = self._cache.get(repo_id)
+            if repo is None:
+                missing.append(repo_id)
+            else:
+                found[repo_id] = repo
+        self.hits += len(found)
+        self.misses += len(missing)
+        if missing:
+            async for doc in self.collection.find({"_id": {"$in": missing}}):
+                repo_id = doc.pop("_id")
+                self._cache.set(repo_id, doc)
+                found[repo_id] = doc
+        return found
+
+    async def hydrate(self, entries: List[dict]) -> List[Dict[str, Any]]:
+        """Full repo dicts, in the stored order, with each entry's score"""
+        repos = await self.get_many([entry["repo_id"] for entry in entries])
+        hydrated = []
+        for entry in entries:
+            repo = repos.get(entry["repo_id"])
+            if repo is None:
+                logger.warning(f"Repo {entry['repo_id']} is missing from the catalog")
+                continue
+            hydrated.append({**repo, **{key: value for key, value in entry.items() if key != "repo_id"}})
+        return hydrated
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
@@ -4,16 +4,82 @@ import random
 import os
 import logging
 import asyncio
-from .settings import DEBUG
+import hashlib
+import functools
+import threading
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from .settings import (
+    DEBUG,
+    CHROMA_MAX_WORKERS,
+    CHROMA_GET_BATCH_SIZE,
+    VECTOR_STORE,
+    VECTOR_INDEX_PATH,
+    VECTOR_QUANTIZATION,
+    VECTOR_RESCORE_FACTOR,
+    VECTOR_COLLECTION,
+    VECTOR_ALIAS_REFRESH,
+    EMBEDDING_DIMENSIONS,
+    RECOMMEND_METADATA_FILTER,
+    RANKING_OVERFETCH,
+    MMR_RESULTS,
+    MMR_LAMBDA,
+)
 from typing import List, Optional
 from datetime import datetime, timezone
 from src.models import RepositoryRecommendation, process_recommendations
-from src.oai import generate_embeddings
+from src.embeddings import generate_embeddings_batch, get_embedding_provider
+from src.ranking import diversifies
+from src.vector_index import NumpyClient
 from dotenv import load_dotenv
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# chromadb only ships synchronous clients, so every call is pushed onto this bounded
+# pool instead of blocking the event loop that serves the other requests
+_chroma_executor = ThreadPoolExecutor(max_workers=CHROMA_MAX_WORKERS, thread_name_prefix="chromadb")
+
+
+async def run_chroma(func, *args, **kwargs):
+    """Run a blocking chromadb call on the chroma thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_chroma_executor, functools.partial(func, *args, **kwargs))
+
+
+def query_hits(results: dict):
+    """Per query, the (metadatas, distances, embeddings) lists of a collection.query result"""
+    for i, metadatas in enumerate(results["metadatas"]):
+        embeddings = results.get("embeddings")
+        embeddings = embeddings[i] if embeddings is not None else None
+        if embeddings is None:
+            embeddings = [None] * len(metadatas)
+        yield metadatas, results["distances"][i], embeddings
+
+
+def normalize_term(term: str) -> str:
+    return term.strip().lower()
+
+
+def term_filter(field: str, terms: List[str]) -> List[dict]:
+    """
+    `where` clauses matching `field` against any of `terms` regardless of case: metadata
+    matches are case-sensitive, so repos carry a lowercased `<field>_lower` copy. Repos
+    stored before it existed only match the usual spellings, until they are re-crawled.
+    """
+    lowered = sorted({normalize_term(t) for t in terms if t and t.strip()})
+    variants = sorted({v for t in terms if t and t.strip() for v in (t, t.lower(), t.capitalize())})
+    if not lowered:
+        return []
+    return [{f"{field}_lower": {"$in": lowered}}, {field: {"$in": variants}}]
+
+
+def metadata_filter(terms: List[str]) -> Optional[dict]:
+    """Chroma `where` matching repos written in, or crawled for, one of `terms`"""
+    clauses = term_filter("language", terms) + term_filter("related_language_or_topic", terms)
+    return {"$or": clauses} if clauses else None
+
 
 async def recommend(user_details=None, 
               languages_topics=None,
@@ -22,8 +88,12 @@ async def recommend(user_details=None,
     """Generate recommendations for users based on projects or topics."""
     
     recommendations = []
-    recommended_repos = set()
-    collection = get_chromadb_collection()
+
+    # Collect every query first, then embed them in one batched call and search them in
+    # one collection.query. Each query is (document, number of top results to consider, label).
+    queries = []
+    # languages and topics the results are filtered on, see metadata_filter
+    filter_terms = []
 
     # Get recommendations based on only language_topics if present, otherwise there is no point in collecting the preferred languages and topics
     if languages_topics and (languages_topics['languages'] or languages_topics['topics']):
@@ -32,114 +102,92 @@ async def recommend(user_details=None,
 
         for i, lang in enumerate(languages):
             new_doc = f"{lang} {topics[i]}" if i < len(topics) else lang
-            embeddings = generate_embeddings(new_doc)
-            try:
-                results = collection.query(
-                    query_embeddings=[embeddings],
-                    n_results=5,
-                    include=["metadatas", "distances"]
-                )
-            except DatabaseError as e:
-                logger.error(f"Error querying ChromaDB: {e}")
-                return recommendations
-
-            if results['metadatas'][0]:
-                metadatas = results["metadatas"][0]
-                for metadata in metadatas:
-                    repo_name = metadata.get("full_name")
-                    if '/' in repo_name:
-                        repo_url = f"https://github.com/{repo_name}"
-                        if repo_url not in recommended_repos:
-                            recommendations.append({
-                                "repo_url": repo_url,
-                                "full_name": metadata.get("full_name"),
-                                "description": metadata.get("description"),
-                                "stargazers_count": metadata.get("stargazers_count"),
-                                "forks_count": metadata.get("forks_count"),
-                                "open_issues_count": metadata.get("open_issues_count"),
-                                "avatar_url": metadata.get("avatar_url"),
-                                "language": metadata.get("language"),
-                                "updated_at": metadata.get("updated_at"),
-                                "topics": metadata.get("topics")
-                            })
-                            recommended_repos.add(repo_url)
-                    else:
-                        logger.info("No recommendations found for topics")
+            queries.append((new_doc, 5, f"language {lang}"))
+        filter_terms = languages + topics
     
     # if the languages and topics are not present, we will recommend projects based on user's projects
     if user_details and not (languages_topics['languages'] or languages_topics['topics']):
         for user_proj in user_details:
             new_doc = f"{user_proj['project_name']} : {user_proj['description']}"
-            embeddings = generate_embeddings(new_doc)
-
-            results = collection.query(
-                query_embeddings=[embeddings],
-                n_results=5,
-                include=["metadatas", "distances"]
-            )
-
-            if results['metadatas'][0]:
-                metadatas = results["metadatas"][0]
-
-                for metadata in metadatas[:4]: # considering only the top 4 recommendations
-                    repo_name = metadata.get("full_name")
-                    if '/' in repo_name:
-                        repo_url = f"https://github.com/{repo_name}"
-                        if repo_url not in recommended_repos:
-                            recommendations.append({
-                                "repo_url": repo_url,
-                                "full_name": metadata.get("full_name"),
-                                "description": metadata.get("description"),
-                                "stargazers_count": metadata.get("stargazers_count"),
-                                "forks_count": metadata.get("forks_count"),
-                                "open_issues_count": metadata.get("open_issues_count"),
-                                "avatar_url": metadata.get("avatar_url"),
-                                "language": metadata.get("language"),
-                                "updated_at": metadata.get("updated_at"),
-                                "topics": metadata.get("topics", [])
-                            })
-                            recommended_repos.add(repo_url)
-                    # if len(recommendations) >= max_recommendations:
-                    #     break
-            else:
-                logger.info(f"No recommendations found for project {user_proj['project_name']}")
+            queries.append((new_doc, 4, f"project {user_proj['project_name']}")) # considering only the top 4 recommendations
+            filter_terms += user_proj.get("related_language_or_topic") or []
 
     if _topics and not user_details:
         logger.info(f"Querying ChromaDB for topics: {_topics}")
-        topics_doc = f"{_topics}"
-        embeddings = generate_embeddings(topics_doc)
-
-        results = collection.query(
+        queries.append((f"{_topics}", 8, f"topics {_topics}")) # Get more results to allow for filtering
+        filter_terms = list(_topics) if isinstance(_topics, list) else [_topics]
+
+    if not queries:
+        return recommendations
+
+    collection = await run_chroma(get_chromadb_collection)
+    embeddings = await generate_embeddings_batch([doc for doc, _, _ in queries],
+                                                 provider=collection_embedding_provider(collection))
+    # over-fetch, the re-ranking in process_recommendations picks from a wider pool
+    limits = [limit * RANKING_OVERFETCH for _, limit, _ in queries]
+    n_results = max(limits)
+    where = metadata_filter(filter_terms) if RECOMMEND_METADATA_FILTER else None
+    # candidate embeddings are only read by the MMR stage, don't ship them when it won't run
+    include = ["metadatas", "distances"] + (["embeddings"] if diversifies(MMR_RESULTS, MMR_LAMBDA) else [])
+    try:
+        results = await query_chromadb(
             query_embeddings=embeddings,
-            n_results=8,  # Get more results to allow for filtering
-            include=["metadatas", "documents"]
+            n_results=n_results,
+            include=include,
+            **({"where": where} if where else {})
         )
+        # (metadata, cosine distance, embedding or None) per query
+        hits_per_query = [list(zip(*hits)) for hits in query_hits(results)]
+
+        # the corpus may hold too few repos for a language, top those queries up
+        # with unfiltered results in one more round trip
+        thin = [i for i, (_, limit, _) in enumerate(queries) if len(hits_per_query[i]) < limit]
+        if where and thin:
+            logger.info(f"Filtered results too thin for {len(thin)} queries, falling back to unfiltered")
+            fallback = await query_chromadb(
+                query_embeddings=[embeddings[i] for i in thin],
+                n_results=n_results,
+                include=include
+            )
+            for i, hits in zip(thin, query_hits(fallback)):
+                found = {m.get("full_name") for m, _, _ in hits_per_query[i]}
+                hits_per_query[i] += [hit for hit in zip(*hits) if hit[0].get("full_name") not in found]
+    except DatabaseError as e:
+        logger.error(f"Error querying ChromaDB: {e}")
+        return recommendations
+
+    # fan the per-query results back out in query order, so the de-duplication keeps
+    # the same repos it did when the queries ran one after another
+    by_url = {}
+    for (_, _, label), limit, hits in zip(queries, limits, hits_per_query):
+        if not hits:
+            logger.info(f"No recommendations found for {label}")
+            continue
+
+        for metadata, distance, embedding in hits[:limit]:
+            repo_name = metadata.get("full_name")
+            if '/' in repo_name:
+                repo_url = f"https://github.com/{repo_name}"
+                if repo_url in by_url:
+                    # found by several queries, keep the closest match
+                    by_url[repo_url]["distance"] = min(by_url[repo_url]["distance"], distance)
+                    continue
+                by_url[repo_url] = {
+                    "repo_url": repo_url,
+                    "full_name": metadata.get("full_name"),
+                    "description": metadata.get("description"),
+                    "stargazers_count": metadata.get("stargazers_count"),
+                    "forks_count": metadata.get("forks_count"),
+                    "open_issues_count": metadata.get("open_issues_count"),
+                    "avatar_url": metadata.get("avatar_url"),
+                    "language": metadata.get("language"),
+                    "updated_at": metadata.get("updated_at"),
+                    "topics": metadata.get("topics", []),
+                    "distance": distance,
+                    "embedding": embedding,
+                }
+                recommendations.append(by_url[repo_url])
 
-        logger.info(f"Recommendation results: {results}")
-        if results['metadatas'][0]:
-                metadatas = results["metadatas"][0]
-                for metadata in metadatas:
-                    repo_name = metadata.get("full_name")
-                    if '/' in repo_name:
-                        repo_url = f"https://github.com/{repo_name}"
-                        if repo_url not in recommended_repos:
-                            recommendations.append({
-                                "repo_url": repo_url,
-                                "full_name": metadata.get("full_name"),
-                                "description": metadata.get("description"),
-                                "stargazers_count": metadata.get("stargazers_count"),
-                                "forks_count": metadata.get("forks_count"),
-                                "open_issues_count": metadata.get("open_issues_count"),
-                                "avatar_url": metadata.get("avatar_url"),
-                                "language": metadata.get("language"),
-                                "updated_at": metadata.get("updated_at"),
-                                "topics": metadata.get("topics")
-                            })
-                            recommended_repos.add(repo_url)
-        else:
-            logger.info(f"No recommendations found for project {user_proj['project_name']}")
-
-        
     return recommendations
 
 
@@ -150,7 +198,7 @@ async def get_topic_based_recommendations(user):
     
     # Get recommendations based on topics
     try:
-        urls = await recommend(topics=all_topics)
+        urls = await recommend(_topics=all_topics)
     except Exception as e:
         logger.error(f"Error generating topic-based recommendations: {str(e)}")
         return {'recommendations': [], 'message': 'Error generating recommendations'}
@@ -161,31 +209,169 @@ async def get_topic_based_recommendations(user):
     
 
 
+# The client and collection handle are created once per process and reused by every
+# request; `reset_chromadb` drops them so the next call reconnects. VECTOR_COLLECTION is
+# an alias, re-resolved every VECTOR_ALIAS_REFRESH seconds so a migration can switch
+# every process over to a new collection.
+_chroma_client = None
+_chroma_collection = None
+_chroma_alias_expires = 0.0
+_chroma_lock = threading.Lock()
+
+# the aliases live in the collection-level metadata of this (empty) collection
+ALIAS_COLLECTION = "aliases"
+
+# errors after which the cached client is considered dead
+CHROMA_CONNECTION_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+def _create_chromadb_client():
+    if VECTOR_STORE == "numpy":
+        return NumpyClient(VECTOR_INDEX_PATH, quantization=VECTOR_QUANTIZATION, rescore_factor=VECTOR_RESCORE_FACTOR)
+
+    if DEBUG:
+        print('Using local chromadb')
+        project_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+        db_path = os.path.join(project_dir, "chroma")
+        return chromadb.PersistentClient(path=db_path)
+
+    # docker run -d -p 8000:8000 chromadb/chromadb
+    client = chromadb.HttpClient(host=os.getenv('CHROMA_HOST'), port=8000)
+    # the HTTP client talks through a requests.Session, size its keep-alive pool to the
+    # number of threads that can use it at once. The session is private to chromadb, when
+    # a release moves it the client keeps the pool its settings give it.
+    session = getattr(getattr(client, "_server", None), "_session", None)
+    if not isinstance(session, requests.Session):
+        logger.warning("Can't size the chromadb HTTP pool, keeping chromadb's default")
+        return client
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=CHROMA_MAX_WORKERS)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return client
+
+
+def resolve_collection_alias(client, name: str = VECTOR_COLLECTION) -> str:
+    """The collection `name` currently points to, `name` itself if it is not an alias"""
+    aliases = client.get_or_create_collection(ALIAS_COLLECTION).metadata or {}
+    return aliases.get(name, name)
+
+
+def set_collection_alias(client, name: str, target: str):
+    """Point `name` at the `target` collection, a single metadata write"""
+    aliases = client.get_or_create_collection(ALIAS_COLLECTION)
+    aliases.modify(metadata={**(aliases.metadata or {}), name: target})
+
+
+def open_collection(client, name: str, dimensions: Optional[int] = EMBEDDING_DIMENSIONS):
+    """Open a collection, creating it for `dimensions`-sized embeddings if it doesn't exist"""
+    # get_or_create_collection would overwrite the metadata of an existing collection, and the
+    # HTTP client reports a missing one as a bare Exception, so look it up by name instead
+    # chromadb < 0.6 lists Collection objects, later versions and NumpyClient list names
+    if name in {getattr(collection, "name", collection) for collection in client.list_collections()}:
+        return client.get_collection(name)
+    metadata = {"hnsw:space": "cosine"}
+    if dimensions:
+        metadata["embedding_dimensions"] = dimensions
+    return client.get_or_create_collection(name=name, metadata=metadata)
+
+
+def collection_embedding_provider(collection):
+    """
+    Embed queries in the vector size of the collection they are run against. Collections
+    created before EMBEDDING_DIMENSIONS existed hold the model's full-size vectors.
+    """
+    metadata = getattr(collection, "metadata", None) or {}
+    return get_embedding_provider(metadata.get("embedding_dimensions"))
+
+
 def get_chromadb_collection():
+    global _chroma_client, _chroma_collection, _chroma_alias_expires
+    if _chroma_collection is not None and time.monotonic() < _chroma_alias_expires:
+        return _chroma_collection
+
+    with _chroma_lock:
+        if _chroma_collection is None or time.monotonic() >= _chroma_alias_expires:
+            try:
+                client = _chroma_client or _create_chromadb_client()
+                target = resolve_collection_alias(client)
+                if _chroma_collection is None or _chroma_collection.name != target:
+                    _chroma_collection = open_collection(client, target)
+                    logger.info(f"Using collection {target} for {VECTOR_COLLECTION}")
+                _chroma_client = client
+                _chroma_alias_expires = time.monotonic() + VECTOR_ALIAS_REFRESH
+            except DatabaseError as e:
+                raise DatabaseError(f"Error in getting collection: {e}")
+            except Exception as e:
+                if _chroma_collection is None:
+                    raise
+                # keep serving from the collection we have, query_chromadb handles dead connections
+                logger.warning(f"Error resolving the {VECTOR_COLLECTION} alias: {e}")
+                _chroma_alias_expires = time.monotonic() + VECTOR_ALIAS_REFRESH
+    return _chroma_collection
+
+
+def reset_chromadb():
+    """Drop the cached client and collection, the next call builds a new connection"""
+    global _chroma_client, _chroma_collection, _chroma_alias_expires
+    with _chroma_lock:
+        session = getattr(getattr(_chroma_client, "_server", None), "_session", None)
+        if session is not None:
+            session.close()
+        _chroma_client = None
+        _chroma_collection = None
+        _chroma_alias_expires = 0.0
+
+
+def init_chromadb():
+    """Connect at startup so the first request doesn't pay for it"""
     try:
-        if DEBUG:
-            print('Using local chromadb')
-            project_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-            db_path = os.path.join(project_dir, "chroma")
-            client = chromadb.PersistentClient(path=db_path)
-        else:
-            # docker run -d -p 8000:8000 chromadb/chromadb
-            client = chromadb.HttpClient(host=os.getenv('CHROMA_HOST'), port=8000)
-            
-        collection = client.get_or_create_collection(name="projects",
-                                                     metadata={"hnsw:space": "cosine"})
-        return collection
-    except DatabaseError as e:
-        raise DatabaseError(f"Error in getting collection: {e}")
+        get_chromadb_collection()
+        logger.info("Connected to ChromaDB")
+    except Exception as e:
+        # the server may not be up yet, requests will retry the connection
+        logger.error(f"Error connecting to ChromaDB: {e}")
 
 
+def close_chromadb():
+    reset_chromadb()
 
-def upsert_to_chroma_db(collection, unique_repos):
+
+async def query_chromadb(**kwargs):
+    """Query the shared collection, reconnecting once if the connection went away"""
+    collection = await run_chroma(get_chromadb_collection)
+    try:
+        return await run_chroma(collection.query, **kwargs)
+    except CHROMA_CONNECTION_ERRORS as e:
+        logger.warning(f"ChromaDB connection failed ({e}), reconnecting")
+        reset_chromadb()
+        collection = await run_chroma(get_chromadb_collection)
+        return await run_chroma(collection.query, **kwargs)
+
+
+def content_hash(document: str) -> str:
+    """Fingerprint of the embedded text, stored with each repo to detect changes"""
+    return hashlib.sha256(document.encode("utf-8")).hexdigest()
+
+
+async def get_existing_metadatas(collection, ids):
+    """Fetch the stored metadata of the ids already in the collection, in bulk"""
+    existing = {}
+    for i in range(0, len(ids), CHROMA_GET_BATCH_SIZE):
+        result = await run_chroma(collection.get, ids=ids[i:i + CHROMA_GET_BATCH_SIZE], include=["metadatas"])
+        existing.update(zip(result["ids"], result["metadatas"]))
+    return existing
+
+
+async def upsert_to_chroma_db(collection, unique_repos, incremental=True):
+    """
+    Write repositories to the collection. In incremental mode only repos whose document
+    (full_name, description, topics) changed are re-embedded; repos where only the metadata
+    (stars, forks, updated_at, ...) changed get a metadata-only update.
+    """
     # Prepare lists to hold data for upsert
     ids = []
     documents = []
     metadatas = []
-    embeddings = []
     
     for repo_id, repo_data in unique_repos.items():
         # Extract data from repo_data with default values or handling None
@@ -216,31 +402,54 @@ def upsert_to_chroma_db(collection, unique_repos):
             "full_name": str(full_name),
             "description": str(description),
             "related_language_or_topic": str(related_language_or_topic),
+            "related_language_or_topic_lower": normalize_term(str(related_language_or_topic)),
             "stargazers_count": int(stargazers_count),
             "forks_count": int(forks_count),
             "open_issues_count": int(open_issues_count),
             "avatar_url": str(avatar_url),
             "language": str(language),
+            "language_lower": normalize_term(str(language)),
             "updated_at": str(updated_at),
-            "topics": str(topics)
+            "topics": str(topics),
+            "content_hash": content_hash(document)
         }
         
         # Add metadata to the list
         metadatas.append(metadata)
-        embed_doc = generate_embeddings(document)
-        embeddings.append(embed_doc)
-    
+
     try:
-        # Upsert data to the collection
-        if ids:
-            collection.add(
-                ids=ids,
+        existing = await get_existing_metadatas(collection, ids) if incremental and ids else {}
+
+        to_embed = []   # new repos or repos whose document changed
+        to_update = []  # same document, only the metadata changed
+        for i, repo_id in enumerate(ids):
+            stored = existing.get(repo_id)
+            if stored is None or stored.get("content_hash") != metadatas[i]["content_hash"]:
+                to_embed.append(i)
+            elif stored != metadatas[i]:
+                to_update.append(i)
+
+        if to_embed:
+            # embed the documents in a few batched requests instead of one call per repo
+            embeddings = await generate_embeddings_batch([documents[i] for i in to_embed],
+                                                         provider=collection_embedding_provider(collection))
+            await run_chroma(
+                collection.upsert,
+                ids=[ids[i] for i in to_embed],
                 embeddings=embeddings,
-                documents=documents,
-                metadatas=metadatas
+                documents=[documents[i] for i in to_embed],
+                metadatas=[metadatas[i] for i in to_embed]
+            )
+
+        if to_update:
+            await run_chroma(
+                collection.update,
+                ids=[ids[i] for i in to_update],
+                metadatas=[metadatas[i] for i in to_update]
             )
         
-        print(f"Upserted {len(ids)} repositories to ChromaDB")
+        print(f"Upserted {len(ids)} repositories to ChromaDB: {len(to_embed)} embedded, "
+              f"{len(to_update)} metadata-only, {len(ids) - len(to_embed) - len(to_update)} unchanged")
         return collection
     
     except ValueError as ve:
@@ -0,0 +1,208 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+from .settings import (
+    EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MEMORY_ITEMS,
+    EMBEDDING_CACHE_MAX_BYTES,
+)
+
+logger = logging.getLogger(__name__)
+
+# stay well below SQLite's limit on host parameters per statement
+SQL_BATCH_SIZE = 500
+# disk hits whose last_used update is deferred before they are written on their own
+TOUCH_BATCH_SIZE = 1000
+
+
+def cache_key(model: str, text: str) -> str:
+    """Content address of an embedding: the same text embedded by the same model maps to the same key"""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache.
+
+    A hot in-process LRU sits in front of a SQLite file that stores the vectors as
+    float32 blobs. The disk tier is evicted least-recently-used once it grows past
+    `max_bytes`. The file may be shared by several processes: its size is always read
+    from the database, and reads only record their `last_used` touches, which are
+    written with the next write or once TOUCH_BATCH_SIZE of them are waiting.
+    """
+
+    def __init__(self,
+                 path: Optional[str] = EMBEDDING_CACHE_PATH,
+                 max_memory_items: int = EMBEDDING_CACHE_MEMORY_ITEMS,
+                 max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        self.max_memory_items = max_memory_items
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._conn = None
+        # size of the disk tier when this process last looked, for stats()
+        self._disk_bytes = 0
+        # key -> last_used of disk hits not written back yet
+        self._touched = {}
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._conn.commit()
+            self._disk_bytes = self._size()
+
+    def _size(self) -> int:
+        """Bytes of vectors in the disk tier, across every process writing to it"""
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def _write_touches(self):
+        """Write the deferred last_used updates, inside the caller's transaction"""
+        if self._touched:
+            self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                   [(used, key) for key, used in self._touched.items()])
+            self._touched.clear()
+
+    def _remember(self, key: str, vector: List[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        """Return the cached vectors for the keys that are present"""
+        found = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                    self.memory_hits += 1
+                else:
+                    missing.append(key)
+
+            if missing and self._conn is not None:
+                rows = []
+                for i in range(0, len(missing), SQL_BATCH_SIZE):
+                    batch = missing[i:i + SQL_BATCH_SIZE]
+                    rows += self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                    ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32).tolist()
+                    found[key] = vector
+                    self._remember(key, vector)
+                self.disk_hits += len(rows)
+                now = time.time()
+                self._touched.update((key, now) for key, _ in rows)
+                if len(self._touched) >= TOUCH_BATCH_SIZE:
+                    try:
+                        self._commit(self._write_touches)
+                    except sqlite3.Error as e:
+                        # recency is best effort, the vectors were read fine
+                        logger.warning(f"Error writing embedding cache touches: {e}")
+                        self._touched.clear()
+
+            self.misses += sum(1 for key in missing if key not in found)
+        return found
+
+    def set_many(self, items: Dict[str, List[float]]):
+        """Store vectors in both tiers"""
+        if not items:
+            return
+        with self._lock:
+            for key, vector in items.items():
+                self._remember(key, vector)
+
+            if self._conn is None:
+                return
+            now = time.time()
+            rows = []
+            for key, vector in items.items():
+                blob = np.asarray(vector, dtype=np.float32).tobytes()
+                rows.append((key, blob, len(blob), now))
+
+            def write():
+                self._write_touches()
+                self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+                self._evict()
+            self._commit(write)
+
+    def _commit(self, write):
+        """Run `write` in one transaction, rolled back if any statement fails"""
+        try:
+            write()
+            self._conn.commit()
+        except sqlite3.Error:
+            self._conn.rollback()
+            raise
+
+    def _evict(self):
+        """Drop least-recently-used rows until the disk tier is back under 90% of its budget"""
+        # read inside the write transaction, so other processes' rows are counted
+        self._disk_bytes = self._size()
+        if self._disk_bytes <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        cursor = self._conn.execute("SELECT key, size FROM embeddings ORDER BY last_used ASC")
+        evicted = []
+        for key, size in cursor:
+            if self._disk_bytes <= target:
+                break
+            evicted.append((key,))
+            self._disk_bytes -= size
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+        self.evictions += len(evicted)
+        logger.info(f"Evicted {len(evicted)} embeddings from the disk cache")
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "memory_items": len(self._memory),
+            "disk_bytes": self._disk_bytes,
+        }
+
+    def close(self):
+        if self._conn is not None:
+            with self._lock:
+                try:
+                    self._commit(self._write_touches)
+                except sqlite3.Error as e:
+                    logger.warning(f"Error writing embedding cache touches: {e}")
+            self._conn.close()
+            self._conn = None
+
+
+_embedding_cache = None
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Process-wide embedding cache, or None when caching is disabled"""
+    global _embedding_cache
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
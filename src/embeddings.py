@@ -0,0 +1,157 @@
+import re
+import abc
+import zlib
+import asyncio
+import logging
+import numpy as np
+from typing import List, Optional
+from .embedding_cache import cache_key, get_embedding_cache
+from .settings import EMBEDDING_PROVIDER, HASHING_EMBEDDING_DIMENSIONS
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingProvider(abc.ABC):
+    """
+    Turns texts into vectors. `model` identifies the vector space (it is part of the
+    embedding cache key) and the limits describe how large one `embed_chunk` call may be.
+    """
+    model = ""
+    max_inputs = 16
+    max_tokens = 8000
+    max_concurrency = 4
+    cacheable = True
+
+    @abc.abstractmethod
+    async def embed_chunk(self, chunk: List[str]) -> List[List[float]]:
+        """Vectors for the texts of one chunk, in order"""
+
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9#+]+")
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    In-process CPU embedder: signed feature hashing of word unigrams and bigrams with
+    sublinear term frequency, L2-normalized. Deterministic and needs no network, which
+    also makes it the embedder for tests and benchmarks.
+    """
+    max_inputs = 1024
+    max_tokens = 10 ** 9
+    max_concurrency = 1
+    cacheable = False # recomputing is cheaper than a cache lookup
+
+    def __init__(self, dimensions: int = HASHING_EMBEDDING_DIMENSIONS):
+        self.dimensions = dimensions
+        self.model = f"hashing-{dimensions}"
+
+    @staticmethod
+    def features(text: str) -> List[str]:
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        rows, cols, signs = [], [], []
+        for i, text in enumerate(texts):
+            for feature in self.features(text):
+                # crc32 rather than hash(), which is salted per process
+                h = zlib.crc32(feature.encode("utf-8"))
+                rows.append(i)
+                cols.append((h >> 1) % self.dimensions)
+                signs.append(1.0 if h & 1 else -1.0)
+
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        np.add.at(matrix, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)),
+                  np.array(signs, dtype=np.float32))
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    async def embed_chunk(self, chunk: List[str]) -> List[List[float]]:
+        # CPU-bound, keep it off the event loop
+        matrix = await asyncio.to_thread(self.embed_texts, chunk)
+        return matrix.tolist()
+
+
+_providers = {}
+
+
+def get_embedding_provider(dimensions: Optional[int] = None) -> EmbeddingProvider:
+    """
+    Process-wide provider selected by EMBEDDING_PROVIDER (azure or hashing), producing
+    `dimensions`-sized vectors, or the model's own size when None. EMBEDDING_DIMENSIONS only
+    sizes new collections, queries use the size of the collection they run against.
+    """
+    if dimensions not in _providers:
+        if EMBEDDING_PROVIDER == "hashing":
+            _providers[dimensions] = HashingEmbeddingProvider(dimensions or HASHING_EMBEDDING_DIMENSIONS)
+        else:
+            # imported here so offline deployments don't need Azure credentials
+            from .oai import AzureEmbeddingProvider
+            _providers[dimensions] = AzureEmbeddingProvider(dimensions=dimensions)
+    return _providers[dimensions]
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap upper-bound token estimate (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def chunk_inputs(texts: List[str], max_inputs: int, max_tokens: int) -> List[List[str]]:
+    """Split texts into consecutive chunks that fit the per-request input and token limits"""
+    chunks = []
+    chunk, chunk_tokens = [], 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if chunk and (len(chunk) >= max_inputs or chunk_tokens + tokens > max_tokens):
+            chunks.append(chunk)
+            chunk, chunk_tokens = [], 0
+        chunk.append(text)
+        chunk_tokens += tokens
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+async def generate_embeddings_batch(texts: List[str], provider: EmbeddingProvider = None) -> List[List[float]]:
+    """Generate embeddings for many texts, a few chunks in flight at once. Output order matches `texts`."""
+    if not texts:
+        return []
+
+    provider = provider or get_embedding_provider()
+    cache = get_embedding_cache() if provider.cacheable else None
+    keys = [cache_key(provider.model, text) for text in texts]
+    embeddings_by_key = {}
+    if cache is not None:
+        # the disk tier is SQLite, keep it off the event loop. The cache only saves calls:
+        # when it fails (e.g. `database is locked`) every text is embedded
+        try:
+            embeddings_by_key = await asyncio.to_thread(cache.get_many, set(keys))
+        except Exception as e:
+            logger.warning(f"Error reading the embedding cache: {e}")
+
+    # only the distinct texts that are not cached get embedded
+    pending = {}
+    for key, text in zip(keys, texts):
+        if key not in embeddings_by_key:
+            pending.setdefault(key, text)
+
+    if pending:
+        chunks = chunk_inputs(list(pending.values()), provider.max_inputs, provider.max_tokens)
+        logger.info(f"Embedding {len(pending)} of {len(texts)} texts in {len(chunks)} chunks with {provider.model}")
+        semaphore = asyncio.Semaphore(provider.max_concurrency)
+
+        async def embed(chunk):
+            async with semaphore:
+                return await provider.embed_chunk(chunk)
+
+        results = await asyncio.gather(*(embed(chunk) for chunk in chunks))
+        new_embeddings = dict(zip(pending, (e for chunk_embeddings in results for e in chunk_embeddings)))
+        if cache is not None:
+            try:
+                await asyncio.to_thread(cache.set_many, new_embeddings)
+            except Exception as e:
+                logger.warning(f"Error writing the embedding cache: {e}")
+        embeddings_by_key.update(new_embeddings)
+
+    return [embeddings_by_key[key] for key in keys]
@@ -0,0 +1,186 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from typing import List, Optional
+from dotenv import load_dotenv
+from . import search
+from .cache import TTLCache, get_redis
+from .db import get_chromadb_collection, normalize_term, run_chroma, term_filter
+from .settings import (
+    INGESTION_QUEUE_BACKEND,
+    INGESTION_QUEUE_NAME,
+    INGESTION_MIN_COVERAGE,
+    INGESTION_DEDUPE_TTL,
+)
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+GPAT = os.getenv('GPAT')
+
+
+def job_id(job: dict) -> str:
+    terms = sorted(t.lower() for t in job.get("languages", []) + job.get("topics", []))
+    return hashlib.sha256(json.dumps(terms).encode()).hexdigest()
+
+
+class LocalJobQueue:
+    """In-process stand-in for the Redis queue, consumed by a worker task in the API process"""
+
+    def __init__(self):
+        self._queue = asyncio.Queue()
+        self._recent = TTLCache(INGESTION_DEDUPE_TTL)
+        # workers running on this queue, without one jobs would only pile up
+        self.consumers = 0
+
+    async def enqueue(self, job: dict) -> bool:
+        key = job_id(job)
+        if self._recent.get(key):
+            return False
+        self._recent.set(key, True)
+        self._queue.put_nowait(job)
+        return True
+
+    async def dequeue(self, timeout: float = 5) -> Optional[dict]:
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class RedisJobQueue:
+    """Crawl jobs in a Redis list, any number of worker processes can consume it"""
+
+    def __init__(self, name: str = INGESTION_QUEUE_NAME):
+        self.name = name
+
+    async def enqueue(self, job: dict) -> bool:
+        redis = get_redis()
+        # the same crawl asked for by many requests is only queued once per TTL
+        if not await redis.set(f"{self.name}:dedupe:{job_id(job)}", 1, nx=True, ex=INGESTION_DEDUPE_TTL):
+            return False
+        await redis.lpush(self.name, json.dumps(job))
+        return True
+
+    async def dequeue(self, timeout: float = 5) -> Optional[dict]:
+        item = await get_redis().brpop(self.name, timeout=timeout)
+        return json.loads(item[1]) if item else None
+
+
+_job_queue = None
+
+
+def get_job_queue():
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = RedisJobQueue() if INGESTION_QUEUE_BACKEND == "redis" else LocalJobQueue()
+    return _job_queue
+
+
+# terms checked recently are not counted again on every request
+_coverage_checked = TTLCache(INGESTION_DEDUPE_TTL)
+
+
+async def count_covered(collection, term: str) -> int:
+    """How many repos (up to INGESTION_MIN_COVERAGE) were crawled for a language or topic"""
+    clauses = term_filter("related_language_or_topic", [term])
+    if not clauses:
+        # nothing to crawl for a blank term, and Chroma rejects an empty $or
+        return INGESTION_MIN_COVERAGE
+    result = await run_chroma(collection.get, where={"$or": clauses}, limit=INGESTION_MIN_COVERAGE, include=[])
+    return len(result["ids"])
+
+
+async def enqueue_if_poorly_covered(languages: List[str], topics: List[str]) -> Optional[dict]:
+    """Queue a crawl for the languages and topics that have too few repos in the collection"""
+    queue = get_job_queue()
+    if isinstance(queue, LocalJobQueue) and not queue.consumers:
+        # the local queue is only consumed by a worker in this process (needs GPAT)
+        return None
+
+    collection = await run_chroma(get_chromadb_collection)
+    job = {"languages": [], "topics": []}
+    for kind, terms in (("languages", languages), ("topics", topics)):
+        for term in terms:
+            term = (term or "").strip()
+            if not term or _coverage_checked.get(normalize_term(term)):
+                continue
+            if await count_covered(collection, term) < INGESTION_MIN_COVERAGE:
+                job[kind].append(term)
+            else:
+                _coverage_checked.set(normalize_term(term), True)
+
+    if not (job["languages"] or job["topics"]):
+        return None
+    # poorly covered terms are only marked once their crawl is queued, a failed check or
+    # enqueue is retried by the next request instead of waiting out the TTL
+    queued = await queue.enqueue(job)
+    for term in job["languages"] + job["topics"]:
+        _coverage_checked.set(normalize_term(term), True)
+    if queued:
+        logger.info(f"Queued crawl job for poorly covered terms: {job}")
+        return job
+    return None
+
+
+_background_tasks = set()
+
+
+def schedule_coverage_check(languages: List[str], topics: List[str]):
+    """Run the coverage check after the response, the request never waits on it"""
+    async def check():
+        try:
+            await enqueue_if_poorly_covered(languages or [], topics or [])
+        except Exception as e:
+            logger.error(f"Error checking corpus coverage: {e}")
+
+    task = asyncio.create_task(check())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def process_job(job: dict, access_token: str = None):
+    """Crawl, embed and upsert the repos for one job"""
+    logger.info(f"Crawling {job}")
+    await search.main({"languages": job.get("languages", [])},
+                      access_token=access_token or GPAT,
+                      extra_topics=job.get("topics", []))
+
+
+async def run_worker(queue=None, access_token: str = None, stop: asyncio.Event = None,
+                     poll_interval: float = 5):
+    """Consume crawl jobs until `stop` is set"""
+    queue = queue or get_job_queue()
+    stop = stop or asyncio.Event()
+    if isinstance(queue, LocalJobQueue):
+        queue.consumers += 1
+    try:
+        await _consume(queue, access_token, stop, poll_interval)
+    finally:
+        if isinstance(queue, LocalJobQueue):
+            queue.consumers -= 1
+
+
+async def _consume(queue, access_token: str, stop: asyncio.Event, poll_interval: float):
+    while not stop.is_set():
+        try:
+            job = await queue.dequeue(timeout=poll_interval)
+        except Exception as e:
+            logger.error(f"Error reading the ingestion queue: {e}")
+            await asyncio.sleep(5)
+            continue
+        if job is None:
+            continue
+        try:
+            await process_job(job, access_token)
+        except Exception as e:
+            logger.error(f"Error processing crawl job {job}: {e}")
+
+
+if __name__ == '__main__':
+    # python -m src.ingestion, start more processes to crawl faster
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_worker())
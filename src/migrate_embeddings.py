@@ -0,0 +1,139 @@
+"""
+Copy the repository collection to a new embedding size and switch VECTOR_COLLECTION to it.
+
+    python -m src.migrate_embeddings --dimensions 512 [--method truncate|reembed] [--no-switch] [--drop-old]
+
+`truncate` keeps the first N components of the stored vectors and re-normalizes them.
+text-embedding-3 models are trained so that this is what the API itself returns for
+`dimensions=N`, so nothing is re-embedded. `reembed` embeds every stored document again
+at the new size (the hashing provider, or models without shortened outputs).
+
+The copy goes to a new collection; the alias is only switched once it is complete, and
+queries follow the collection's size from then on. Before switching, the stored documents
+are used as sample queries against both collections and the overlap of their top-k
+results is reported.
+"""
+import time
+import asyncio
+import logging
+import argparse
+import numpy as np
+from typing import List
+from .db import (
+    _create_chromadb_client,
+    collection_embedding_provider,
+    open_collection,
+    resolve_collection_alias,
+    run_chroma,
+    set_collection_alias,
+)
+from .embeddings import generate_embeddings_batch, get_embedding_provider
+from .settings import EMBEDDING_MODEL, EMBEDDING_PROVIDER, VECTOR_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+
+def truncate(embeddings: np.ndarray, dimensions: int) -> np.ndarray:
+    shortened = embeddings[:, :dimensions]
+    norms = np.linalg.norm(shortened, axis=1, keepdims=True)
+    return shortened / np.maximum(norms, 1e-12)
+
+
+async def copy_collection(source, target, dimensions: int, method: str, batch_size: int = 500) -> int:
+    """Write every repo of `source` into `target` with `dimensions`-sized embeddings"""
+    provider = get_embedding_provider(dimensions)
+    offset = 0
+    while True:
+        batch = await run_chroma(source.get, limit=batch_size, offset=offset,
+                                 include=["embeddings", "documents", "metadatas"])
+        if not batch["ids"]:
+            break
+        if method == "truncate":
+            embeddings = truncate(np.asarray(batch["embeddings"], dtype=np.float32), dimensions).tolist()
+        else:
+            embeddings = await generate_embeddings_batch(batch["documents"], provider=provider)
+        await run_chroma(target.upsert, ids=batch["ids"], embeddings=embeddings,
+                         documents=batch["documents"], metadatas=batch["metadatas"])
+        offset += len(batch["ids"])
+        print(f"{offset} repos copied")
+    return offset
+
+
+async def top_ids(collection, documents: List[str], k: int, provider) -> List[List[str]]:
+    embeddings = await generate_embeddings_batch(documents, provider=provider)
+    results = await run_chroma(collection.query, query_embeddings=embeddings, n_results=k, include=["distances"])
+    return results["ids"]
+
+
+async def ranking_overlap(source, target, sample_size: int = 200, k: int = 10) -> dict:
+    """Mean and worst-case overlap of the top-k results of the two collections for sample queries"""
+    sample = await run_chroma(source.get, limit=sample_size, include=["documents", "embeddings"])
+    documents = [d for d in sample["documents"] if d]
+    if not documents:
+        return {"queries": 0}
+
+    # collections created before EMBEDDING_DIMENSIONS existed don't record their size
+    source_dimensions = (source.metadata or {}).get("embedding_dimensions") or len(sample["embeddings"][0])
+    before = await top_ids(source, documents, k, get_embedding_provider(source_dimensions))
+    after = await top_ids(target, documents, k, collection_embedding_provider(target))
+    overlaps = [len(set(a) & set(b)) / len(a) for a, b in zip(before, after) if a]
+    top1 = [a[0] == b[0] for a, b in zip(before, after) if a and b]
+    return {
+        "queries": len(overlaps),
+        f"overlap@{k}": float(np.mean(overlaps)),
+        f"min_overlap@{k}": float(np.min(overlaps)),
+        "top1_agreement": float(np.mean(top1)) if top1 else 0.0,
+    }
+
+
+async def migrate(dimensions: int,
+                  method: str = "truncate",
+                  batch_size: int = 500,
+                  sample_size: int = 200,
+                  switch: bool = True,
+                  drop_old: bool = False,
+                  client=None) -> dict:
+    if method == "truncate" and not (EMBEDDING_PROVIDER == "azure" and EMBEDDING_MODEL.startswith("text-embedding-3")):
+        raise ValueError("truncate only preserves meaning for text-embedding-3 vectors, use --method reembed")
+
+    client = client or await run_chroma(_create_chromadb_client)
+    source_name = await run_chroma(resolve_collection_alias, client)
+    source = await run_chroma(client.get_collection, source_name)
+    target_name = f"{VECTOR_COLLECTION}-{dimensions}d-{int(time.time())}"
+    target = await run_chroma(open_collection, client, target_name, dimensions)
+    print(f"Migrating {source_name} into {target_name} ({method}, {dimensions} dimensions)")
+
+    copied = await copy_collection(source, target, dimensions, method, batch_size)
+    report = {"source": source_name, "target": target_name, "repos": copied,
+              **await ranking_overlap(source, target, sample_size)}
+    print(f"Ranking change: {report}")
+
+    if switch:
+        await run_chroma(set_collection_alias, client, VECTOR_COLLECTION, target_name)
+        print(f"{VECTOR_COLLECTION} now points to {target_name}")
+        if drop_old:
+            await run_chroma(client.delete_collection, source_name)
+            print(f"Deleted {source_name}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-index the repository collection at another embedding size")
+    parser.add_argument("--dimensions", type=int, required=True)
+    parser.add_argument("--method", choices=["truncate", "reembed"], default="truncate")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--sample-size", type=int, default=200, help="documents used to compare rankings")
+    parser.add_argument("--no-switch", action="store_true", help="build and evaluate without switching the alias")
+    parser.add_argument("--drop-old", action="store_true", help="delete the old collection after switching")
+    args = parser.parse_args()
+
+    asyncio.run(migrate(args.dimensions,
+                        method=args.method,
+                        batch_size=args.batch_size,
+                        sample_size=args.sample_size,
+                        switch=not args.no_switch,
+                        drop_old=args.drop_old))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Move the repo metadata embedded in stored recommendations to the shared `repos` catalog.
+
+    python -m src.migrate_recommendations [--batch-size 500] [--dry-run]
+
+Documents still holding full repo dicts in `recommendations` are rewritten to ordered
+`repos` entries (repo id plus score), after their repos were upserted into the catalog.
+Reads handle both shapes, so the API can keep serving while this runs, and an interrupted
+run is resumed by running it again: migrated documents no longer match.
+"""
+import asyncio
+import logging
+import argparse
+from typing import List
+from pymongo import UpdateOne
+from .catalog import RepoCatalog, split_recommendations
+from .models import db, repo_catalog
+
+logger = logging.getLogger(__name__)
+
+LEGACY = {"recommendations": {"$exists": True}}
+
+
+async def migrate_batch(documents: List[dict], recommendations, catalog: RepoCatalog, dry_run: bool = False) -> dict:
+    requests, repos, embedded = [], {}, 0
+    for doc in documents:
+        entries, recommended = split_recommendations(doc.get("recommendations") or [])
+        embedded += len(doc.get("recommendations") or [])
+        repos.update(recommended)
+        # the filter skips a document another run migrated in the meantime
+        requests.append(UpdateOne({"_id": doc["_id"], **LEGACY},
+                                  {"$set": {"repos": entries}, "$unset": {"recommendations": ""}}))
+    if not dry_run:
+        await catalog.upsert_many(repos)
+        await recommendations.bulk_write(requests, ordered=False)
+    return {"documents": len(documents), "embedded": embedded, "repos": set(repos)}
+
+
+async def migrate(batch_size: int = 500, dry_run: bool = False, recommendations=None,
+                  catalog: RepoCatalog = None) -> dict:
+    recommendations = recommendations if recommendations is not None else db['recommendations']
+    catalog = catalog or repo_catalog
+
+    documents, embedded, repos = 0, 0, set()
+    batch = []
+
+    async def flush():
+        nonlocal documents, embedded
+        result = await migrate_batch(batch, recommendations, catalog, dry_run)
+        documents += result["documents"]
+        embedded += result["embedded"]
+        repos.update(result["repos"])
+        logger.info(f"Migrated {documents} recommendations, {len(repos)} distinct repos so far")
+        batch.clear()
+
+    async for doc in recommendations.find(LEGACY, batch_size=batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+
+    report = {"documents": documents, "embedded_repos": embedded, "catalog_repos": len(repos), "dry_run": dry_run}
+    logger.info(f"Recommendation migration: {report}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move embedded repo metadata to the repos catalog")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be migrated")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(asyncio.run(migrate(batch_size=args.batch_size, dry_run=args.dry_run)))
+
+
+if __name__ == "__main__":
+    main()
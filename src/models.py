@@ -1,12 +1,24 @@
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
 from datetime import datetime, timedelta
 import os
 import uuid
 import logging
 import asyncio
 from dotenv import load_dotenv
+from .ranking import rank, diversify
+from .catalog import RepoCatalog, split_recommendations
+from .cache import redis_write
+from .settings import (
+    RECOMMENDATION_WRITE_BATCH_SIZE,
+    RECOMMENDATION_WRITE_INTERVAL,
+    RECOMMENDATION_WRITE_RETRIES,
+    RECOMMENDATION_WRITE_JOURNAL,
+)
 from datetime import datetime, timedelta
 load_dotenv()
 
@@ -92,59 +104,175 @@ class RepositoryRecommendation(BaseModel):
     topics: str
 
 
-def append_recommendations_to_db(username, recommendations, recommendation_name):
-    try:
-        user_recommenations_coll = db['user_recommendations']
-        recommendations_collection = db['recommendations']
+class RecommendationWriter:
+    """
+    Write-behind persistence of generated recommendations. Requests enqueue a record and get
+    its id back at once; a background task writes batches, the repos of every recommendation
+    to the catalog in one bulk_write, the recommendations in one insert_many and every user's
+    new refs in one bulk_write, once `batch_size` records wait or every `interval` seconds.
+    A record stays in `pending`, and readable, until Mongo acknowledged all three writes.
+    """
 
-    except Exception as e:
-        logger.error(f"Failed to fetch recommendations from DB: {str(e)}")
-        raise ValueError("Failed to fetch recommendations from DB")
-    
-    recommendation_id = str(uuid.uuid4())
-    try:
-        recommendations_collection.insert_one({
+    def __init__(self, batch_size: int = RECOMMENDATION_WRITE_BATCH_SIZE,
+                 interval: float = RECOMMENDATION_WRITE_INTERVAL,
+                 max_retries: int = RECOMMENDATION_WRITE_RETRIES,
+                 journal: bool = RECOMMENDATION_WRITE_JOURNAL,
+                 recommendations=None, user_recommendations=None, catalog: RepoCatalog = None):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_retries = max_retries
+        write_concern = WriteConcern(w=1, j=True) if journal else WriteConcern(w=1)
+        if recommendations is None:
+            recommendations = db['recommendations']
+        if user_recommendations is None:
+            user_recommendations = db['user_recommendations']
+        self._recommendations = recommendations.with_options(write_concern=write_concern)
+        self._user_recommendations = user_recommendations.with_options(write_concern=write_concern)
+        self.catalog = catalog if catalog is not None else repo_catalog
+        # recommendation_id -> record, in enqueue order
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task = None
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+
+    def enqueue(self, username: str, recommendations: List[Dict[str, Any]], recommendation_name: str) -> str:
+        """Queue a recommendation for the next batch and return its id"""
+        recommendation_id = str(uuid.uuid4())
+        self.pending[recommendation_id] = {
+            "username": username,
             "recommendation_id": recommendation_id,
-            "recommendations": recommendations
-        })
+            "recommendation_name": recommendation_name,
+            "recommendations": recommendations,
+            "attempts": 0,
+        }
+        if len(self.pending) >= self.batch_size:
+            self._wake.set()
+        self.start()
+        return recommendation_id
 
-    except Exception as e:
-        logger.error(f"Failed to save recommendations to DB: {str(e)}")
-        raise ValueError("Failed to save recommendations to DB")
+    def pending_refs(self, username: str) -> List[Dict[str, str]]:
+        return [{"recommendation_id": r["recommendation_id"], "recommendation_name": r["recommendation_name"]}
+                for r in self.pending.values() if r["username"] == username]
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            while self.pending and await self.flush():
+                pass
+
+    async def _write(self, batch: List[Dict[str, Any]]):
+        documents, repos = [], {}
+        for r in batch:
+            entries, recommended = split_recommendations(r["recommendations"])
+            repos.update(recommended)
+            documents.append({"_id": r["recommendation_id"], "recommendation_id": r["recommendation_id"],
+                              "repos": entries})
+        # repos first, so a stored recommendation never points at a repo missing from the catalog
+        await self.catalog.upsert_many(repos)
+        # the recommendation id is the _id, a retried insert fails on the duplicate key
+        # instead of storing the document twice
+        try:
+            await self._recommendations.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+        refs = {}
+        for r in batch:
+            refs.setdefault(r["username"], []).append(
+                {"recommendation_id": r["recommendation_id"], "recommendation_name": r["recommendation_name"]})
+        # $addToSet rather than $push, so a retried batch does not list a recommendation twice
+        await self._user_recommendations.bulk_write(
+            [UpdateOne({"username": username}, {"$addToSet": {"recommendation_refs": {"$each": user_refs}}},
+                       upsert=True) for username, user_refs in refs.items()],
+            ordered=False)
+
+    async def flush(self) -> int:
+        """Write up to `batch_size` pending records, returns how many were written"""
+        batch = list(self.pending.values())[:self.batch_size]
+        if not batch:
+            return 0
+        try:
+            await self._write(batch)
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Failed to save {len(batch)} recommendations to DB: {str(e)}")
+            for record in batch:
+                record["attempts"] += 1
+                if record["attempts"] > self.max_retries:
+                    logger.error(f"Dropping recommendation {record['recommendation_id']} "
+                                 f"after {record['attempts']} failed writes")
+                    self.pending.pop(record["recommendation_id"], None)
+                    self.dropped += 1
+            return 0
+        for record in batch:
+            self.pending.pop(record["recommendation_id"], None)
+        # another worker may have cached a user's list from Mongo before this batch landed
+        await redis_write(delete=[f"user_recommendations:{username}"
+                                  for username in {record["username"] for record in batch}])
+        self.written += len(batch)
+        self.batches += 1
+        return len(batch)
+
+    async def close(self):
+        """Stop the background task and write everything still pending"""
+        if self._task is not None:
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        # failed records are retried until written or dropped after max_retries attempts
+        while self.pending:
+            if not await self.flush():
+                await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {"pending": len(self.pending), "written": self.written, "batches": self.batches,
+                "failures": self.failures, "dropped": self.dropped}
+
+
+repo_catalog = RepoCatalog(db['repos'].with_options(
+    write_concern=WriteConcern(w=1, j=True) if RECOMMENDATION_WRITE_JOURNAL else WriteConcern(w=1)))
+recommendation_writer = RecommendationWriter()
 
-    try:
-        user_recommenations_coll.update_one(
-            {"username": username},
-            {"$push": {
-                "recommendation_refs": {
-                    "recommendation_id": recommendation_id,
-                    "recommendation_name": recommendation_name
-                }
-            }},
-            upsert=True
-        )
 
-        return recommendation_id
-    except Exception as e:
-        logger.error(f"Failed to save user recommendations to DB: {str(e)}")
-        raise ValueError("Failed to save user recommendations to DB")
-    
+def append_recommendations_to_db(username, recommendations, recommendation_name):
+    """Queue the recommendations for the background writer, returns their id right away"""
+    return recommendation_writer.enqueue(username, recommendations, recommendation_name)
+
 
 async def get_user_previous_recommendations(username: str) -> list:
     try:
         # Example query; adjust as per your database schema
         user_recommendations = await db.user_recommendations.find_one({"username": username})
-        if not user_recommendations:
-            return []
 
         # Assuming the recommendations are stored in 'recommendation_refs'
-        return user_recommendations.get("recommendation_refs", [])
+        refs = user_recommendations.get("recommendation_refs", []) if user_recommendations else []
+        # plus the ones still waiting for the background writer
+        stored = {ref.get("recommendation_id") for ref in refs}
+        return refs + [ref for ref in recommendation_writer.pending_refs(username)
+                       if ref["recommendation_id"] not in stored]
     except Exception as e:
         logger.error(f"Database query error: {str(e)}")
         raise
 
 
 async def get_user_recommendation_by_id(recommendation_id):
+    pending = recommendation_writer.pending.get(recommendation_id)
+    if pending is not None:
+        return {"recommendation_id": recommendation_id, "recommendations": pending["recommendations"]}
     try:
         recommendations_collection = db['recommendations']
         recommendation_data = await recommendations_collection.find_one({"recommendation_id": recommendation_id})
@@ -152,9 +280,14 @@ async def get_user_recommendation_by_id(recommendation_id):
         if not recommendation_data:
             return None
 
+        # documents not yet migrated by src/migrate_recommendations.py embed the full repos
+        if "repos" in recommendation_data:
+            recommendations = await repo_catalog.hydrate(recommendation_data["repos"])
+        else:
+            recommendations = recommendation_data["recommendations"]
         return {
             "recommendation_id": recommendation_id,
-            "recommendations": recommendation_data["recommendations"]
+            "recommendations": recommendations
         }
 
     except Exception as e:
@@ -164,13 +297,15 @@ async def get_user_recommendation_by_id(recommendation_id):
 def process_recommendations(urls: List[Dict[str, Any]],
                             languages_topics) -> List[Dict[str, Any]]:
     """
-    Process the list of URLs to ensure uniqueness and format them correctly.
+    Process the list of URLs to ensure uniqueness and rank them for the user.
     
     Args:
         urls: List of URL recommendations.
+        languages_topics: The user's languages and topics.
         
     Returns:
-        Processed list of unique recommendations.
+        Processed list of unique recommendations, best first, each with its `score`.
+        The first slots are diversified when the candidates carry their `embedding`.
     """
     seen_full_names = set()
     unique_recommendations = []
@@ -181,29 +316,13 @@ def process_recommendations(urls: List[Dict[str, Any]],
             seen_full_names.add(full_name)
             unique_recommendations.append(rec)
 
-    def match_score(rec):
-        # Calculate the score based on language and topic match
-        score = 0
-        rec_language = rec.get('language', '')
-        rec_topics = rec.get('topics', [])
-        
-        # Extract user languages and topics
-        user_languages = languages_topics.get("languages", [])
-        user_topics = languages_topics.get("topics", [])
-
-        # Add 2 to the score for a language match
-        if rec_language in user_languages:
-            score += 2
-        
-        # Add 1 to the score for each matching topic
-        score += sum(1 for topic in rec_topics if topic in user_topics)
-        
-        return score
-
-    # Sort the recommendations based on match score in descending order
-    unique_recommendations.sort(key=match_score, reverse=True)
-
-    return unique_recommendations
+    # score every candidate in one vectorized pass: similarity, language and topic match,
+    # popularity, activity and recency, then diversify the top slots, see src/ranking.py
+    ranked = diversify(rank(unique_recommendations,
+                            languages_topics.get("languages", []),
+                            languages_topics.get("topics", [])))
+    # the embeddings were only needed for diversification
+    return [{key: value for key, value in rec.items() if key != "embedding"} for rec in ranked]
 
 
 # TODO: v2
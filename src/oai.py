@@ -1,20 +1,75 @@
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI
+import openai
 import os
+import random
+import asyncio
+import logging
+from typing import List
 from dotenv import load_dotenv
+from .settings import (
+    EMBEDDING_MODEL,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_BATCH_MAX_TOKENS,
+    EMBEDDING_MAX_CONCURRENCY,
+    EMBEDDING_MAX_RETRIES,
+    EMBEDDING_RETRY_BACKOFF,
+    EMBEDDING_DIMENSIONS,
+)
+from .embeddings import EmbeddingProvider
 load_dotenv()
 
-client = AzureOpenAI(
+logger = logging.getLogger(__name__)
+
+# async, so embedding calls don't block the event loop
+async_client = AsyncAzureOpenAI(
     azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT"),
     api_key = os.getenv("AZURE_OPENAI_API_KEY"),
     azure_deployment=os.getenv("AZURE_DEPLOYMENT"),
-    api_version = "2023-09-15-preview",
+    api_version = "2024-02-01", # first version accepting `dimensions`
 )
 
-def generate_embeddings(text, model="text-embedding-3-small"):
-    """Generate embeddings for the given text using the specified model"""
-    return client.embeddings.create(input = [text], model=model).data[0].embedding
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+
+def dimension_kwargs(dimensions):
+    # only sent when set, older models reject the parameter
+    return {"dimensions": dimensions} if dimensions else {}
+
+
+def model_key(model, dimensions):
+    """Identifies the vector space in the embedding cache, shortened vectors are a different one"""
+    return f"{model}@{dimensions}" if dimensions else model
+
+
+class AzureEmbeddingProvider(EmbeddingProvider):
+    """Embeddings from the Azure OpenAI deployment"""
+    max_inputs = EMBEDDING_BATCH_SIZE
+    max_tokens = EMBEDDING_BATCH_MAX_TOKENS
+    max_concurrency = EMBEDDING_MAX_CONCURRENCY
+
+    def __init__(self, model: str = EMBEDDING_MODEL, dimensions: int = None):
+        self.deployment_model = model
+        self.dimensions = dimensions
+        self.model = model_key(model, dimensions)
+
+    async def embed_chunk(self, chunk: List[str]) -> List[List[float]]:
+        """Embed one chunk, retrying transient failures with jittered exponential backoff"""
+        for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+            try:
+                response = await async_client.with_options(max_retries=0).embeddings.create(
+                    input=chunk, model=self.deployment_model, **dimension_kwargs(self.dimensions))
+                # the API returns an index per input, don't rely on the response order
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            except RETRYABLE_ERRORS as e:
+                if attempt == EMBEDDING_MAX_RETRIES:
+                    raise
+                delay = EMBEDDING_RETRY_BACKOFF * (2 ** attempt) + random.uniform(0, EMBEDDING_RETRY_BACKOFF)
+                logger.warning(f"Embedding chunk of {len(chunk)} inputs failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
 
 if __name__ == "__main__":
+    from .embeddings import generate_embeddings_batch, get_embedding_provider
     text = "I am a software engineer"
-    embeddings = generate_embeddings(text)
-    print(embeddings)
+    embeddings = asyncio.run(generate_embeddings_batch([text], provider=get_embedding_provider(EMBEDDING_DIMENSIONS)))
+    print(embeddings[0])
@@ -1,30 +1,184 @@
+import json
 import asyncio
-from datetime import datetime
+import hashlib
+import logging
+from collections import OrderedDict
 from typing import Optional, List
+from .cache import get_redis
+from .rate_limit import RateLimitScheduler, get_scheduler, resource_for
+from .settings import OCTOKIT_CACHE_BACKEND, OCTOKIT_CACHE_MAX_ENTRIES, OCTOKIT_CACHE_TTL, GITHUB_API_URL
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryResponseCache:
+    """In-process LRU of GitHub responses and their validators (ETag / Last-Modified)"""
+
+    def __init__(self, max_entries: int = OCTOKIT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    async def set(self, key: str, entry: dict):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class RedisResponseCache:
+    """GitHub responses and their validators in Redis, shared by every worker"""
+
+    def __init__(self, redis, prefix: str = "octokit:", ttl: int = OCTOKIT_CACHE_TTL):
+        self.redis = redis
+        self.prefix = prefix
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[dict]:
+        try:
+            entry = await self.redis.get(self.prefix + key)
+        except Exception as e:
+            # a cache outage only costs us the conditional request
+            logger.warning(f"Error reading Octokit cache from Redis: {e}")
+            return None
+        return json.loads(entry) if entry else None
+
+    async def set(self, key: str, entry: dict):
+        try:
+            await self.redis.set(self.prefix + key, json.dumps(entry), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Error writing Octokit cache to Redis: {e}")
+
+
+_response_cache = None
+
+
+def get_response_cache():
+    """Process-wide response cache selected by OCTOKIT_CACHE_BACKEND (memory, redis or none)"""
+    global _response_cache
+    if _response_cache is None:
+        if OCTOKIT_CACHE_BACKEND == "redis":
+            _response_cache = RedisResponseCache(get_redis())
+        elif OCTOKIT_CACHE_BACKEND == "memory":
+            _response_cache = MemoryResponseCache()
+    return _response_cache
+
+
+class GraphQLError(Exception):
+    """The GraphQL API answered, but with errors instead of data"""
+
+
+def next_page_url(link_header: Optional[str]) -> Optional[str]:
+    """Extract the rel="next" URL from a GitHub `Link` header"""
+    if not link_header:
+        return None
+    for part in link_header.split(','):
+        section = part.split(';')
+        if len(section) > 1 and any(p.strip() == 'rel="next"' for p in section[1:]):
+            return section[0].strip()[1:-1]
+    return None
 
 
 class Octokit:
-    def __init__(self, auth: str, session):
+    def __init__(self, auth: str, session, cache=None, base_url: Optional[str] = None,
+                 scheduler: Optional[RateLimitScheduler] = None):
         self.auth = auth
         self.session = session
+        self.cache = cache if cache is not None else get_response_cache()
+        self.base_url = base_url or GITHUB_API_URL
+        self.scheduler = scheduler if scheduler is not None else get_scheduler(auth)
+
+    def _cache_key(self, method: str, url: str, params: Optional[dict]) -> str:
+        # responses can differ per token, so the token is part of the key (hashed, never stored)
+        token = hashlib.sha256(self.auth.encode()).hexdigest()
+        query = json.dumps(sorted((params or {}).items()), default=str)
+        return hashlib.sha256(f"{token}\0{method}\0{url}\0{query}".encode()).hexdigest()
 
-    async def request(self, 
-                      method: str, 
-                      url: str, 
+    async def request(self,
+                      method: str,
+                      url: str,
                       params: Optional[dict]=None):
+        body, _ = await self.request_with_headers(method, url, params)
+        return body
+
+    async def paginate(self,
+                       method: str,
+                       url: str,
+                       params: Optional[dict]=None):
+        """Yield every page of a list endpoint, following the `Link: rel="next"` headers"""
+        while url:
+            body, headers = await self.request_with_headers(method, url, params)
+            yield body
+            url = next_page_url(headers.get('Link'))
+            params = None # the next link carries the query string
+
+    async def graphql(self, query: str, variables: Optional[dict]=None) -> dict:
+        """Run a GitHub GraphQL v4 query and return its `data`"""
+        body, _ = await self.request_with_headers('POST', '/graphql', json_body={'query': query, 'variables': variables or {}})
+        if body.get('errors'):
+            raise GraphQLError("; ".join(error.get('message', str(error)) for error in body['errors']))
+        return body['data']
+
+    async def request_with_headers(self,
+                                   method: str,
+                                   url: str,
+                                   params: Optional[dict]=None,
+                                   json_body: Optional[dict]=None):
+        """Like `request`, but also returns the response headers"""
         headers = {
             'Authorization': 'BEARER ' + self.auth,
             'Accept': 'application/vnd.github+json',
         }
 
-        url = 'https://api.github.com' + url
+        # pagination links are already absolute
+        if not url.startswith('http'):
+            url = self.base_url + url
 
+        # conditional request: GitHub answers 304 without counting it against the rate limit
+        cache_key, cached = None, None
+        if self.cache is not None and method.upper() == 'GET':
+            cache_key = self._cache_key(method, url, params)
+            cached = await self.cache.get(cache_key)
+            if cached:
+                if cached.get('etag'):
+                    headers['If-None-Match'] = cached['etag']
+                if cached.get('last_modified'):
+                    headers['If-Modified-Since'] = cached['last_modified']
+
+        resource = resource_for(url)
+        attempt = 0
         while True:
-            async with self.session.request(method, url, headers=headers, params=params) as response:
-                if response.status == 403:
-                    reset_time = datetime.fromtimestamp(int(response.headers["X-RateLimit-Reset"]))
-                    sleep_time = (reset_time - datetime.now()).total_seconds() + 5
-                    await asyncio.sleep(sleep_time)
-                else:
-                    response.raise_for_status()
-                    return await response.json()
+            async with self.scheduler.slot(resource):
+                async with self.session.request(method, url, headers=headers, params=params, json=json_body) as response:
+                    self.scheduler.update(resource, response.headers)
+                    if response.status == 304 and cached:
+                        return cached['body'], {**cached.get('headers', {}), **response.headers}
+
+                    if response.status in (403, 429) or response.status >= 500:
+                        delay = self.scheduler.retry_delay(resource, response.status, response.headers,
+                                                           await response.text(), attempt)
+                        if delay is None:
+                            response.raise_for_status()
+                    else:
+                        response.raise_for_status()
+                        body = await response.json()
+                        etag = response.headers.get('ETag')
+                        last_modified = response.headers.get('Last-Modified')
+                        if cache_key and (etag or last_modified):
+                            await self.cache.set(cache_key, {
+                                'etag': etag,
+                                'last_modified': last_modified,
+                                'headers': {name: response.headers[name] for name in ('Link',) if name in response.headers},
+                                'body': body,
+                            })
+                        return body, response.headers
+
+            # back off outside the concurrency slot so other tasks keep going
+            attempt += 1
+            if delay:
+                await asyncio.sleep(delay)
@@ -0,0 +1,145 @@
+import time
+import logging
+import numpy as np
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+from .settings import (
+    RANKING_WEIGHTS,
+    RANKING_RECENCY_HALF_LIFE_DAYS,
+    MMR_RESULTS,
+    MMR_LAMBDA,
+    MMR_TIME_BUDGET,
+)
+
+logger = logging.getLogger(__name__)
+
+FEATURES = ("similarity", "language", "topics", "stars", "forks", "issues", "recency")
+
+
+def split_topics(topics) -> Set[str]:
+    """Topics are stored as a comma-joined string in Chroma metadata, but may be a list"""
+    if not topics:
+        return set()
+    if isinstance(topics, str):
+        topics = topics.split(",")
+    return {t.strip().lower() for t in topics if t and t.strip()}
+
+
+def log_scaled(values: np.ndarray) -> np.ndarray:
+    """log1p, scaled to [0, 1] by the largest candidate"""
+    logs = np.log1p(np.maximum(values, 0))
+    top = logs.max() if len(logs) else 0
+    return logs / top if top > 0 else np.zeros_like(logs)
+
+
+def parse_timestamps(values: List[str]) -> np.ndarray:
+    """ISO-8601 timestamps (GitHub's `...Z` form) as epoch seconds, NaN when missing"""
+    seconds = np.full(len(values), np.nan)
+    for i, value in enumerate(values):
+        if value:
+            try:
+                seconds[i] = datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+            except ValueError:
+                pass
+    return seconds
+
+
+def features(candidates: List[Dict[str, Any]], languages: List[str], topics: List[str],
+             now: Optional[float] = None) -> np.ndarray:
+    """(candidates x FEATURES) matrix, every column in [0, 1]"""
+    now = now if now is not None else datetime.now(timezone.utc).timestamp()
+    user_languages = {l.lower() for l in languages if l}
+    user_topics = {t.lower() for t in topics if t} | user_languages
+
+    # cosine distance is in [0, 2], missing distances rank as unrelated
+    distances = np.array([c.get("distance", 1.0) if c.get("distance") is not None else 1.0 for c in candidates],
+                         dtype=np.float64)
+    language = np.array([(c.get("language") or "").lower() in user_languages for c in candidates], dtype=np.float64)
+    overlap = np.array([len(split_topics(c.get("topics")) & user_topics) for c in candidates], dtype=np.float64)
+    stars = np.array([c.get("stargazers_count") or 0 for c in candidates], dtype=np.float64)
+    forks = np.array([c.get("forks_count") or 0 for c in candidates], dtype=np.float64)
+    issues = np.array([c.get("open_issues_count") or 0 for c in candidates], dtype=np.float64)
+    age_days = (now - parse_timestamps([c.get("updated_at") for c in candidates])) / 86400
+
+    return np.column_stack([
+        np.clip(1 - distances, 0, 1),
+        language,
+        overlap / max(len(user_topics), 1),
+        log_scaled(stars),
+        log_scaled(forks),
+        log_scaled(issues),
+        np.nan_to_num(0.5 ** (np.maximum(age_days, 0) / RANKING_RECENCY_HALF_LIFE_DAYS)),
+    ])
+
+
+def score(candidates: List[Dict[str, Any]], languages: List[str], topics: List[str],
+          weights: Optional[Dict[str, float]] = None, now: Optional[float] = None) -> np.ndarray:
+    """Weighted sum of the ranking features of every candidate, in one matrix-vector product"""
+    if not candidates:
+        return np.zeros(0)
+    weights = {**RANKING_WEIGHTS, **(weights or {})}
+    return features(candidates, languages, topics, now) @ np.array([weights.get(f, 0.0) for f in FEATURES])
+
+
+def rank(candidates: List[Dict[str, Any]], languages: List[str], topics: List[str],
+         weights: Optional[Dict[str, float]] = None, now: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Candidates best first, each with its `score`"""
+    scores = score(candidates, languages, topics, weights, now)
+    # stable, so ties keep the retrieval order
+    order = np.argsort(-scores, kind="stable")
+    return [{**candidates[i], "score": round(float(scores[i]), 4)} for i in order]
+
+
+def mmr(relevance: np.ndarray, embeddings: np.ndarray, k: int, lambda_: float = 0.7,
+        time_budget: Optional[float] = None) -> List[int]:
+    """
+    Maximal Marginal Relevance: pick `k` indices, each maximizing
+    lambda * relevance - (1 - lambda) * (cosine similarity to the closest pick so far).
+    Past `time_budget` seconds the remaining slots are filled in relevance order.
+    """
+    start = time.perf_counter()
+    n = len(relevance)
+    k = min(k, n)
+    if k == 0:
+        return []
+
+    spread = relevance.max() - relevance.min()
+    relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones(n)
+    unit = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    similarity = unit @ unit.T
+
+    selected = []
+    available = np.ones(n, dtype=bool)
+    closest = np.full(n, -np.inf) # similarity to the nearest selected candidate
+    while len(selected) < k:
+        if time_budget is not None and time.perf_counter() - start > time_budget:
+            logger.info(f"MMR time budget spent after {len(selected)} of {k} picks")
+            rest = [int(i) for i in np.argsort(-relevance, kind="stable") if available[i]]
+            return selected + rest[:k - len(selected)]
+        redundancy = np.where(np.isfinite(closest), closest, 0.0)
+        marginal = np.where(available, lambda_ * relevance - (1 - lambda_) * redundancy, -np.inf)
+        pick = int(np.argmax(marginal))
+        selected.append(pick)
+        available[pick] = False
+        closest = np.maximum(closest, similarity[pick])
+    return selected
+
+
+def diversifies(k: int, lambda_: float) -> bool:
+    """Whether diversify can reorder anything: pure relevance, or no slots, keeps the ranked order"""
+    return k > 0 and lambda_ < 1.0
+
+
+def diversify(ranked: List[Dict[str, Any]], k: int = MMR_RESULTS, lambda_: float = MMR_LAMBDA,
+              time_budget: float = MMR_TIME_BUDGET) -> List[Dict[str, Any]]:
+    """
+    Reorder ranked candidates so the first `k` are relevant but not near-duplicates of each
+    other, using the candidate embeddings returned by the vector query. The rest keep their order.
+    """
+    if len(ranked) <= 1 or not diversifies(k, lambda_) or any(c.get("embedding") is None for c in ranked):
+        return ranked
+    relevance = np.array([c["score"] for c in ranked])
+    embeddings = np.array([c["embedding"] for c in ranked], dtype=np.float32)
+    picked = mmr(relevance, embeddings, k, lambda_, time_budget)
+    picked_set = set(picked)
+    return [ranked[i] for i in picked] + [c for i, c in enumerate(ranked) if i not in picked_set]
@@ -0,0 +1,168 @@
+import time
+import random
+import asyncio
+import hashlib
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional
+from .cache import TTLCache
+from .settings import (
+    OCTOKIT_SCHEDULER_MAX_TOKENS,
+    OCTOKIT_SCHEDULER_TTL,
+    OCTOKIT_MAX_CONCURRENCY,
+    OCTOKIT_MAX_RETRIES,
+    OCTOKIT_RETRY_BACKOFF,
+    OCTOKIT_SECONDARY_BACKOFF,
+)
+
+logger = logging.getLogger(__name__)
+
+# below this share of the window's budget requests are spread out until the reset
+PACING_THRESHOLD = 0.1
+
+
+def resource_for(url: str) -> str:
+    """GitHub keeps separate rate-limit buckets for search, GraphQL and everything else"""
+    if '/search/' in url:
+        return 'search'
+    if url.endswith('/graphql'):
+        return 'graphql'
+    return 'core'
+
+
+class RateLimitBucket:
+    def __init__(self, limit: int, remaining: int, reset: float):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+        self.next_slot = 0.0
+
+    def as_dict(self) -> dict:
+        return {"limit": self.limit, "remaining": self.remaining, "reset": int(self.reset)}
+
+
+class RateLimitScheduler:
+    """
+    Paces GitHub requests made with one token.
+
+    Every task using the token draws from the same per-resource token bucket, which is
+    refilled from the `X-RateLimit-*` response headers. Requests wait for the window to
+    reset instead of running into 403s, are spread out once the budget runs low, and a
+    secondary rate limit pauses all of them at once.
+    """
+
+    def __init__(self, max_concurrency: int = OCTOKIT_MAX_CONCURRENCY):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._buckets = {}
+        self._paused_until = 0.0
+
+    async def _wait_for_budget(self, resource: str):
+        while True:
+            now = time.time()
+            if self._paused_until > now:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            bucket = self._buckets.get(resource)
+            if bucket is None:
+                return
+            if bucket.reset <= now:
+                # new window, the next response tells us the real numbers
+                bucket.remaining = bucket.limit
+                bucket.reset = now + 60
+            if bucket.remaining <= 0:
+                logger.info(f"GitHub {resource} rate limit exhausted, waiting {bucket.reset - now:.0f}s for reset")
+                await asyncio.sleep(bucket.reset - now + 1)
+                continue
+
+            bucket.remaining -= 1
+            if bucket.remaining < bucket.limit * PACING_THRESHOLD:
+                # spread what's left evenly over the rest of the window
+                interval = (bucket.reset - now) / (bucket.remaining + 1)
+                slot = max(now, bucket.next_slot)
+                bucket.next_slot = slot + interval
+                if slot > now:
+                    await asyncio.sleep(slot - now)
+            return
+
+    @asynccontextmanager
+    async def slot(self, resource: str):
+        """Wait for rate-limit budget and a concurrency slot"""
+        await self._wait_for_budget(resource)
+        async with self._semaphore:
+            yield
+
+    def update(self, resource: str, headers):
+        """Refresh the bucket from the rate-limit headers of a response"""
+        if 'X-RateLimit-Remaining' not in headers:
+            return
+        resource = headers.get('X-RateLimit-Resource', resource)
+        limit = int(headers.get('X-RateLimit-Limit', 0))
+        remaining = int(headers['X-RateLimit-Remaining'])
+        reset = float(headers.get('X-RateLimit-Reset', time.time() + 60))
+
+        bucket = self._buckets.get(resource)
+        if bucket is None or reset > bucket.reset:
+            self._buckets[resource] = RateLimitBucket(limit, remaining, reset)
+        else:
+            # requests still in flight were already taken off the local count
+            bucket.limit = limit
+            bucket.remaining = min(bucket.remaining, remaining)
+
+    def retry_delay(self, resource: str, status: int, headers, body: str, attempt: int) -> Optional[float]:
+        """
+        How long to wait before retrying a failed response, or None if it shouldn't be retried.
+        Rate-limit waits are applied to every task through the scheduler itself.
+        """
+        if status in (403, 429):
+            if attempt >= OCTOKIT_MAX_RETRIES:
+                return None
+            if headers.get('Retry-After'):
+                # secondary rate limit with an explicit pause
+                self._pause(float(headers['Retry-After']))
+                return 0
+            if headers.get('X-RateLimit-Remaining') == '0':
+                # primary limit, `update` emptied the bucket so the next slot waits for the reset
+                return 0
+            if status == 429 or 'secondary rate limit' in body.lower():
+                self._pause(self._jittered(OCTOKIT_SECONDARY_BACKOFF, attempt))
+                return 0
+            return None
+
+        if status >= 500 and attempt < OCTOKIT_MAX_RETRIES:
+            return self._jittered(OCTOKIT_RETRY_BACKOFF, attempt)
+        return None
+
+    def _pause(self, seconds: float):
+        logger.warning(f"GitHub secondary rate limit hit, pausing requests for {seconds:.0f}s")
+        self._paused_until = max(self._paused_until, time.time() + seconds)
+
+    @staticmethod
+    def _jittered(base: float, attempt: int) -> float:
+        return base * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def budget(self) -> dict:
+        """Remaining budget per rate-limit resource"""
+        return {resource: bucket.as_dict() for resource, bucket in self._buckets.items()}
+
+
+# idle tokens are forgotten, their budget is re-learned from the next response
+_schedulers = TTLCache(OCTOKIT_SCHEDULER_TTL, max_entries=OCTOKIT_SCHEDULER_MAX_TOKENS)
+
+
+def token_fingerprint(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()[:12]
+
+
+def get_scheduler(token: str) -> RateLimitScheduler:
+    """Rate limits are per token, so every client using the same token shares a scheduler"""
+    fingerprint = token_fingerprint(token)
+    scheduler = _schedulers.get(fingerprint) or RateLimitScheduler()
+    # set on every use, so a token in use keeps its scheduler
+    _schedulers.set(fingerprint, scheduler)
+    return scheduler
+
+
+def rate_limit_budget() -> dict:
+    """Remaining GitHub budget of every token seen by this process, keyed by token fingerprint"""
+    return {fingerprint: scheduler.budget() for fingerprint, scheduler in _schedulers.items()}
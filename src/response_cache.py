@@ -0,0 +1,173 @@
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+from .cache import SingleFlight, TTLCache, get_redis
+from .settings import (
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_STALE_TTL,
+    RESPONSE_CACHE_LOCK_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+# delete the lock only while it still holds our token, in one round trip
+UNLOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def normalize_terms(terms: Optional[List[str]]) -> List[str]:
+    return sorted({t.strip().lower() for t in terms or [] if t and t.strip()})
+
+
+def fingerprint(kind: str, languages: List[str], topics: List[str],
+                user_details: Optional[List[dict]] = None, username: Optional[str] = None) -> str:
+    """
+    Cache key of a recommendation response: the normalized languages and topics plus the
+    state of the user's profile, so a push to any of their repos yields a new key
+    """
+    profile = sorted((d.get("project_name") or "", d.get("pushed_at") or "") for d in user_details or [])
+    payload = {"kind": kind, "username": username, "languages": normalize_terms(languages),
+               "topics": normalize_terms(topics), "profile": profile}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Whole responses in Redis (in-process when Redis is unavailable). Entries are fresh for
+    `ttl` seconds and then served stale for up to `stale_ttl` more while one background task
+    recomputes them. Identical concurrent misses share one computation: SingleFlight within
+    the process, a Redis lock across workers.
+    """
+
+    def __init__(self, prefix: str = "response:", ttl: float = RESPONSE_CACHE_TTL,
+                 stale_ttl: float = RESPONSE_CACHE_STALE_TTL, lock_timeout: float = RESPONSE_CACHE_LOCK_TIMEOUT,
+                 poll_interval: float = 0.1):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self._memory = TTLCache(ttl + stale_ttl, max_entries=1000)
+        self._flights = SingleFlight()
+        self._revalidating = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    async def _read(self, key: str) -> Optional[dict]:
+        try:
+            raw = await get_redis().get(self.prefix + key)
+            return json.loads(raw) if raw else None
+        except Exception as e:
+            logger.warning(f"Error reading {self.prefix} cache from Redis: {e}")
+            return self._memory.get(key)
+
+    async def _write(self, key: str, value: Any):
+        entry = {"created_at": time.time(), "value": value}
+        self._memory.set(key, entry)
+        try:
+            await get_redis().set(self.prefix + key, json.dumps(entry), ex=int(self.ttl + self.stale_ttl))
+        except Exception as e:
+            logger.warning(f"Error writing {self.prefix} cache to Redis: {e}")
+
+    async def _lock(self, key: str) -> Optional[str]:
+        """A token when this worker may compute `key`, None when another one holds the lock"""
+        token = uuid.uuid4().hex
+        try:
+            acquired = await get_redis().set(f"{self.prefix}lock:{key}", token, nx=True, ex=int(self.lock_timeout))
+        except Exception as e:
+            # without Redis there is nobody to coordinate with
+            logger.warning(f"Error taking the {self.prefix} lock in Redis: {e}")
+            return token
+        return token if acquired else None
+
+    async def _locked(self, key: str) -> bool:
+        try:
+            return await get_redis().get(f"{self.prefix}lock:{key}") is not None
+        except Exception as e:
+            logger.warning(f"Error reading the {self.prefix} lock from Redis: {e}")
+            return False
+
+    async def _unlock(self, key: str, token: str):
+        try:
+            await get_redis().eval(UNLOCK_SCRIPT, 1, f"{self.prefix}lock:{key}", token)
+        except Exception as e:
+            logger.warning(f"Error releasing the {self.prefix} lock in Redis: {e}")
+
+    async def _wait(self, key: str) -> Tuple[bool, Any]:
+        """
+        (True, value) once the lock holder stored the response, (False, token) when this
+        worker should compute it: the holder released the lock without storing anything
+        (an uncacheable answer or an error) or did not finish within the lock timeout
+        """
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            entry = await self._read(key)
+            if entry is not None:
+                return True, entry["value"]
+            if not await self._locked(key):
+                token = await self._lock(key)
+                if token is not None:
+                    return False, token
+        logger.warning(f"Timed out waiting for {self.prefix}{key}, computing it here")
+        return False, uuid.uuid4().hex
+
+    async def _fill(self, key: str, compute: Callable[[], Awaitable[Any]],
+                    should_cache: Callable[[Any], bool], wait: bool = True) -> Any:
+        token = await self._lock(key)
+        if token is None:
+            if not wait:
+                return None
+            # another worker is computing this response, wait for it rather than redo it
+            found, result = await self._wait(key)
+            if found:
+                return result
+            token = result
+        try:
+            value = await compute()
+            if should_cache(value):
+                await self._write(key, value)
+            return value
+        finally:
+            await self._unlock(key, token)
+
+    def _revalidate(self, key: str, compute, should_cache):
+        if key in self._revalidating:
+            return
+
+        async def refresh():
+            try:
+                await self._flights.do(key, lambda: self._fill(key, compute, should_cache, wait=False))
+            except Exception as e:
+                logger.error(f"Error revalidating {self.prefix}{key}: {e}")
+
+        task = asyncio.create_task(refresh())
+        self._revalidating[key] = task
+        task.add_done_callback(lambda _: self._revalidating.pop(key, None))
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]],
+                             should_cache: Callable[[Any], bool] = lambda value: True) -> Any:
+        """The cached value of `key`, computing it (once) if missing and refreshing it if stale"""
+        entry = await self._read(key)
+        if entry is not None:
+            if time.time() - entry["created_at"] > self.ttl:
+                self.stale_hits += 1
+                self._revalidate(key, compute, should_cache)
+            else:
+                self.hits += 1
+            return entry["value"]
+
+        self.misses += 1
+        return await self._flights.do(key, lambda: self._fill(key, compute, should_cache))
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "stale_hits": self.stale_hits, "misses": self.misses}
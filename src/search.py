@@ -1,67 +1,162 @@
 import os
+import json
+import math
 import asyncio
+import hashlib
 from datetime import datetime
 from aiohttp import ClientSession
 from typing import Optional, List
 from dotenv import load_dotenv
-from src.db import get_chromadb_collection, upsert_to_chroma_db
+from src.db import get_chromadb_collection, upsert_to_chroma_db, run_chroma
 from .octokit import Octokit
 from .models import get_user_collection
+from .cache import TieredCache, SingleFlight
+from .settings import (
+    SEARCH_MAX_RESULTS,
+    SEARCH_PER_PAGE,
+    SEARCH_PAGE_CONCURRENCY,
+    SEARCH_CACHE_TTL,
+    SEARCH_CACHE_BACKEND,
+)
 import logging
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-logging.basicConfig(filename='repository_search.log', level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
-
 GPAT = os.getenv('GPAT')
 
-async def search_repositories(octokit: Octokit, 
-                              params: Optional[dict]):
-    unique_repos = {}
-    try:
-        response = await octokit.request('GET', '/search/repositories', params)
-    except Exception as e:
-        raise Exception(f"Error fetching data: {e}")
-    
-    while len(response['items']) > 0 and params['page'] <= 3:
-        for item in response['items']:
-            if item['id'] not in unique_repos:
-                language = params["q"].split('language:')[1].split(' ')[0] if 'language:' in params["q"] else ""
-                topic = params["q"].split('topic:')[1].split(' ')[0] if 'topic:' in params["q"] else ""
-
-                if language:
-                    related = language
-                elif topic:
-                    related = topic
-                else:
-                    related = "Others"
-                
-                topics = item.get('topics', [])
-                topics_str = ", ".join(topics) if topics else ""
-
-                unique_repos[item['id']] = {
-                    "full_name": item.get('full_name'),
-                    "description": item.get('description'),
-                    "related_language_or_topic": related,
-                    "stargazers_count": item.get('stargazers_count'),
-                    "forks_count": item.get('forks_count'),
-                    "open_issues_count": item.get('open_issues_count'),
-                    "avatar_url": item.get('owner', {}).get('avatar_url'),
-                    "language": item.get('language'),
-                    "updated_at": item.get('updated_at'),
-                    "topics": topics_str
-                }
-
-        params['page'] += 1
+# Search results are public and don't depend on the token, so every user and worker can
+# share them. Identical queries running at the same time share one request.
+_search_cache = TieredCache("search:", SEARCH_CACHE_TTL, use_redis=SEARCH_CACHE_BACKEND == "redis")
+_search_flights = SingleFlight()
+
+# the fields of a search item used by add_items, the rest isn't worth caching
+SEARCH_ITEM_FIELDS = ('id', 'full_name', 'description', 'stargazers_count', 'forks_count',
+                      'open_issues_count', 'language', 'updated_at', 'topics')
+
+
+def normalize_query(q: str) -> str:
+    """Qualifier order, case and spacing don't change what the search returns"""
+    return " ".join(sorted(q.lower().split()))
+
+
+def search_query_key(params: dict) -> str:
+    key = [normalize_query(params['q']), params.get('sort'), params.get('order'),
+           params.get('per_page'), params.get('page')]
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+
+async def cached_search(octokit: Octokit, params: dict) -> dict:
+    """One page of /search/repositories, served from the search cache when possible"""
+    key = search_query_key(params)
+    cached = await _search_cache.get(key)
+    if cached is not None:
+        return cached
+
+    async def fetch():
         response = await octokit.request('GET', '/search/repositories', params)
-        logging.info(f"Page: {params['page'] - 1}, Repositories: {response['items']}")
+        page = {
+            'total_count': response.get('total_count', 0),
+            'items': [{**{field: item.get(field) for field in SEARCH_ITEM_FIELDS},
+                       'owner': {'avatar_url': item.get('owner', {}).get('avatar_url')}}
+                      for item in response['items']],
+        }
+        await _search_cache.set(key, page)
+        return page
+
+    return await _search_flights.do(key, fetch)
+
+
+def related_language_or_topic(query: str) -> str:
+    language = query.split('language:')[1].split(' ')[0] if 'language:' in query else ""
+    topic = query.split('topic:')[1].split(' ')[0] if 'topic:' in query else ""
+
+    if language:
+        return language
+    elif topic:
+        return topic
+    return "Others"
+
+
+def add_items(unique_repos: dict, items: List[dict], related: str) -> int:
+    """Add the search items that are not in unique_repos yet, returns how many were new"""
+    added = 0
+    for item in items:
+        if item['id'] not in unique_repos:
+            topics = item.get('topics', [])
+            topics_str = ", ".join(topics) if topics else ""
+
+            unique_repos[item['id']] = {
+                "full_name": item.get('full_name'),
+                "description": item.get('description'),
+                "related_language_or_topic": related,
+                "stargazers_count": item.get('stargazers_count'),
+                "forks_count": item.get('forks_count'),
+                "open_issues_count": item.get('open_issues_count'),
+                "avatar_url": item.get('owner', {}).get('avatar_url'),
+                "language": item.get('language'),
+                "updated_at": item.get('updated_at'),
+                "topics": topics_str
+            }
+            added += 1
+    return added
+
 
+async def search_repositories(octokit: Octokit, 
+                              params: Optional[dict],
+                              max_results: int = SEARCH_MAX_RESULTS):
+    """
+    Collects up to `max_results` repositories for a search query.
+
+    The first page is as large as the whole result set allows, `total_count` then tells us
+    which further pages exist; those are fetched concurrently, a wave at a time, until the
+    results run out or a page brings nothing new.
+    """
+    unique_repos = {}
+    related = related_language_or_topic(params["q"])
+    per_page = min(SEARCH_PER_PAGE, max_results)
+
+    async def fetch_page(page):
+        try:
+            return await cached_search(octokit, {**params, 'per_page': per_page, 'page': page})
+        except Exception as e:
+            raise Exception(f"Error fetching data: {e}")
+
+    response = await fetch_page(1)
+    add_items(unique_repos, response['items'], related)
+    logging.info(f"Page: 1, Repositories: {response['items']}")
+
+    # the search API never returns more than 1000 results for a query
+    wanted = min(response.get('total_count', 0), max_results, 1000)
+    pages = list(range(2, math.ceil(wanted / per_page) + 1))
+    saturated = len(response['items']) < per_page
+
+    while pages and not saturated:
+        wave, pages = pages[:SEARCH_PAGE_CONCURRENCY], pages[SEARCH_PAGE_CONCURRENCY:]
+        responses = await asyncio.gather(*(fetch_page(page) for page in wave))
+        for page, response in zip(wave, responses):
+            logging.info(f"Page: {page}, Repositories: {response['items']}")
+            if add_items(unique_repos, response['items'], related) == 0 or len(response['items']) < per_page:
+                saturated = True
+                break
+
+    # keep the contract of returning at most max_results repositories
+    unique_repos = dict(list(unique_repos.items())[:max_results])
     logging.info(f"Unique Repositories: {unique_repos}")
     return unique_repos
 
+def dedupe(values: List[str]) -> List[str]:
+    """Drop case-insensitive repeats, keeping the first spelling and the order"""
+    seen = set()
+    unique = []
+    for value in values:
+        if value.lower() not in seen:
+            seen.add(value.lower())
+            unique.append(value)
+    return unique
+
+
 # Define the main function
 async def main(language_topics,
                access_token: str,
@@ -80,43 +175,43 @@ async def main(language_topics,
         languages = extra_languages + languages if extra_languages else languages
         topics = extra_topics + languages if extra_topics else languages
 
-        tasks = []
+        queries = []
         print("Fetching repositories using main....")
-        for language in languages[:5]:
+        for language in dedupe(languages)[:5]:
             logger.info(f"Searching for {language} repositories")
             base_params = {
                 'q': f'stars:>=2000 forks:>=500 language:{language} pushed:>=2024-03-01',
                 'sort': 'stars',
                 'order': 'desc',
-                'per_page': 7,
-                'page': 1,
             }
 
             help_wanted_params = base_params.copy()
             help_wanted_params['q'] += ' help-wanted-issues:>2'
-            tasks.append(asyncio.create_task(search_repositories(octokit, help_wanted_params)))
+            queries.append(help_wanted_params)
 
             good_first_issues_params = base_params.copy()
             good_first_issues_params['q'] += ' good-first-issues:>2'
-            tasks.append(asyncio.create_task(search_repositories(octokit, good_first_issues_params)))
+            queries.append(good_first_issues_params)
 
-        for topic in topics[:7]:
+        for topic in dedupe(topics)[:7]:
             logger.info(f"Searching for {topic} repositories")
             base_params = {
                 'q': f'stars:>=2000 forks:>=500 topic:{topic} pushed:>2024-01-01',
                 'sort': 'stars',
                 'order': 'desc',
-                'per_page': 7,
-                'page': 1,
             }
 
             help_wanted_params = base_params.copy()
             help_wanted_params['q'] += ' help-wanted-issues:>1'
-            tasks.append(asyncio.create_task(search_repositories(octokit, help_wanted_params)))
+            queries.append(help_wanted_params)
 
             good_first_issues_params = base_params.copy()
             good_first_issues_params['q'] += ' good-first-issues:>1'
-            tasks.append(asyncio.create_task(search_repositories(octokit, good_first_issues_params)))
+            queries.append(good_first_issues_params)
+
+        # the same query can come from several of the inputs, run it only once
+        unique_queries = {search_query_key(params): params for params in queries}
+        tasks = [asyncio.create_task(search_repositories(octokit, params)) for params in unique_queries.values()]
 
         results = await asyncio.gather(*tasks)
         for result in results:
@@ -125,10 +220,10 @@ async def main(language_topics,
     
     logger.info(f"Found {len(unique_repos)} unique repositories\n--------")
 
-    chroma_db = get_chromadb_collection()
+    chroma_db = await run_chroma(get_chromadb_collection)
     try:
         print("Upserting data to ChromaDB....")
-        upsert_to_chroma_db(chroma_db, unique_repos)
+        await upsert_to_chroma_db(chroma_db, unique_repos)
     except Exception as e:
         raise Exception(f"Error upserting data to ChromaDB: {e}")
     
@@ -136,6 +231,9 @@ async def main(language_topics,
 
 
 if __name__ == '__main__':
+    # only when run as a script, importing the package must not redirect the app's logging
+    logging.basicConfig(filename='repository_search.log', level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
     language_topics = {'languages': ['Python'], 
                        'topics': ['llm-agent', 'agentic-agi', 'agentic']}
     
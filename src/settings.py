@@ -1,5 +1,148 @@
 import os
+import json
 from datetime import timedelta
 
 
 DEBUG = False
+
+# Embedding pipeline: Azure caps a single embeddings request by the number of
+# inputs and by the total number of tokens, so batches are split on both.
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 16))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", 8000))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", 4))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", 3))
+EMBEDDING_RETRY_BACKOFF = float(os.getenv("EMBEDDING_RETRY_BACKOFF", 1.0))
+# Shortened vectors (text-embedding-3 `dimensions`), 0 keeps the model's full size. This is
+# the size of newly created collections; queries follow the size of the collection in use.
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", 0)) or None
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Content-addressed embedding cache shared by ingestion and queries
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(PROJECT_DIR, ".cache", "embeddings.sqlite3"))
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", 10000))
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+# chromadb's clients are synchronous, their calls run on a bounded thread pool
+CHROMA_MAX_WORKERS = int(os.getenv("CHROMA_MAX_WORKERS", 8))
+# ids per collection.get when reading back stored metadata during ingestion
+CHROMA_GET_BATCH_SIZE = int(os.getenv("CHROMA_GET_BATCH_SIZE", 500))
+
+# chroma (HTTP server, or a local PersistentClient in DEBUG) or numpy, an exact
+# brute-force index memory-mapped from VECTOR_INDEX_PATH and shared by all workers
+VECTOR_STORE = os.getenv("VECTOR_STORE", "chroma")
+VECTOR_INDEX_PATH = os.getenv("VECTOR_INDEX_PATH", os.path.join(PROJECT_DIR, ".cache", "vector_index"))
+# none, float16 or int8: quantized numpy indexes store float16 vectors instead of float32;
+# int8 scans int8 codes and re-scores the best VECTOR_RESCORE_FACTOR * n_results candidates
+# against the float16 vectors
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+VECTOR_RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", 4))
+# alias (or plain name) of the repository collection, see src/migrate_embeddings.py
+VECTOR_COLLECTION = os.getenv("VECTOR_COLLECTION", "projects")
+VECTOR_ALIAS_REFRESH = float(os.getenv("VECTOR_ALIAS_REFRESH", 60))
+
+# restrict recommend's vector queries to repos of the user's languages and topics,
+# queries with too few filtered matches are re-run unfiltered
+RECOMMEND_METADATA_FILTER = os.getenv("RECOMMEND_METADATA_FILTER", "true").lower() == "true"
+
+# Re-ranking of the retrieved candidates (src/ranking.py): each query over-fetches
+# RANKING_OVERFETCH times the results it keeps, then every candidate is scored on these
+# features, each in [0, 1]. Override with e.g. RANKING_WEIGHTS='{"recency": 0.3}'.
+RANKING_OVERFETCH = int(os.getenv("RANKING_OVERFETCH", 3))
+RANKING_WEIGHTS = {
+    "similarity": 1.0,  # 1 - cosine distance to the query
+    "language": 0.3,    # written in one of the user's languages
+    "topics": 0.5,      # share of the user's languages/topics the repo is tagged with
+    "stars": 0.15,      # log-scaled, relative to the best candidate
+    "forks": 0.05,
+    "issues": 0.05,     # open issues, a sign of an active project
+    "recency": 0.15,    # halves every RANKING_RECENCY_HALF_LIFE_DAYS since updated_at
+    **json.loads(os.getenv("RANKING_WEIGHTS", "{}")),
+}
+RANKING_RECENCY_HALF_LIFE_DAYS = float(os.getenv("RANKING_RECENCY_HALF_LIFE_DAYS", 180))
+# Maximal Marginal Relevance over the ranked candidates fills the first MMR_RESULTS slots:
+# 1.0 is pure relevance, lower values push near-duplicate repos down. Past the time
+# budget (seconds) the remaining slots are filled by relevance alone.
+MMR_RESULTS = int(os.getenv("MMR_RESULTS", 20))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", 0.7))
+MMR_TIME_BUDGET = float(os.getenv("MMR_TIME_BUDGET", 0.005))
+
+# Whole /api/recommendations responses, keyed on the normalized inputs and the user's
+# profile state: fresh for RESPONSE_CACHE_TTL seconds, then served stale for up to
+# RESPONSE_CACHE_STALE_TTL more while they are recomputed in the background
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 600))
+RESPONSE_CACHE_STALE_TTL = int(os.getenv("RESPONSE_CACHE_STALE_TTL", 3600))
+# how long a worker may hold the lock on computing one response
+RESPONSE_CACHE_LOCK_TIMEOUT = int(os.getenv("RESPONSE_CACHE_LOCK_TIMEOUT", 30))
+
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+# one bounded pool per process; when it is exhausted callers wait REDIS_POOL_TIMEOUT seconds.
+# The socket timeout must stay above the ingestion queue's 5 second BRPOP.
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 32))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 2))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 10))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", 1))
+# API read-through caches: a stored recommendation never changes, a user's list does
+RECOMMENDATION_CACHE_TTL = int(os.getenv("RECOMMENDATION_CACHE_TTL", 24 * 3600))
+USER_RECOMMENDATIONS_CACHE_TTL = int(os.getenv("USER_RECOMMENDATIONS_CACHE_TTL", 600))
+
+# Write-behind persistence of generated recommendations (src/models.py): a batch is written
+# once RECOMMENDATION_WRITE_BATCH_SIZE records wait or every RECOMMENDATION_WRITE_INTERVAL
+# seconds. Failed batches are retried, records are dropped after RECOMMENDATION_WRITE_RETRIES.
+RECOMMENDATION_WRITE_BATCH_SIZE = int(os.getenv("RECOMMENDATION_WRITE_BATCH_SIZE", 100))
+RECOMMENDATION_WRITE_INTERVAL = float(os.getenv("RECOMMENDATION_WRITE_INTERVAL", 0.5))
+RECOMMENDATION_WRITE_RETRIES = int(os.getenv("RECOMMENDATION_WRITE_RETRIES", 5))
+# a batch only leaves the queue once it is in the journal
+RECOMMENDATION_WRITE_JOURNAL = os.getenv("RECOMMENDATION_WRITE_JOURNAL", "true").lower() == "true"
+
+# repo metadata shared by all stored recommendations (src/catalog.py), the hottest repos
+# are kept in process; their stars and descriptions may lag by REPO_CATALOG_CACHE_TTL seconds
+REPO_CATALOG_CACHE_SIZE = int(os.getenv("REPO_CATALOG_CACHE_SIZE", 10000))
+REPO_CATALOG_CACHE_TTL = int(os.getenv("REPO_CATALOG_CACHE_TTL", 3600))
+
+# Conditional-request (ETag) cache for GitHub API responses: memory, redis or none
+OCTOKIT_CACHE_BACKEND = os.getenv("OCTOKIT_CACHE_BACKEND", "memory").lower()
+OCTOKIT_CACHE_MAX_ENTRIES = int(os.getenv("OCTOKIT_CACHE_MAX_ENTRIES", 5000))
+OCTOKIT_CACHE_TTL = int(os.getenv("OCTOKIT_CACHE_TTL", 7 * 24 * 3600))
+
+# GitHub request scheduling, shared by every task using the same token
+OCTOKIT_MAX_CONCURRENCY = int(os.getenv("OCTOKIT_MAX_CONCURRENCY", 8))
+OCTOKIT_MAX_RETRIES = int(os.getenv("OCTOKIT_MAX_RETRIES", 4))
+OCTOKIT_RETRY_BACKOFF = float(os.getenv("OCTOKIT_RETRY_BACKOFF", 1.0))
+OCTOKIT_SECONDARY_BACKOFF = float(os.getenv("OCTOKIT_SECONDARY_BACKOFF", 60.0))
+# schedulers kept for distinct tokens, and for how long an idle one is remembered
+OCTOKIT_SCHEDULER_MAX_TOKENS = int(os.getenv("OCTOKIT_SCHEDULER_MAX_TOKENS", 1000))
+OCTOKIT_SCHEDULER_TTL = int(os.getenv("OCTOKIT_SCHEDULER_TTL", 3600))
+
+# languages_url lookups in flight at once while building a user's profile
+GITHUB_LANGUAGES_CONCURRENCY = int(os.getenv("GITHUB_LANGUAGES_CONCURRENCY", 8))
+
+# how a user's profile is fetched: rest (1 + N calls) or graphql (one paginated query)
+GITHUB_PROFILE_BACKEND = os.getenv("GITHUB_PROFILE_BACKEND", "rest").lower()
+
+# repository search: results kept per query, page size and pages fetched at once
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", 21))
+SEARCH_PER_PAGE = int(os.getenv("SEARCH_PER_PAGE", 100))
+SEARCH_PAGE_CONCURRENCY = int(os.getenv("SEARCH_PAGE_CONCURRENCY", 3))
+
+# search result cache: memory, or redis for memory plus a Redis tier shared by all workers
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 3600))
+SEARCH_CACHE_BACKEND = os.getenv("SEARCH_CACHE_BACKEND", "memory").lower()
+
+# Background corpus growth: requests queue crawls for languages/topics with fewer than
+# INGESTION_MIN_COVERAGE repos, workers (python -m src.ingestion) consume the queue.
+# The local backend runs the queue and one worker inside the API process.
+INGESTION_QUEUE_BACKEND = os.getenv("INGESTION_QUEUE_BACKEND", "local").lower()
+INGESTION_QUEUE_NAME = os.getenv("INGESTION_QUEUE_NAME", "ingestion:jobs")
+INGESTION_MIN_COVERAGE = int(os.getenv("INGESTION_MIN_COVERAGE", 10))
+INGESTION_DEDUPE_TTL = int(os.getenv("INGESTION_DEDUPE_TTL", 6 * 3600))
+
+# azure, or hashing for the in-process CPU embedder (no network). The providers produce
+# different vector spaces, switching needs a re-embedded collection.
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "azure").lower()
+HASHING_EMBEDDING_DIMENSIONS = int(os.getenv("HASHING_EMBEDDING_DIMENSIONS", 1024))
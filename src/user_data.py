@@ -1,24 +1,117 @@
 import os
 import aiohttp
 import asyncio
-from .octokit import Octokit
+from .octokit import Octokit, GraphQLError
 from datetime import datetime
 from aiohttp import ClientSession
 from .models import get_user_collection
+from .settings import GITHUB_LANGUAGES_CONCURRENCY, GITHUB_PROFILE_BACKEND
 from dotenv import load_dotenv
 load_dotenv()
 import logging
 
 logger = logging.getLogger(__name__)
 
+REPO_LIMIT = 15
+
+# One query returns the repos with their language breakdown and topics, instead of
+# one REST call for the list and one per repo for its languages.
+USER_REPOS_QUERY = """
+query($login: String!, $first: Int!, $after: String) {
+  user(login: $login) {
+    repositories(first: $first, after: $after, ownerAffiliations: OWNER, orderBy: {field: NAME, direction: ASC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        name
+        description
+        isFork
+        pushedAt
+        primaryLanguage { name }
+        languages(first: 20, orderBy: {field: SIZE, direction: DESC}) { edges { node { name } } }
+        repositoryTopics(first: 20) { nodes { topic { name } } }
+      }
+    }
+  }
+}
+"""
+
+
+async def fetch_repos_rest(octokit: Octokit, username: str, repo_limit: int = REPO_LIMIT):
+    """
+    Fetches the qualifying repositories of the user through the REST API
+    """
+    url = f'/users/{username}/repos'
+
+    # walk the pages only until enough qualifying repos are found
+    qualifying_repos = []
+    async for repos_data in octokit.paginate('GET', url, {'per_page': 100}):
+        for repo in repos_data:
+            if not repo['fork'] and (repo['description'] or repo['language'] or len(repo['topics'])>0):
+                qualifying_repos.append(repo)
+                if len(qualifying_repos) >= repo_limit:
+                    break
+        if len(qualifying_repos) >= repo_limit:
+            break
+
+    # fetch the language breakdowns concurrently, a bounded number at a time
+    semaphore = asyncio.Semaphore(GITHUB_LANGUAGES_CONCURRENCY)
+
+    async def fetch_languages(repo):
+        language_url = repo['languages_url'].replace('https://api.github.com', '')
+        async with semaphore:
+            return await octokit.request('GET', language_url)
+
+    languages_per_repo = await asyncio.gather(*(fetch_languages(repo) for repo in qualifying_repos))
+
+    return [{
+        'name': repo['name'],
+        'description': repo['description'],
+        'languages': list(languages_data.keys()),
+        'topics': repo['topics'],
+        'pushed_at': repo.get('pushed_at'),
+    } for repo, languages_data in zip(qualifying_repos, languages_per_repo)]
+
+
+async def fetch_repos_graphql(octokit: Octokit, username: str, repo_limit: int = REPO_LIMIT):
+    """
+    Fetches the qualifying repositories of the user through the GraphQL API
+    """
+    qualifying_repos = []
+    cursor = None
+    while len(qualifying_repos) < repo_limit:
+        data = await octokit.graphql(USER_REPOS_QUERY, {'login': username, 'first': 50, 'after': cursor})
+        if not data.get('user'):
+            break
+        repositories = data['user']['repositories']
+
+        for repo in repositories['nodes']:
+            topics = [node['topic']['name'] for node in repo['repositoryTopics']['nodes']]
+            if not repo['isFork'] and (repo['description'] or repo['primaryLanguage'] or len(topics)>0):
+                qualifying_repos.append({
+                    'name': repo['name'],
+                    'description': repo['description'],
+                    'languages': [edge['node']['name'] for edge in repo['languages']['edges']],
+                    'topics': topics,
+                    'pushed_at': repo.get('pushedAt'),
+                })
+                if len(qualifying_repos) >= repo_limit:
+                    break
+
+        if not repositories['pageInfo']['hasNextPage']:
+            break
+        cursor = repositories['pageInfo']['endCursor']
+
+    return qualifying_repos
 
-async def get_repos(user):
+
+async def get_repos(user, backend: str = None):
     """
     Fetches the repositories of the user
     """
     user_details = []
     language_topics = {}
-    
+    backend = backend or GITHUB_PROFILE_BACKEND
+
     try:
         async with ClientSession() as session:
             if not user.access_token:
@@ -26,46 +119,38 @@ async def get_repos(user):
 
             octokit = Octokit(user.access_token, session)
 
-            # To store the unique data of the user 
+            # To store the unique data of the user
             languages_map = {} # store the freq of the languages
             topics_map = {}
 
-            url = f'/users/{user.username}/repos'
-            repos_data = await octokit.request('GET', url)
-
-            repo_limit = 15
-            cnt = 0
+            if backend == 'graphql':
+                repos = await fetch_repos_graphql(octokit, user.username)
+            else:
+                repos = await fetch_repos_rest(octokit, user.username)
 
             # iterates through every repository of the user data
-            for repo in repos_data:
-                if cnt >= repo_limit:
-                    break
-                
-                if not repo['fork'] and (repo['description'] or repo['language'] or len(repo['topics'])>0):
-                    language_url = repo['languages_url'].replace('https://api.github.com', '')
-                    languages_data = await octokit.request('GET', language_url)
-
-                    user_repo = {
-                        'project_name' : repo['name'],
-                        'description' : repo['description'],
-                        "related_language_or_topic": list(languages_data.keys()),
-                    }
-                    user_details.append(user_repo)
-
-                    for lang in languages_data.keys():
-                        languages_map[lang] = languages_map.get(lang, 0) + 1
-
-                    for topic in repo['topics']:
-                        topics_map[topic] = topics_map.get(topic, 0) + 1
-                    
-                    cnt += 1
+            for repo in repos:
+                user_repo = {
+                    'project_name' : repo['name'],
+                    'description' : repo['description'],
+                    "related_language_or_topic": repo['languages'],
+                    # changes on every push, part of the response cache fingerprint
+                    "pushed_at": repo.get('pushed_at'),
+                }
+                user_details.append(user_repo)
+
+                for lang in repo['languages']:
+                    languages_map[lang] = languages_map.get(lang, 0) + 1
+
+                for topic in repo['topics']:
+                    topics_map[topic] = topics_map.get(topic, 0) + 1
 
             # return the top5 languages
             top5_languages = user.languages + sorted(languages_map, key=languages_map.get, reverse=True)[:5] if user.languages else sorted(languages_map, key=languages_map.get, reverse=True)[:5]
             top_topics = user.extra_topics + sorted(topics_map, key=topics_map.get, reverse=True)[:7] if user.extra_topics else sorted(topics_map, key=topics_map.get, reverse=True)[:7]
             language_topics = {"languages" : list(top5_languages), "topics" : list(top_topics)}
 
-    except aiohttp.ClientError as e:
+    except (aiohttp.ClientError, GraphQLError) as e:
         logger.info(f"Error fetching data: {e}")
 
     return user_details, language_topics
@@ -0,0 +1,416 @@
+import os
+import json
+import fcntl
+import shutil
+import uuid
+import logging
+import threading
+import numpy as np
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def match_where(where: Optional[dict], columns: Dict[str, list], n: int) -> np.ndarray:
+    """Boolean row mask for the subset of Chroma's `where` syntax we use ($eq, $ne, $in, $nin, $gt(e), $lt(e), $and, $or)"""
+    if not where:
+        return np.ones(n, dtype=bool)
+
+    masks = []
+    for field, condition in where.items():
+        if field == "$and":
+            masks.append(np.logical_and.reduce([match_where(c, columns, n) for c in condition]))
+        elif field == "$or":
+            masks.append(np.logical_or.reduce([match_where(c, columns, n) for c in condition]))
+        else:
+            values = columns.get(field, [None] * n)
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for op, target in condition.items():
+                if op == "$eq":
+                    masks.append(np.array([v == target for v in values], dtype=bool))
+                elif op == "$ne":
+                    masks.append(np.array([v != target for v in values], dtype=bool))
+                elif op == "$in":
+                    targets = set(target)
+                    masks.append(np.array([v in targets for v in values], dtype=bool))
+                elif op == "$nin":
+                    targets = set(target)
+                    masks.append(np.array([v not in targets for v in values], dtype=bool))
+                elif op in ("$gt", "$gte", "$lt", "$lte"):
+                    column = np.array([v if isinstance(v, (int, float)) else np.nan for v in values], dtype=float)
+                    with np.errstate(invalid="ignore"):
+                        masks.append({"$gt": column > target, "$gte": column >= target,
+                                      "$lt": column < target, "$lte": column <= target}[op])
+                else:
+                    raise ValueError(f"Unsupported where operator: {op}")
+    return np.logical_and.reduce(masks) if masks else np.ones(n, dtype=bool)
+
+
+def read_json(path: str) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_json(path: str, value):
+    # write-then-rename, readers never see a half-written file
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+def quantize(matrix: np.ndarray, quantization: str):
+    """Compressed codes (and per-row scales for int8) for the coarse search pass"""
+    if quantization == "float16":
+        return matrix.astype(np.float16), None
+    if quantization == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales = np.maximum(scales, 1e-12).astype(np.float32)
+        codes = np.round(matrix / scales[:, None]).astype(np.int8)
+        return codes, scales
+    raise ValueError(f"Unknown quantization: {quantization}")
+
+
+class Snapshot:
+    """One generation of a NumpyCollection, never modified once published"""
+
+    def __init__(self, ids=None, documents=None, columns=None, matrix=None, codes=None, scales=None,
+                 files=(), version=None):
+        self.ids = ids or []
+        self.documents = documents or []
+        self.columns = columns or {}
+        self.matrix = matrix if matrix is not None else np.zeros((0, 0), dtype=np.float32)
+        self.codes = codes
+        self.scales = scales
+        self.index = {id_: i for i, id_ in enumerate(self.ids)}
+        # the .npy files of this generation
+        self.files = set(files)
+        self.version = version
+
+    def metadata_row(self, i: int) -> dict:
+        return {field: values[i] for field, values in self.columns.items() if values[i] is not None}
+
+
+class NumpyCollection:
+    """
+    Exact in-memory vector index with the subset of the Chroma collection API we use.
+
+    Embeddings are L2-normalized float32 rows of a `.npy` file opened with mmap, so every
+    worker process on the host shares the same pages. Ids, documents and metadata are kept
+    column-wise in `metadata.json`. Cosine distances for a batch of queries come from a
+    single matmul, top-k from `argpartition`.
+
+    With `quantization` set to float16 or int8 (per-row scale) no float32 copy is kept: the
+    stored matrix is float16, half the disk and page cache. float16 queries scan it directly;
+    int8 queries scan the int8 codes and re-score the best `rescore_factor * n_results`
+    candidates against the float16 rows, which are then only paged in for those candidates.
+    Neither mode re-scores at full precision: their distances are float16-accurate (about
+    1e-3), which leaves the ranking unchanged except between near-ties.
+
+    Writes rewrite the matrix to a new file and then atomically swap `metadata.json`, which
+    names the matrix file; readers notice the swap on their next call and remap. Each load
+    publishes a new Snapshot with one assignment, every read works on the snapshot it
+    started with. The previous generation's files are kept until the next write, so a
+    process that read the old `metadata.json` can still map them.
+    """
+
+    def __init__(self, path: str, quantization: str = "none", rescore_factor: int = 4):
+        if quantization not in ("none", "float16", "int8"):
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.path = path
+        self.name = os.path.basename(os.path.normpath(path))
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._snapshot = Snapshot()
+        self._load()
+        self.metadata = read_json(os.path.join(path, "collection.json"))
+
+    def modify(self, metadata: Optional[dict] = None):
+        """Replace the collection-level metadata, as Chroma's Collection.modify does"""
+        if metadata is not None:
+            write_json(os.path.join(self.path, "collection.json"), metadata)
+            self.metadata = metadata
+
+    @property
+    def _metadata_path(self) -> str:
+        return os.path.join(self.path, "metadata.json")
+
+    def _read_snapshot(self, version) -> Snapshot:
+        with open(self._metadata_path) as f:
+            state = json.load(f)
+        files = [state[kind] for kind in ("matrix", "codes", "scales") if state.get(kind)]
+        matrix = np.load(os.path.join(self.path, state["matrix"]), mmap_mode="r")
+        codes, scales = None, None
+        if self.quantization == "float16" and matrix.dtype == np.float16:
+            # the stored matrix is the scan itself
+            codes = matrix
+        elif self.quantization != "none":
+            if state.get("quantization") == self.quantization and state.get("codes"):
+                codes = np.load(os.path.join(self.path, state["codes"]), mmap_mode="r")
+                if state.get("scales"):
+                    scales = np.load(os.path.join(self.path, state["scales"]), mmap_mode="r")
+            else:
+                # written by a process with another setting, quantize privately until the next write
+                codes, scales = quantize(np.asarray(matrix, dtype=np.float32), self.quantization)
+        return Snapshot(state["ids"], state["documents"], state["metadatas"], matrix, codes, scales,
+                        files=files, version=version)
+
+    def _load(self, attempts: int = 3) -> Snapshot:
+        """Publish the generation on disk if it is newer than ours; call with the lock held"""
+        for attempt in range(attempts):
+            try:
+                stat = os.stat(self._metadata_path)
+            except FileNotFoundError:
+                if self._snapshot.version is not None:
+                    self._snapshot = Snapshot()
+                return self._snapshot
+            # os.replace gives every write a new inode
+            version = (stat.st_ino, stat.st_mtime_ns)
+            if version == self._snapshot.version:
+                return self._snapshot
+            try:
+                self._snapshot = self._read_snapshot(version)
+                return self._snapshot
+            except FileNotFoundError:
+                # two writes landed between reading metadata.json and mapping its files
+                if attempt == attempts - 1:
+                    raise
+                logger.info(f"{self.path} changed while loading, retrying")
+        return self._snapshot
+
+    def _refresh(self) -> Snapshot:
+        """Pick up writes made by other processes, returns the snapshot to read from"""
+        with self._lock:
+            return self._load()
+
+    # the current generation, for callers outside the read path
+    @property
+    def ids(self) -> List[str]:
+        return self._snapshot.ids
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._snapshot.matrix
+
+    @property
+    def codes(self) -> Optional[np.ndarray]:
+        return self._snapshot.codes
+
+    @property
+    def scales(self) -> Optional[np.ndarray]:
+        return self._snapshot.scales
+
+    def count(self) -> int:
+        return len(self._refresh().ids)
+
+    @staticmethod
+    def _normalize(embeddings) -> np.ndarray:
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def _write(self, ids, matrix, documents, columns):
+        version = uuid.uuid4().hex
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        # quantized indexes re-score from float16, a float32 copy would outweigh the codes
+        arrays = {"matrix": matrix if self.quantization == "none" else matrix.astype(np.float16)}
+        if self.quantization == "int8":
+            arrays["codes"], arrays["scales"] = quantize(matrix, self.quantization)
+
+        state = {"quantization": self.quantization, "ids": ids, "documents": documents, "metadatas": columns}
+        for kind, array in arrays.items():
+            if array is not None:
+                state[kind] = f"{kind}-{version}.npy"
+                np.save(os.path.join(self.path, state[kind]), array)
+        write_json(self._metadata_path, state)
+        logger.info(f"Wrote {len(ids)} vectors to {self.path}")
+
+        # the generation just replaced stays on disk for readers that are about to map it,
+        # mapped files stay alive after removal until every process remaps
+        keep = {state[kind] for kind in arrays if kind in state} | self._snapshot.files
+        for name in os.listdir(self.path):
+            if name.endswith(".npy") and name not in keep:
+                os.remove(os.path.join(self.path, name))
+        self._load()
+
+    def _apply(self, ids, embeddings=None, documents=None, metadatas=None, insert=True, replace=True):
+        # the file lock serializes writers across processes (API workers, ingestion workers, imports)
+        with self._lock, open(os.path.join(self.path, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            snapshot = self._load()
+            new_rows = np.asarray(embeddings) if embeddings is not None else None
+            if new_rows is not None:
+                new_rows = self._normalize(new_rows)
+            matrix = np.array(snapshot.matrix, dtype=np.float32)
+            if matrix.size == 0 and new_rows is not None:
+                matrix = np.zeros((0, new_rows.shape[1]), dtype=np.float32)
+            all_ids = list(snapshot.ids)
+            all_documents = list(snapshot.documents)
+            columns = {field: list(values) for field, values in snapshot.columns.items()}
+            index = dict(snapshot.index)
+            appended = []
+
+            for j, id_ in enumerate(ids):
+                metadata = metadatas[j] if metadatas is not None else None
+                i = index.get(id_)
+                if i is None:
+                    if not insert or new_rows is None:
+                        continue
+                    i = len(all_ids)
+                    index[id_] = i
+                    all_ids.append(id_)
+                    all_documents.append(None)
+                    for values in columns.values():
+                        values.append(None)
+                    appended.append(new_rows[j])
+                elif not replace:
+                    continue
+                elif new_rows is not None:
+                    matrix[i] = new_rows[j]
+
+                if documents is not None:
+                    all_documents[i] = documents[j]
+                if metadata is not None:
+                    for field in set(columns) | set(metadata):
+                        columns.setdefault(field, [None] * len(all_ids))[i] = metadata.get(field)
+
+            if appended:
+                matrix = np.vstack([matrix, np.stack(appended)])
+            self._write(all_ids, matrix, all_documents, columns)
+
+    def add(self, ids, embeddings, documents=None, metadatas=None):
+        # like Chroma, ids that already exist are left alone
+        self._apply(ids, embeddings, documents, metadatas, insert=True, replace=False)
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        self._apply(ids, embeddings, documents, metadatas, insert=True, replace=True)
+
+    def update(self, ids, embeddings=None, documents=None, metadatas=None):
+        self._apply(ids, embeddings, documents, metadatas, insert=False, replace=True)
+
+    @staticmethod
+    def _score(snapshot: Snapshot, queries: np.ndarray, block_size: int = 16384) -> np.ndarray:
+        """Cosine similarity of every query to every row, approximate when quantized"""
+        if snapshot.codes is None:
+            # one BLAS call scores every query against every row
+            return queries @ snapshot.matrix.T
+
+        n = len(snapshot.ids)
+        similarities = np.empty((len(queries), n), dtype=np.float32)
+        # BLAS has no int8/float16 kernels, upcast one block at a time
+        for start in range(0, n, block_size):
+            block = snapshot.codes[start:start + block_size].astype(np.float32)
+            similarities[:, start:start + block_size] = queries @ block.T
+        if snapshot.scales is not None:
+            similarities *= snapshot.scales[None, :]
+        return similarities
+
+    @staticmethod
+    def _rows(snapshot: Snapshot, rows, include) -> dict:
+        result = {"ids": [snapshot.ids[i] for i in rows]}
+        if "metadatas" in include:
+            result["metadatas"] = [snapshot.metadata_row(i) for i in rows]
+        if "documents" in include:
+            result["documents"] = [snapshot.documents[i] for i in rows]
+        if "embeddings" in include:
+            result["embeddings"] = [snapshot.matrix[i].tolist() for i in rows]
+        return result
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("metadatas", "documents")):
+        snapshot = self._refresh()
+        if ids is not None:
+            rows = [snapshot.index[id_] for id_ in ids if id_ in snapshot.index]
+        else:
+            rows = list(range(len(snapshot.ids)))
+        if where:
+            mask = match_where(where, snapshot.columns, len(snapshot.ids))
+            rows = [i for i in rows if mask[i]]
+        if offset:
+            rows = rows[offset:]
+        if limit is not None:
+            rows = rows[:limit]
+        return self._rows(snapshot, rows, include)
+
+    def query(self, query_embeddings, n_results=10, where=None, include=("metadatas", "documents", "distances")):
+        snapshot = self._refresh()
+        queries = self._normalize(query_embeddings)
+        result = {"ids": [], "distances": [], "metadatas": [], "documents": [], "embeddings": []}
+        if len(snapshot.ids) == 0:
+            for key in result:
+                result[key] = [[] for _ in range(len(queries))]
+            return result
+
+        similarities = self._score(snapshot, queries)
+        if where:
+            mask = match_where(where, snapshot.columns, len(snapshot.ids))
+            similarities[:, ~mask] = -np.inf
+            available = int(mask.sum())
+        else:
+            available = len(snapshot.ids)
+        k = min(n_results, available)
+
+        for query, scores in zip(queries, similarities):
+            if k == 0:
+                top = np.array([], dtype=np.intp)
+            elif snapshot.codes is None or snapshot.codes is snapshot.matrix:
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                # coarse pass on the codes, then finer scores for the shortlist
+                shortlist = min(k * self.rescore_factor, available)
+                top = np.argpartition(-scores, shortlist - 1)[:shortlist]
+                top = np.sort(top) # sequential reads from the mmap
+                scores = np.full(len(scores), -np.inf, dtype=np.float32)
+                scores[top] = snapshot.matrix[top].astype(np.float32) @ query
+                top = top[np.argpartition(-scores[top], k - 1)[:k]]
+            top = top[np.argsort(-scores[top])]
+            rows = self._rows(snapshot, top.tolist(), include)
+            result["ids"].append(rows["ids"])
+            result["distances"].append((1.0 - scores[top]).tolist())
+            for key in ("metadatas", "documents", "embeddings"):
+                result[key].append(rows.get(key))
+        return {key: value for key, value in result.items() if key == "ids" or key in include}
+
+
+class NumpyClient:
+    """A directory of NumpyCollections, with the collection management calls of a Chroma client"""
+
+    def __init__(self, path: str, quantization: str = "none", rescore_factor: int = 4):
+        self.path = path
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        os.makedirs(path, exist_ok=True)
+
+    def _open(self, name: str) -> NumpyCollection:
+        return NumpyCollection(os.path.join(self.path, name), self.quantization, self.rescore_factor)
+
+    def list_collections(self) -> List[str]:
+        """Collection names, as chromadb >= 0.6 lists them, without loading any collection"""
+        return [name for name in sorted(os.listdir(self.path)) if os.path.isdir(os.path.join(self.path, name))]
+
+    def get_collection(self, name: str) -> NumpyCollection:
+        if not os.path.isdir(os.path.join(self.path, name)):
+            raise ValueError(f"Collection {name} does not exist.")
+        return self._open(name)
+
+    def get_or_create_collection(self, name: str, metadata: Optional[dict] = None) -> NumpyCollection:
+        """Like Chroma, `metadata` is only stored on a new collection, an existing one keeps its own"""
+        try:
+            os.mkdir(os.path.join(self.path, name))
+            created = True
+        except FileExistsError:
+            created = False
+        collection = self._open(name)
+        if created:
+            collection.modify(metadata=metadata)
+        return collection
+
+    def delete_collection(self, name: str):
+        shutil.rmtree(os.path.join(self.path, name))
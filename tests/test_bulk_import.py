@@ -0,0 +1,56 @@
+import json
+import asyncio
+import pytest
+from src import bulk_import
+
+
+class RecordingCollection:
+    def __init__(self, fail_on_call=None):
+        self.ids = []
+        self.calls = 0
+        self.fail_on_call = fail_on_call
+
+
+def write_dump(path):
+    lines = []
+    for i in range(7):
+        lines.append({"id": i, "full_name": f"owner/repo{i}", "description": "d", "topics": ["x", "y"],
+                      "language": "Go", "stargazers_count": 10, "owner": {"avatar_url": "a"}})
+    # a GitHub Archive event and an event without a repository payload
+    lines.append({"type": "PullRequestEvent", "repo": {"id": 100, "name": "org/pr"},
+                  "payload": {"pull_request": {"base": {"repo": {"id": 100, "full_name": "org/pr"}}}}})
+    lines.append({"type": "WatchEvent", "repo": {"id": 101, "name": "org/watch"}, "payload": {}})
+    path.write_text("\n".join(json.dumps(line) for line in lines) + "\n")
+
+
+def test_bulk_import_streams_chunks_and_resumes(monkeypatch, tmp_path):
+    dump = tmp_path / "repos.jsonl"
+    write_dump(dump)
+    collection = RecordingCollection(fail_on_call=3)
+
+    async def fake_upsert(coll, unique_repos):
+        coll.calls += 1
+        if coll.calls == coll.fail_on_call:
+            raise RuntimeError("interrupted")
+        coll.ids.extend(unique_repos)
+
+    monkeypatch.setattr(bulk_import, "upsert_to_chroma_db", fake_upsert)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(bulk_import.bulk_import(str(dump), collection=collection, chunk_size=3))
+    assert collection.ids == ["0", "1", "2", "3", "4", "5"]
+
+    checkpoint = asyncio.run(bulk_import.bulk_import(str(dump), collection=collection, chunk_size=3))
+    assert collection.ids == ["0", "1", "2", "3", "4", "5", "6", "100"]
+    assert checkpoint["rows"] == 9
+    assert checkpoint["imported"] == 8
+    assert checkpoint["offset"] == dump.stat().st_size
+
+
+def test_normalize_record_matches_unique_repos_shape():
+    repo_id, repo = bulk_import.normalize_record(
+        {"id": 1, "full_name": "o/r", "topics": ["a", "b"], "owner": {"avatar_url": "u"}, "language": None})
+    assert repo_id == "1"
+    assert repo["topics"] == "a, b"
+    assert repo["avatar_url"] == "u"
+    assert repo["related_language_or_topic"] == "Others"
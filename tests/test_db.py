@@ -0,0 +1,272 @@
+import time
+import asyncio
+from src import db
+
+
+def repo(name):
+    return {"full_name": name, "description": "", "stargazers_count": 1, "forks_count": 1,
+            "open_issues_count": 1, "avatar_url": "", "language": "Python", "updated_at": "", "topics": ""}
+
+
+class FakeCollection:
+    def __init__(self, results_per_query):
+        self.results_per_query = results_per_query
+        self.queries = []
+
+    def query(self, query_embeddings, n_results, include, where=None):
+        self.queries.append((query_embeddings, n_results))
+        self.include = include
+        return {
+            "metadatas": [self.results_per_query[i][:n_results] for i in range(len(query_embeddings))],
+            "distances": [[0.1] * len(self.results_per_query[i][:n_results]) for i in range(len(query_embeddings))],
+        }
+
+
+def test_recommend_batches_all_projects_into_one_round_trip(monkeypatch):
+    collection = FakeCollection([
+        [repo("a/one"), repo("a/two"), repo("a/three"), repo("a/four"), repo("a/five")],
+        [repo("a/two"), repo("b/one")],
+        [],
+    ])
+    embed_calls = []
+
+    async def fake_embeddings(texts, provider=None):
+        embed_calls.append(texts)
+        return [[0.0]] * len(texts)
+
+    monkeypatch.setattr(db, "get_chromadb_collection", lambda: collection)
+    monkeypatch.setattr(db, "generate_embeddings_batch", fake_embeddings)
+    monkeypatch.setattr(db, "RANKING_OVERFETCH", 1)
+
+    user_details = [
+        {"project_name": "p1", "description": "d1"},
+        {"project_name": "p2", "description": "d2"},
+        {"project_name": "p3", "description": "d3"},
+    ]
+    recommendations = asyncio.run(db.recommend(user_details=user_details,
+                                               languages_topics={"languages": [], "topics": []}))
+
+    assert len(embed_calls) == 1 and len(embed_calls[0]) == 3
+    assert len(collection.queries) == 1
+    # top 4 per project, de-duplicated across projects in query order
+    assert [r["full_name"] for r in recommendations] == ["a/one", "a/two", "a/three", "a/four", "b/one"]
+    assert all(r["distance"] == 0.1 for r in recommendations)
+
+
+def test_recommend_only_fetches_embeddings_when_mmr_runs(monkeypatch):
+    collection = FakeCollection([[repo("a/one")]])
+
+    async def fake_embeddings(texts, provider=None):
+        return [[0.0]] * len(texts)
+
+    monkeypatch.setattr(db, "get_chromadb_collection", lambda: collection)
+    monkeypatch.setattr(db, "generate_embeddings_batch", fake_embeddings)
+    project = [{"project_name": "p1", "description": "d1"}]
+    no_filter = {"languages": [], "topics": []}
+
+    asyncio.run(db.recommend(user_details=project, languages_topics=no_filter))
+    assert "embeddings" in collection.include
+
+    for results, lambda_ in ((20, 1.0), (0, 0.7)):
+        monkeypatch.setattr(db, "MMR_RESULTS", results)
+        monkeypatch.setattr(db, "MMR_LAMBDA", lambda_)
+        asyncio.run(db.recommend(user_details=project, languages_topics=no_filter))
+        assert collection.include == ["metadatas", "distances"]
+
+
+class SlowCollection(FakeCollection):
+    def query(self, query_embeddings, n_results, include, where=None):
+        time.sleep(0.3) # the chromadb client blocks the calling thread
+        return super().query(query_embeddings, n_results, include)
+
+
+def test_concurrent_recommend_calls_overlap(monkeypatch):
+    collection = SlowCollection([[repo("a/one")]])
+
+    async def slow_embeddings(texts, provider=None):
+        await asyncio.sleep(0.3)
+        return [[0.0]] * len(texts)
+
+    monkeypatch.setattr(db, "get_chromadb_collection", lambda: collection)
+    monkeypatch.setattr(db, "generate_embeddings_batch", slow_embeddings)
+
+    async def run_concurrently():
+        languages_topics = {"languages": ["Python"], "topics": []}
+        return await asyncio.gather(*(db.recommend(languages_topics=languages_topics) for _ in range(4)))
+
+    start = time.perf_counter()
+    results = asyncio.run(run_concurrently())
+    elapsed = time.perf_counter() - start
+
+    assert all(r[0]["full_name"] == "a/one" for r in results)
+    # 4 requests x 0.6s of I/O each would take 2.4s if they serialized
+    assert elapsed < 1.2
+
+
+def test_chromadb_collection_is_cached_and_reconnects(monkeypatch):
+    import requests
+    created = []
+
+    class FlakyCollection(FakeCollection):
+        def query(self, **kwargs):
+            if len(created) == 1:
+                raise requests.exceptions.ConnectionError("connection reset")
+            return super().query(**kwargs)
+
+    class Aliases:
+        metadata = None
+
+    class FakeClient:
+        def list_collections(self):
+            return []
+
+        def get_or_create_collection(self, name, metadata=None):
+            if name == db.ALIAS_COLLECTION:
+                return Aliases()
+            created.append(name)
+            collection = FlakyCollection([[repo("a/one")]])
+            collection.name = name
+            return collection
+
+    monkeypatch.setattr(db, "_create_chromadb_client", FakeClient)
+    db.reset_chromadb()
+    try:
+        assert db.get_chromadb_collection() is db.get_chromadb_collection()
+        assert len(created) == 1
+
+        results = asyncio.run(db.query_chromadb(query_embeddings=[[0.0]], n_results=1, include=["metadatas"]))
+        assert results["metadatas"][0][0]["full_name"] == "a/one"
+        assert len(created) == 2
+    finally:
+        db.reset_chromadb()
+
+
+def test_open_collection_creates_a_missing_collection_with_a_real_client(tmp_path):
+    import chromadb
+    client = chromadb.PersistentClient(path=str(tmp_path))
+
+    created = db.open_collection(client, "projects", 256)
+    assert created.metadata == {"hnsw:space": "cosine", "embedding_dimensions": 256}
+    # opening it again, at another configured size, keeps what it was created with
+    created.add(ids=["a"], embeddings=[[0.1] * 256], metadatas=[{"full_name": "a"}])
+    reopened = db.open_collection(client, "projects", 64)
+    assert reopened.metadata["embedding_dimensions"] == 256 and reopened.count() == 1
+
+
+def test_legacy_collection_queries_keep_the_full_size_after_shortening_is_configured(monkeypatch):
+    from src import embeddings
+    monkeypatch.setattr(embeddings, "EMBEDDING_PROVIDER", "hashing")
+    monkeypatch.setattr(embeddings, "_providers", {})
+
+    class Legacy:
+        metadata = {"hnsw:space": "cosine"}
+
+    class Shortened:
+        metadata = {"hnsw:space": "cosine", "embedding_dimensions": 64}
+
+    assert db.collection_embedding_provider(Legacy()).dimensions == embeddings.HASHING_EMBEDDING_DIMENSIONS
+    assert db.collection_embedding_provider(Shortened()).dimensions == 64
+
+
+class IngestCollection:
+    def __init__(self):
+        self.rows = {}
+        self.upserts = []
+        self.updates = []
+
+    def get(self, ids, include):
+        found = [i for i in ids if i in self.rows]
+        return {"ids": found, "metadatas": [self.rows[i] for i in found]}
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.upserts.append(ids)
+        self.rows.update(zip(ids, metadatas))
+
+    def update(self, ids, metadatas):
+        self.updates.append(ids)
+        self.rows.update(zip(ids, metadatas))
+
+
+def test_incremental_upsert_only_embeds_changed_documents(monkeypatch):
+    embedded = []
+
+    async def fake_embeddings(texts, provider=None):
+        embedded.extend(texts)
+        return [[0.0]] * len(texts)
+
+    monkeypatch.setattr(db, "generate_embeddings_batch", fake_embeddings)
+    collection = IngestCollection()
+    repos = {1: {**repo("a/one"), "related_language_or_topic": "Python"},
+             2: {**repo("a/two"), "related_language_or_topic": "Python"}}
+    asyncio.run(db.upsert_to_chroma_db(collection, repos))
+    assert len(embedded) == 2
+
+    embedded.clear()
+    repos[1] = {**repos[1], "stargazers_count": 500}        # metadata only
+    repos[2] = {**repos[2], "description": "now with docs"} # document changed
+    repos[3] = {**repo("a/three"), "related_language_or_topic": "Python"}
+    asyncio.run(db.upsert_to_chroma_db(collection, repos))
+
+    assert collection.upserts[-1] == ["2", "3"]
+    assert collection.updates == [["1"]]
+    assert collection.rows["1"]["stargazers_count"] == 500
+    assert len(embedded) == 2
+
+    # nothing changed, nothing to do
+    embedded.clear()
+    asyncio.run(db.upsert_to_chroma_db(collection, repos))
+    assert embedded == [] and len(collection.upserts) == 2 and len(collection.updates) == 1
+
+
+def test_recommend_filters_on_languages_and_falls_back_when_thin(monkeypatch, tmp_path):
+    from src import embeddings
+    from src.vector_index import NumpyClient
+
+    monkeypatch.setattr(embeddings, "EMBEDDING_PROVIDER", "hashing")
+    monkeypatch.setattr(embeddings, "_providers", {})
+    collection = NumpyClient(str(tmp_path)).get_or_create_collection("projects")
+    monkeypatch.setattr(db, "get_chromadb_collection", lambda: collection)
+    monkeypatch.setattr(db, "RANKING_OVERFETCH", 1)
+
+    # the Python repos are the nearest neighbours of the query text, but not in the user's language
+    unique_repos = {i: {**repo(f"py/web-framework-{i}"), "description": "rust web framework",
+                        "related_language_or_topic": "Python"} for i in range(6)}
+    unique_repos.update({10 + i: {**repo(f"rs/tool-{i}"), "language": "Rust", "description": f"tool {i}",
+                                  "related_language_or_topic": "rust"} for i in range(6)})
+    unique_repos[20] = {**repo("hs/web-server"), "language": "Haskell", "description": "web server",
+                        "related_language_or_topic": "haskell"}
+
+    async def run(languages):
+        await db.upsert_to_chroma_db(collection, unique_repos)
+        return await db.recommend(languages_topics={"languages": languages, "topics": ["web framework"]})
+
+    rust = asyncio.run(run(["Rust"]))
+    assert [r["language"] for r in rust] == ["Rust"] * 5
+
+    # terms match whatever case the user typed them in
+    assert [r["language"] for r in asyncio.run(run(["RUST "]))] == ["Rust"] * 5
+
+    # a single Haskell repo comes first, the rest is filled from the unfiltered query
+    haskell = asyncio.run(run(["Haskell"]))
+    assert haskell[0]["full_name"] == "hs/web-server" and len(haskell) == 5
+    assert {r["language"] for r in haskell[1:]} == {"Python"}
+
+
+def test_http_client_pool_is_sized_when_possible_and_skipped_otherwise(monkeypatch):
+    import requests
+    monkeypatch.setattr(db, "VECTOR_STORE", "chroma")
+    monkeypatch.setattr(db, "DEBUG", False)
+
+    class Server:
+        _session = requests.Session()
+
+    class Client:
+        _server = Server()
+
+    monkeypatch.setattr(db.chromadb, "HttpClient", lambda host, port: Client())
+    client = db._create_chromadb_client()
+    assert client._server._session.get_adapter("http://chroma:8000")._pool_maxsize == db.CHROMA_MAX_WORKERS
+
+    # a chromadb release without the private session still starts
+    monkeypatch.setattr(db.chromadb, "HttpClient", lambda host, port: object())
+    assert db._create_chromadb_client() is not None
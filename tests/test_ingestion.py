@@ -0,0 +1,103 @@
+import asyncio
+from src import ingestion
+from src.cache import TTLCache
+
+
+class CoverageCollection:
+    def __init__(self, counts):
+        self.counts = counts
+
+    def get(self, where, limit, include):
+        lowered = where["$or"][0]["related_language_or_topic_lower"]["$in"]
+        count = max(self.counts.get(v, 0) for v in lowered)
+        return {"ids": [str(i) for i in range(min(count, limit))]}
+
+
+def test_poorly_covered_terms_are_queued_once_and_crawled(monkeypatch):
+    queue = ingestion.LocalJobQueue()
+    monkeypatch.setattr(ingestion, "get_job_queue", lambda: queue)
+    monkeypatch.setattr(ingestion, "_coverage_checked", TTLCache(60))
+    monkeypatch.setattr(ingestion, "get_chromadb_collection",
+                        lambda: CoverageCollection({"python": 50, "rust": 2}))
+    crawled = []
+
+    async def fake_main(language_topics, access_token, extra_topics=None):
+        crawled.append((language_topics["languages"], extra_topics))
+
+    monkeypatch.setattr(ingestion.search, "main", fake_main)
+
+    async def run():
+        # without a worker the local queue isn't fed
+        assert await ingestion.enqueue_if_poorly_covered(["Rust"], []) is None
+        stop = asyncio.Event()
+        worker = asyncio.create_task(ingestion.run_worker(queue, access_token="token", stop=stop, poll_interval=0.05))
+        await asyncio.sleep(0)
+
+        job = await ingestion.enqueue_if_poorly_covered(["python", "Rust"], ["cli"])
+        # asked again right away: already checked, nothing new is queued
+        again = await ingestion.enqueue_if_poorly_covered(["Rust"], ["cli"])
+
+        while not crawled:
+            await asyncio.sleep(0.01)
+        stop.set()
+        await worker
+        return job, again
+
+    job, again = asyncio.run(run())
+    assert job == {"languages": ["Rust"], "topics": ["cli"]}
+    assert again is None
+    assert crawled == [(["Rust"], ["cli"])]
+
+
+def test_failed_coverage_check_is_retried_by_the_next_request(monkeypatch):
+    queue = ingestion.LocalJobQueue()
+    queue.consumers = 1
+    monkeypatch.setattr(ingestion, "get_job_queue", lambda: queue)
+    monkeypatch.setattr(ingestion, "_coverage_checked", TTLCache(60))
+    calls = []
+
+    class FlakyCollection(CoverageCollection):
+        def get(self, where, limit, include):
+            calls.append(where)
+            if len(calls) == 1:
+                raise ConnectionError("chroma is restarting")
+            return super().get(where, limit, include)
+
+    monkeypatch.setattr(ingestion, "get_chromadb_collection", lambda: FlakyCollection({"rust": 2}))
+
+    async def run():
+        try:
+            await ingestion.enqueue_if_poorly_covered(["Rust"], [])
+        except ConnectionError:
+            pass
+        return await ingestion.enqueue_if_poorly_covered(["Rust"], [])
+
+    assert asyncio.run(run()) == {"languages": ["Rust"], "topics": []}
+
+
+def test_blank_terms_are_neither_checked_nor_queued(monkeypatch):
+    queue = ingestion.LocalJobQueue()
+    queue.consumers = 1
+    monkeypatch.setattr(ingestion, "get_job_queue", lambda: queue)
+    monkeypatch.setattr(ingestion, "_coverage_checked", TTLCache(60))
+    checked = []
+
+    class StrictCollection(CoverageCollection):
+        def get(self, where, limit, include):
+            # like Chroma, an empty $or is rejected
+            if not where["$or"]:
+                raise ValueError("Expected where value for $or to be a non-empty list")
+            checked.append(where)
+            return super().get(where, limit, include)
+
+    monkeypatch.setattr(ingestion, "get_chromadb_collection", lambda: StrictCollection({"rust": 2}))
+
+    async def run():
+        blank = await ingestion.enqueue_if_poorly_covered([" ", ""], ["  "])
+        return blank, await ingestion.enqueue_if_poorly_covered([" Rust ", " "], []), \
+            await ingestion.count_covered(StrictCollection({}), " ")
+
+    blank, job, covered = asyncio.run(run())
+    assert blank is None
+    assert job == {"languages": ["Rust"], "topics": []} and len(checked) == 1
+    assert covered == ingestion.INGESTION_MIN_COVERAGE
@@ -0,0 +1,43 @@
+import asyncio
+import pytest
+from src import db, embeddings, migrate_embeddings
+from src.vector_index import NumpyClient
+
+
+def test_reembed_migration_switches_alias_and_queries_follow(monkeypatch, tmp_path):
+    monkeypatch.setattr(embeddings, "EMBEDDING_PROVIDER", "hashing")
+    monkeypatch.setattr(embeddings, "_providers", {})
+    client = NumpyClient(str(tmp_path))
+    monkeypatch.setattr(db, "_create_chromadb_client", lambda: client)
+
+    languages = ["Python", "Rust", "Go", "Haskell", "Elixir"]
+    unique_repos = {i: {"full_name": f"owner/{lang.lower()}-{i}", "description": f"A {lang} library number {i}",
+                        "related_language_or_topic": lang, "language": lang, "topics": lang.lower()}
+                    for i, lang in enumerate(languages * 4)}
+
+    async def run():
+        source = await db.run_chroma(db.open_collection, client, "projects", 256)
+        await db.upsert_to_chroma_db(source, unique_repos)
+        report = await migrate_embeddings.migrate(64, method="reembed", sample_size=10, client=client)
+
+        db.reset_chromadb()
+        collection = await db.run_chroma(db.get_chromadb_collection)
+        recommendations = await db.recommend(languages_topics={"languages": ["Rust"], "topics": []})
+        return report, collection, recommendations
+
+    try:
+        report, collection, recommendations = asyncio.run(run())
+    finally:
+        db.reset_chromadb()
+
+    assert report["repos"] == 20 and report["queries"] == 10
+    assert 0 <= report["overlap@10"] <= 1
+    assert collection.name == report["target"] and collection.matrix.shape == (20, 64)
+    # the query was embedded at 64 dimensions to match the collection
+    assert recommendations and recommendations[0]["language"] == "Rust"
+
+
+def test_truncate_is_refused_for_vectors_that_are_not_matryoshka(monkeypatch):
+    monkeypatch.setattr(migrate_embeddings, "EMBEDDING_PROVIDER", "hashing")
+    with pytest.raises(ValueError, match="reembed"):
+        asyncio.run(migrate_embeddings.migrate(64, method="truncate"))
@@ -0,0 +1,37 @@
+import asyncio
+from bson import ObjectId
+from src import models, migrate_recommendations
+from src.catalog import RepoCatalog
+from tests.test_models import FakeCollection
+
+
+def legacy(*names):
+    return {"_id": ObjectId(), "recommendation_id": "-".join(names),
+            "recommendations": [{"full_name": name, "description": f"About {name}", "score": 1.0 - i / 10}
+                                for i, name in enumerate(names)]}
+
+
+def test_migration_moves_embedded_repos_to_the_catalog(monkeypatch):
+    recommendations, repos = FakeCollection(), FakeCollection()
+    catalog = RepoCatalog(repos)
+    docs = [legacy("a/x", "b/y"), legacy("b/y", "c/z"), legacy("a/x")]
+    recommendations.docs = {d["_id"]: dict(d) for d in docs}
+    monkeypatch.setattr(models, "db", {"recommendations": recommendations})
+    monkeypatch.setattr(models, "repo_catalog", catalog)
+
+    async def run():
+        dry = await migrate_recommendations.migrate(batch_size=2, dry_run=True, recommendations=recommendations,
+                                                    catalog=catalog)
+        assert repos.docs == {} and all("recommendations" in d for d in recommendations.docs.values())
+        report = await migrate_recommendations.migrate(batch_size=2, recommendations=recommendations, catalog=catalog)
+        again = await migrate_recommendations.migrate(batch_size=2, recommendations=recommendations, catalog=catalog)
+        return dry, report, again, await models.get_user_recommendation_by_id("b/y-c/z")
+
+    dry, report, again, read = asyncio.run(run())
+    assert dry == {"documents": 3, "embedded_repos": 5, "catalog_repos": 3, "dry_run": True}
+    assert report == {**dry, "dry_run": False}
+    assert again["documents"] == 0
+    assert sorted(repos.docs) == ["a/x", "b/y", "c/z"]
+    assert all("recommendations" not in d and d["repos"] for d in recommendations.docs.values())
+    # reads return the same repos, in the same order, as before the migration
+    assert read["recommendations"] == docs[1]["recommendations"]
@@ -0,0 +1,173 @@
+import asyncio
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+from src import models
+from src.catalog import RepoCatalog
+from src.models import RecommendationWriter
+
+
+def matches(doc, query):
+    for key, condition in query.items():
+        if isinstance(condition, dict) and "$in" in condition:
+            if doc.get(key) not in condition["$in"]:
+                return False
+        elif isinstance(condition, dict) and "$exists" in condition:
+            if (key in doc) != condition["$exists"]:
+                return False
+        elif doc.get(key) != condition:
+            return False
+    return True
+
+
+class FakeCollection:
+    """The slice of a Motor collection used by the writer, the catalog and the migration"""
+
+    def __init__(self, fail_times=0):
+        self.calls = []
+        self.docs = {}
+        self.fail_times = fail_times
+        self.write_concern = None
+
+    def __bool__(self):
+        # like pymongo's Collection, so a truthiness check cannot slip into the code under test
+        raise NotImplementedError("Collection objects do not implement truth value testing")
+
+    def with_options(self, write_concern=None):
+        self.write_concern = write_concern
+        return self
+
+    async def insert_many(self, docs, ordered=True):
+        if self.fail_times:
+            self.fail_times -= 1
+            raise AutoReconnect("primary stepped down")
+        self.calls.append(("insert_many", len(docs)))
+        duplicates = [{"code": 11000} for d in docs if d["_id"] in self.docs]
+        self.docs.update({d["_id"]: dict(d) for d in docs})
+        if duplicates:
+            raise BulkWriteError({"writeErrors": duplicates})
+
+    async def bulk_write(self, requests, ordered=True):
+        self.calls.append(("bulk_write", len(requests)))
+        for request in requests:
+            query, update = request._filter, request._doc
+            doc = next((d for d in self.docs.values() if matches(d, query)), None)
+            if doc is None:
+                if not request._upsert:
+                    continue
+                doc = {"_id": query.get("_id", len(self.docs)), **{k: v for k, v in query.items() if k != "_id"}}
+                self.docs[doc["_id"]] = doc
+            doc.update(update.get("$set", {}))
+            for key in update.get("$unset", {}):
+                doc.pop(key, None)
+            for key, values in update.get("$addToSet", {}).items():
+                doc.setdefault(key, []).extend(v for v in values["$each"] if v not in doc.get(key, []))
+
+    async def find(self, query, batch_size=None):
+        self.calls.append(("find", len(query.get("_id", {}).get("$in", [])) if "_id" in query else None))
+        for doc in [d for d in self.docs.values() if matches(d, query)]:
+            yield dict(doc)
+
+    async def find_one(self, query):
+        return next((dict(d) for d in self.docs.values() if matches(d, query)), None)
+
+
+@pytest.fixture(autouse=True)
+def redis_deletes(monkeypatch):
+    deleted = []
+
+    async def fake_redis_write(set_json=None, delete=None, ttl=3600):
+        deleted.extend(delete or [])
+        return True
+
+    monkeypatch.setattr(models, "redis_write", fake_redis_write)
+    return deleted
+
+
+def make_writer(**kwargs):
+    recommendations, users, repos = FakeCollection(), FakeCollection(), FakeCollection()
+    writer = RecommendationWriter(recommendations=recommendations, user_recommendations=users,
+                                  catalog=RepoCatalog(repos), **kwargs)
+    return writer, recommendations, users, repos
+
+
+def test_writes_are_batched_and_readable_while_pending(monkeypatch, redis_deletes):
+    writer, recommendations, users, repos = make_writer(batch_size=10, interval=60)
+    monkeypatch.setattr(models, "recommendation_writer", writer)
+
+    async def run():
+        ids = [models.append_recommendations_to_db(user, [{"full_name": "a/b", "score": 0.5}], f"rec {i}")
+               for i, user in enumerate(["u1", "u2", "u1"])]
+        pending = await models.get_user_recommendation_by_id(ids[0])
+        assert recommendations.calls == []
+        await writer.close()
+        return ids, pending
+
+    ids, pending = asyncio.run(run())
+    assert pending == {"recommendation_id": ids[0], "recommendations": [{"full_name": "a/b", "score": 0.5}]}
+    # three requests, three round trips
+    assert repos.calls == [("bulk_write", 1)] and recommendations.calls == [("insert_many", 3)]
+    assert users.calls == [("bulk_write", 2)]
+    refs = next(d for d in users.docs.values() if d["username"] == "u1")["recommendation_refs"]
+    assert [r["recommendation_id"] for r in refs] == [ids[0], ids[2]]
+    assert recommendations.write_concern.document == {"w": 1, "j": True}
+    assert writer.stats() == {"pending": 0, "written": 3, "batches": 1, "failures": 0, "dropped": 0}
+    # lists other workers cached from Mongo while the batch was pending are dropped
+    assert sorted(redis_deletes) == ["user_recommendations:u1", "user_recommendations:u2"]
+
+
+def test_full_batch_is_flushed_without_waiting_for_the_interval():
+    writer, recommendations, users, _ = make_writer(batch_size=2, interval=60)
+
+    async def run():
+        for i in range(5):
+            writer.enqueue("u", [], f"rec {i}")
+        await asyncio.sleep(0.01)
+        # a full batch wakes the writer, which drains the queue in batches
+        assert recommendations.calls == [("insert_many", 2), ("insert_many", 2), ("insert_many", 1)]
+        await writer.close()
+
+    asyncio.run(run())
+    assert len(next(iter(users.docs.values()))["recommendation_refs"]) == 5
+
+
+def test_failed_batches_are_retried_then_dropped():
+    writer, recommendations, _, _ = make_writer(batch_size=10, interval=0.01, max_retries=1)
+    recommendations.fail_times = 1
+
+    async def run():
+        writer.enqueue("u", [], "rec")
+        await writer.close()
+
+    asyncio.run(run())
+    assert writer.stats()["written"] == 1 and writer.failures == 1
+
+    recommendations.fail_times = 5
+    asyncio.run(run())
+    assert writer.dropped == 1 and writer.pending == {}
+
+
+def test_recommendations_store_repo_ids_and_hydrate_from_the_catalog(monkeypatch):
+    writer, recommendations, _, repos = make_writer()
+    monkeypatch.setattr(models, "db", {"recommendations": recommendations})
+    monkeypatch.setattr(models, "repo_catalog", writer.catalog)
+    popular = {"full_name": "big/repo", "description": "Popular", "stargazers_count": 50000}
+    niche = {"full_name": "small/repo", "description": "Niche", "stargazers_count": 3}
+
+    async def run():
+        first = writer.enqueue("u1", [{**popular, "score": 0.9}, {**niche, "score": 0.4}], "rec 1")
+        second = writer.enqueue("u2", [{**niche, "score": 0.8}, {**popular, "score": 0.7}], "rec 2")
+        await writer.close()
+        # a cold worker reads the repos with one $in query, then from its LRU
+        writer.catalog._cache = type(writer.catalog._cache)(60)
+        return (await models.get_user_recommendation_by_id(first),
+                await models.get_user_recommendation_by_id(second))
+
+    first, second = asyncio.run(run())
+    # each repo is stored once, the recommendations only keep ids and scores
+    assert len(repos.docs) == 2 and repos.docs["big/repo"]["description"] == "Popular"
+    assert recommendations.docs[second["recommendation_id"]]["repos"] == [
+        {"repo_id": "small/repo", "score": 0.8}, {"repo_id": "big/repo", "score": 0.7}]
+    assert first["recommendations"] == [{**popular, "score": 0.9}, {**niche, "score": 0.4}]
+    assert second["recommendations"] == [{**niche, "score": 0.8}, {**popular, "score": 0.7}]
+    assert [c for c in repos.calls if c[0] == "find"] == [("find", 2)]
+    assert writer.catalog.stats() == {"hits": 2, "misses": 2}
@@ -0,0 +1,154 @@
+import asyncio
+import httpx
+import openai
+from types import SimpleNamespace
+from src import oai, embeddings
+from src.embedding_cache import EmbeddingCache, cache_key
+
+
+class FakeEmbeddings:
+    def __init__(self, fail_first=0):
+        self.calls = []
+        self.fail_first = fail_first
+
+    async def create(self, input, model):
+        self.calls.append(list(input))
+        if self.fail_first > 0:
+            self.fail_first -= 1
+            raise openai.APIConnectionError(request=httpx.Request("POST", "https://example.com"))
+        # return the items shuffled, the caller has to restore the order from `index`
+        data = [SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)]
+        return SimpleNamespace(data=list(reversed(data)))
+
+
+class FakeClient:
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def with_options(self, **kwargs):
+        return self
+
+
+def test_chunk_inputs_respects_limits():
+    texts = ["a" * 40] * 10
+    chunks = embeddings.chunk_inputs(texts, max_inputs=4, max_tokens=1000)
+    assert [len(c) for c in chunks] == [4, 4, 2]
+
+    chunks = embeddings.chunk_inputs(texts, max_inputs=100, max_tokens=25)
+    assert all(sum(embeddings.estimate_tokens(t) for t in c) <= 25 for c in chunks)
+    assert sum(chunks, []) == texts
+
+
+def test_generate_embeddings_batch_keeps_order_and_retries(monkeypatch):
+    fake = FakeEmbeddings(fail_first=1)
+    monkeypatch.setattr(oai, "async_client", FakeClient(fake))
+    monkeypatch.setattr(embeddings, "get_embedding_cache", lambda: None)
+    monkeypatch.setattr(oai, "EMBEDDING_RETRY_BACKOFF", 0)
+    provider = oai.AzureEmbeddingProvider()
+    provider.max_inputs = 3
+
+    texts = ["x" * n for n in range(1, 11)]
+    vectors = asyncio.run(embeddings.generate_embeddings_batch(texts, provider))
+
+    assert vectors == [[float(n)] for n in range(1, 11)]
+    # 4 chunks plus the one retried call
+    assert len(fake.calls) == 5
+
+
+def test_generate_embeddings_batch_only_embeds_cache_misses(monkeypatch, tmp_path):
+    fake = FakeEmbeddings()
+    cache = EmbeddingCache(path=str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(oai, "async_client", FakeClient(fake))
+    monkeypatch.setattr(embeddings, "get_embedding_cache", lambda: cache)
+    provider = oai.AzureEmbeddingProvider()
+
+    assert asyncio.run(embeddings.generate_embeddings_batch(["ab", "abc", "ab"], provider)) == [[2.0], [3.0], [2.0]]
+    assert fake.calls == [["ab", "abc"]]
+
+    assert asyncio.run(embeddings.generate_embeddings_batch(["abc", "abcd"], provider)) == [[3.0], [4.0]]
+    assert fake.calls[-1] == ["abcd"]
+    assert cache.stats()["memory_hits"] == 1
+
+
+def test_embedding_cache_disk_tier_and_eviction(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    vector_bytes = 4 * 4
+    cache = EmbeddingCache(path=path, max_memory_items=2, max_bytes=3 * vector_bytes)
+    keys = [cache_key("model", str(i)) for i in range(4)]
+    for key in keys:
+        cache.set_many({key: [1.0, 2.0, 3.0, 4.0]})
+    cache.close()
+
+    # a fresh process only has the disk tier, which kept the most recently used vectors
+    cache = EmbeddingCache(path=path, max_memory_items=2, max_bytes=3 * vector_bytes)
+    found = cache.get_many(keys)
+    assert keys[-1] in found and keys[0] not in found
+    assert found[keys[-1]] == [1.0, 2.0, 3.0, 4.0]
+    stats = cache.stats()
+    assert stats["disk_hits"] == len(found)
+    assert stats["misses"] == len(keys) - len(found)
+    assert stats["disk_bytes"] <= 3 * vector_bytes
+
+
+def test_embedding_cache_shares_its_budget_and_defers_touches(tmp_path):
+    import sqlite3
+    path = str(tmp_path / "cache.sqlite3")
+    vector_bytes = 4 * 4
+    first = EmbeddingCache(path=path, max_memory_items=0, max_bytes=4 * vector_bytes)
+    second = EmbeddingCache(path=path, max_memory_items=0, max_bytes=4 * vector_bytes)
+    keys = [cache_key("model", str(i)) for i in range(6)]
+    for i, key in enumerate(keys):
+        (first if i % 2 else second).set_many({key: [1.0, 2.0, 3.0, 4.0]})
+
+    # both processes count each other's rows against the one budget
+    rows = sqlite3.connect(path).execute("SELECT COUNT(*), SUM(size) FROM embeddings").fetchone()
+    assert rows[1] <= 4 * vector_bytes and first.stats()["disk_bytes"] == rows[1]
+
+    # a disk hit is not a write, its last_used is stored with the next write or on close
+    used = lambda: dict(sqlite3.connect(path).execute("SELECT key, last_used FROM embeddings").fetchall())
+    before = used()
+    assert keys[-1] in first.get_many([keys[-1]])
+    assert used() == before
+    first.close()
+    assert used()[keys[-1]] > before[keys[-1]]
+    second.close()
+
+
+def test_generate_embeddings_batch_survives_a_failing_cache(monkeypatch):
+    import sqlite3
+    fake = FakeEmbeddings()
+
+    class LockedCache:
+        def get_many(self, keys):
+            raise sqlite3.OperationalError("database is locked")
+
+        set_many = get_many
+
+    monkeypatch.setattr(oai, "async_client", FakeClient(fake))
+    monkeypatch.setattr(embeddings, "get_embedding_cache", lambda: LockedCache())
+    provider = oai.AzureEmbeddingProvider()
+
+    assert asyncio.run(embeddings.generate_embeddings_batch(["ab", "abc"], provider)) == [[2.0], [3.0]]
+    assert fake.calls == [["ab", "abc"]]
+
+
+def test_provider_without_embed_chunk_cannot_be_instantiated():
+    import pytest
+
+    class Incomplete(embeddings.EmbeddingProvider):
+        model = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_hashing_provider_is_deterministic_and_normalized():
+    import numpy as np
+    provider = embeddings.HashingEmbeddingProvider(dimensions=256)
+    texts = ["fast python web framework", "python web framework, fast", "rust game engine", ""]
+    vectors = np.array(asyncio.run(embeddings.generate_embeddings_batch(texts, provider)))
+
+    assert vectors.shape == (4, 256)
+    assert np.allclose(vectors, provider.embed_texts(texts))
+    assert np.allclose(np.linalg.norm(vectors[:3], axis=1), 1.0)
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
@@ -0,0 +1,100 @@
+import asyncio
+from aiohttp import web, ClientSession
+from src.octokit import Octokit, MemoryResponseCache
+
+
+async def start_server(app):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def test_request_revalidates_with_etag():
+    seen = []
+
+    async def repos(request):
+        seen.append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304, headers={"ETag": '"v1"'})
+        return web.json_response([{"name": "repo"}], headers={"ETag": '"v1"'})
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/users/someone/repos", repos)
+        runner, base_url = await start_server(app)
+        try:
+            async with ClientSession() as session:
+                octokit = Octokit("token", session, cache=MemoryResponseCache(), base_url=base_url)
+                first = await octokit.request("GET", "/users/someone/repos", {"per_page": 100})
+                second = await octokit.request("GET", "/users/someone/repos", {"per_page": 100})
+                return first, second
+        finally:
+            await runner.cleanup()
+
+    first, second = asyncio.run(run())
+    assert first == second == [{"name": "repo"}]
+    assert seen == [None, '"v1"']
+
+
+def test_scheduler_retries_server_errors_and_waits_for_reset(monkeypatch):
+    import time
+    from src import rate_limit
+    from src.rate_limit import RateLimitScheduler
+    monkeypatch.setattr(rate_limit, "OCTOKIT_RETRY_BACKOFF", 0.01)
+    calls = []
+
+    async def search(request):
+        calls.append(time.time())
+        if len(calls) == 1:
+            return web.Response(status=502)
+        return web.json_response({"items": []}, headers={
+            "X-RateLimit-Limit": "30",
+            "X-RateLimit-Remaining": "0" if len(calls) == 2 else "29",
+            "X-RateLimit-Reset": str(time.time() + 0.5),
+            "X-RateLimit-Resource": "search",
+        })
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/search/repositories", search)
+        runner, base_url = await start_server(app)
+        scheduler = RateLimitScheduler(max_concurrency=2)
+        try:
+            async with ClientSession() as session:
+                octokit = Octokit("token", session, cache=MemoryResponseCache(), base_url=base_url,
+                                  scheduler=scheduler)
+                await octokit.request("GET", "/search/repositories", {"q": "a"})
+                assert scheduler.budget()["search"]["remaining"] == 0
+                await octokit.request("GET", "/search/repositories", {"q": "b"})
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+    assert len(calls) == 3
+    # the third request waited for the window to reset instead of hitting a 403
+    assert calls[2] - calls[1] >= 0.5
+
+
+def test_rate_limit_retries_are_capped_and_schedulers_bounded(monkeypatch):
+    from src import rate_limit
+    from src.cache import TTLCache
+    from src.rate_limit import RateLimitScheduler
+    scheduler = RateLimitScheduler()
+    monkeypatch.setattr(scheduler, "_pause", lambda seconds: None)
+    retry_after = {"Retry-After": "1"}
+    primary = {"X-RateLimit-Remaining": "0"}
+
+    for headers in (retry_after, primary):
+        assert scheduler.retry_delay("core", 403, headers, "", attempt=0) == 0
+        assert scheduler.retry_delay("core", 403, headers, "", attempt=rate_limit.OCTOKIT_MAX_RETRIES) is None
+
+    monkeypatch.setattr(rate_limit, "_schedulers", TTLCache(60, max_entries=2))
+    first = rate_limit.get_scheduler("token-1")
+    assert rate_limit.get_scheduler("token-1") is first
+    rate_limit.get_scheduler("token-2")
+    rate_limit.get_scheduler("token-3")
+    assert len(rate_limit.rate_limit_budget()) == 2
+    assert rate_limit.get_scheduler("token-1") is not first
@@ -0,0 +1,70 @@
+import time
+import numpy as np
+from datetime import datetime, timezone
+from src import ranking
+from src.models import process_recommendations
+
+NOW = datetime(2024, 6, 1, tzinfo=timezone.utc).timestamp()
+
+
+def candidate(name, distance=0.5, language="Go", topics="", stars=10, updated_at="2024-05-01T00:00:00Z"):
+    return {"full_name": name, "distance": distance, "language": language, "topics": topics,
+            "stargazers_count": stars, "forks_count": 1, "open_issues_count": 1, "updated_at": updated_at}
+
+
+def test_topics_string_is_matched_as_a_set_of_topics():
+    assert ranking.split_topics("machine-learning, web ,  ") == {"machine-learning", "web"}
+    # the old match_score iterated over the characters of the string and matched nothing
+    ranked = ranking.rank([candidate("a/plain"), candidate("a/ml", topics="web, machine-learning")],
+                          languages=[], topics=["machine-learning"], now=NOW)
+    assert ranked[0]["full_name"] == "a/ml"
+
+
+def test_each_signal_moves_the_ranking():
+    base = candidate("a/base")
+    cases = [
+        (candidate("a/closer", distance=0.2), {}),
+        (candidate("a/python", language="Python"), {}),
+        (candidate("a/popular", stars=50000), {}),
+        (candidate("a/fresh", updated_at="2024-05-31T00:00:00Z"), {}),
+    ]
+    for better, weights in cases:
+        ranked = ranking.rank([base, better], languages=["python"], topics=[], weights=weights, now=NOW)
+        assert ranked[0]["full_name"] == better["full_name"]
+        assert ranked[0]["score"] > ranked[1]["score"]
+
+    # weights are configurable, without the similarity term the popular repo wins
+    ranked = ranking.rank([candidate("a/close", distance=0.0), candidate("a/popular", distance=0.9, stars=50000)],
+                          languages=[], topics=[], weights={"similarity": 0}, now=NOW)
+    assert ranked[0]["full_name"] == "a/popular"
+
+
+def test_process_recommendations_dedupes_and_ranks_quickly():
+    candidates = [candidate(f"o/r{i % 2000}", distance=(i % 97) / 100, stars=i,
+                            topics="web, cli" if i % 3 else "") for i in range(4000)]
+    start = time.perf_counter()
+    ranked = process_recommendations(candidates, {"languages": ["Go"], "topics": ["cli"]})
+    elapsed = time.perf_counter() - start
+
+    assert len(ranked) == 2000
+    assert [r["score"] for r in ranked] == sorted((r["score"] for r in ranked), reverse=True)
+    assert elapsed / len(candidates) < 50e-6
+
+
+def test_mmr_pushes_near_duplicates_down():
+    # three near-identical repos from one niche outrank two from another
+    niche, other = np.array([1.0, 0.0, 0.0]), np.array([0.0, 1.0, 0.0])
+    ranked = [{"full_name": f"niche/{i}", "score": 1.0 - i * 0.01, "embedding": niche + 0.01 * i} for i in range(3)]
+    ranked += [{"full_name": f"other/{i}", "score": 0.8 - i * 0.01, "embedding": other + 0.01 * i} for i in range(2)]
+
+    diverse = ranking.diversify(ranked, k=3, lambda_=0.5)
+    assert [r["full_name"] for r in diverse[:2]] == ["niche/0", "other/0"]
+    assert len(diverse) == 5
+
+    # pure relevance, or no time to diversify, keeps the ranked order
+    names = [r["full_name"] for r in ranked]
+    assert [r["full_name"] for r in ranking.diversify(ranked, k=3, lambda_=1.0)] == names
+    assert [r["full_name"] for r in ranking.diversify(ranked, k=3, lambda_=0.5, time_budget=0)] == names
+
+    cleaned = process_recommendations([{**r, "distance": 0.1} for r in ranked], {"languages": [], "topics": []})
+    assert cleaned[1]["full_name"].startswith("other/") and all("embedding" not in r for r in cleaned)
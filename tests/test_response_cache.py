@@ -0,0 +1,154 @@
+import asyncio
+import pytest
+from src import response_cache
+from src.response_cache import ResponseCache, fingerprint
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+    async def eval(self, script, numkeys, key, token):
+        if self.data.get(key) == token.encode():
+            self.data.pop(key)
+            return 1
+        return 0
+
+
+class DownRedis:
+    def __getattr__(self, name):
+        async def fail(*args, **kwargs):
+            raise ConnectionError("redis is down")
+        return fail
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(response_cache, "get_redis", lambda: fake)
+    return fake
+
+
+def counting(value, delay=0.0):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return {"value": value, "call": len(calls)}
+    return compute, calls
+
+
+def test_fingerprint_normalizes_inputs_and_tracks_profile_state():
+    details = [{"project_name": "a", "pushed_at": "2024-01-01T00:00:00Z"}]
+    key = fingerprint("github", ["Python", "go"], ["CLI"], details, username="u")
+    assert key == fingerprint("github", ["Go", "python "], ["cli"], details, username="u")
+    assert key != fingerprint("github", ["Go", "python"], ["cli"],
+                              [{"project_name": "a", "pushed_at": "2024-02-01T00:00:00Z"}], username="u")
+
+
+def test_concurrent_misses_share_one_computation(redis):
+    cache = ResponseCache("test:")
+    compute, calls = counting("v", delay=0.1)
+
+    async def run():
+        results = await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(5)))
+        return results, await cache.get_or_compute("k", compute)
+
+    results, again = asyncio.run(run())
+    assert len(calls) == 1 and all(r == {"value": "v", "call": 1} for r in results)
+    assert again == results[0]
+    assert cache.stats() == {"hits": 1, "stale_hits": 0, "misses": 5}
+    assert "test:lock:k" not in redis.data
+
+
+def test_stale_entry_is_served_while_revalidating(redis):
+    cache = ResponseCache("test:", ttl=0)
+    compute, calls = counting("v")
+
+    async def run():
+        first = await cache.get_or_compute("k", compute)
+        await asyncio.sleep(0.01)
+        stale = await cache.get_or_compute("k", compute)
+        await asyncio.sleep(0.05) # let the background refresh finish
+        return first, stale, await cache.get_or_compute("k", compute)
+
+    first, stale, refreshed = asyncio.run(run())
+    assert first["call"] == 1 and stale["call"] == 1
+    assert refreshed["call"] == 2 and cache.stale_hits == 2
+
+
+def test_waits_for_the_worker_holding_the_lock(redis):
+    cache = ResponseCache("test:", poll_interval=0.01)
+    compute, calls = counting("mine")
+    redis.data["test:lock:k"] = b"other-worker"
+
+    async def other_worker():
+        await asyncio.sleep(0.05)
+        await ResponseCache("test:")._write("k", {"value": "theirs"})
+
+    async def run():
+        result, _ = await asyncio.gather(cache.get_or_compute("k", compute), other_worker())
+        return result
+
+    assert asyncio.run(run()) == {"value": "theirs"}
+    assert calls == []
+
+
+def test_stops_waiting_once_the_lock_is_released_without_an_entry(redis):
+    cache = ResponseCache("test:", poll_interval=0.01)
+    compute, calls = counting("mine")
+    redis.data["test:lock:k"] = b"other-worker"
+
+    async def other_worker():
+        # the holder's answer was not cacheable, it only releases the lock
+        await asyncio.sleep(0.05)
+        await redis.delete("test:lock:k")
+
+    async def run():
+        result, _ = await asyncio.wait_for(asyncio.gather(cache.get_or_compute("k", compute), other_worker()), 1)
+        return result
+
+    assert asyncio.run(run()) == {"value": "mine", "call": 1}
+    assert "test:lock:k" not in redis.data
+
+
+def test_unlock_keeps_a_lock_taken_over_by_another_worker(redis):
+    cache = ResponseCache("test:")
+
+    async def run():
+        token = await cache._lock("k")
+        redis.data["test:lock:k"] = b"other-worker"  # ours expired, another worker took it
+        await cache._unlock("k", token)
+
+    asyncio.run(run())
+    assert redis.data["test:lock:k"] == b"other-worker"
+
+
+def test_redis_outage_degrades_to_computing(monkeypatch):
+    monkeypatch.setattr(response_cache, "get_redis", lambda: DownRedis())
+    cache = ResponseCache("test:")
+    compute, calls = counting("v")
+    empty = lambda response: False
+
+    async def run():
+        await cache.get_or_compute("k", compute)
+        await cache.get_or_compute("k", compute)
+        await cache.get_or_compute("empty", compute, should_cache=empty)
+        await cache.get_or_compute("empty", compute, should_cache=empty)
+
+    asyncio.run(run())
+    # the in-process copy serves the second call, uncacheable answers are recomputed
+    assert len(calls) == 3
@@ -0,0 +1,69 @@
+import pytest
+import asyncio
+from src import search
+from src.cache import TieredCache
+
+
+@pytest.fixture(autouse=True)
+def empty_search_cache(monkeypatch):
+    monkeypatch.setattr(search, "_search_cache", TieredCache("search:", ttl=60))
+
+
+class FakeOctokit:
+    def __init__(self, total_count, repeat_from_page=None):
+        self.total_count = total_count
+        self.repeat_from_page = repeat_from_page
+        self.requests = []
+
+    async def request(self, method, url, params):
+        self.requests.append(dict(params))
+        await asyncio.sleep(0.01)
+        page, per_page = params["page"], params["per_page"]
+        if self.repeat_from_page and page >= self.repeat_from_page:
+            page = 1 # GitHub sometimes serves the same items again
+        start = (page - 1) * per_page
+        ids = range(start, min(start + per_page, self.total_count))
+        return {"total_count": self.total_count,
+                "items": [{"id": i, "full_name": f"owner/repo{i}", "topics": ["a", "b"]} for i in ids]}
+
+
+def test_search_repositories_gets_default_result_set_in_one_request():
+    octokit = FakeOctokit(total_count=500)
+    repos = asyncio.run(search.search_repositories(octokit, {"q": "stars:>=2000 language:Python"}))
+
+    assert len(repos) == 21
+    assert len(octokit.requests) == 1
+    assert repos[0]["related_language_or_topic"] == "Python"
+    assert repos[0]["topics"] == "a, b"
+
+
+def test_search_repositories_plans_pages_from_total_count():
+    octokit = FakeOctokit(total_count=230)
+    repos = asyncio.run(search.search_repositories(octokit, {"q": "topic:cli"}, max_results=1000))
+
+    assert len(repos) == 230
+    assert sorted(r["page"] for r in octokit.requests) == [1, 2, 3]
+
+
+def test_search_repositories_stops_on_duplicate_pages():
+    octokit = FakeOctokit(total_count=1000, repeat_from_page=2)
+    repos = asyncio.run(search.search_repositories(octokit, {"q": "topic:cli"}, max_results=1000))
+
+    assert len(repos) == 100
+    assert len(octokit.requests) <= 1 + search.SEARCH_PAGE_CONCURRENCY
+
+
+def test_identical_searches_share_one_fetch_and_the_cache():
+    octokit = FakeOctokit(total_count=50)
+
+    async def run():
+        first = await asyncio.gather(
+            search.search_repositories(octokit, {"q": "language:Python stars:>=2000", "sort": "stars"}),
+            search.search_repositories(octokit, {"q": "stars:>=2000  language:python", "sort": "stars"}),
+        )
+        again = await search.search_repositories(octokit, {"q": "language:Python stars:>=2000", "sort": "stars"})
+        return first, again
+
+    (first, second), again = asyncio.run(run())
+    assert len(octokit.requests) == 1
+    assert list(first) == list(second) == list(again)
@@ -50,3 +50,159 @@ def test_verify_token_invalid(expired_token):
 def test_get_recommendations_unauthorized():
     response = client.post("/api/recommendations/")
     assert response.status_code == 401
+
+
+def test_health_check_not_blocked_by_slow_recommendation(monkeypatch):
+    import time
+    import asyncio
+    import httpx
+    from src import api, db
+
+    class SlowCollection:
+        def query(self, query_embeddings, n_results, include, where=None):
+            time.sleep(0.5)
+            return {"metadatas": [[]], "distances": [[]]}
+
+    async def fake_embeddings(texts, provider=None):
+        return [[0.0]] * len(texts)
+
+    monkeypatch.setattr(db, "get_chromadb_collection", lambda: SlowCollection())
+    monkeypatch.setattr(db, "generate_embeddings_batch", fake_embeddings)
+
+    async def run():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            finished = []
+
+            async def slow_request():
+                await ac.post("/api/recommendations_without_github",
+                              json={"username": "user", "languages": ["Python"]})
+                finished.append("recommendation")
+
+            async def health_request():
+                await asyncio.sleep(0.1)
+                response = await ac.get("/api/health")
+                assert response.status_code == 200
+                finished.append("health")
+
+            await asyncio.gather(slow_request(), health_request())
+            return finished
+
+    assert asyncio.run(run()) == ["health", "recommendation"]
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.ops = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def set(self, key, value, ex=None):
+        self.ops.append(("set", key, value, ex))
+
+    def delete(self, key):
+        self.ops.append(("delete", key))
+
+    async def execute(self):
+        self.redis.round_trips += 1
+        for op in self.ops:
+            if op[0] == "set":
+                self.redis.data[op[1]] = op[2].encode()
+                self.redis.ttls[op[1]] = op[3]
+            else:
+                self.redis.data.pop(op[1], None)
+
+
+class FakeRedis:
+    def __init__(self, up=True):
+        self.up = up
+        self.data = {}
+        self.ttls = {}
+        self.round_trips = 0
+
+    async def mget(self, keys):
+        if not self.up:
+            raise ConnectionError("redis is down")
+        self.round_trips += 1
+        return [self.data.get(k) for k in keys]
+
+    def pipeline(self, transaction=True):
+        if not self.up:
+            raise ConnectionError("redis is down")
+        return FakePipeline(self)
+
+
+def test_recommendation_by_id_uses_redis_and_falls_back_to_mongo(monkeypatch):
+    from src import api, cache
+    redis = FakeRedis()
+    monkeypatch.setattr(cache, "get_redis", lambda: redis)
+    mongo_reads = []
+
+    async def from_mongo(recommendation_id):
+        mongo_reads.append(recommendation_id)
+        return {"recommendation_id": recommendation_id, "recommendations": []} if recommendation_id == "r1" else None
+
+    monkeypatch.setattr(api, "get_user_recommendation_by_id", from_mongo)
+
+    assert client.get("/api/recommendation/r1").status_code == 200
+    assert client.get("/api/recommendation/r1").json()["recommendation_id"] == "r1"
+    assert mongo_reads == ["r1"] and redis.ttls["recommendation:r1"] > 0
+    assert client.get("/api/recommendation/missing").status_code == 404
+
+    # with Redis down the request is served from Mongo instead of failing
+    redis.up = False
+    assert client.get("/api/recommendation/r1").status_code == 200
+    assert mongo_reads == ["r1", "missing", "r1"]
+
+
+def test_new_recommendation_is_cached_and_user_list_dropped_in_one_round_trip(monkeypatch):
+    import asyncio
+    from src import api, cache
+    redis = FakeRedis()
+    redis.data["user_recommendations:someone"] = b"[]"
+    monkeypatch.setattr(cache, "get_redis", lambda: redis)
+
+    asyncio.run(api.cache_new_recommendation("someone", "r2", [{"full_name": "a/b"}]))
+    assert redis.round_trips == 1
+    assert "user_recommendations:someone" not in redis.data
+    assert b"a/b" in redis.data["recommendation:r2"]
+
+
+def test_anonymous_callers_share_the_ranking_but_get_their_own_recommendation(monkeypatch):
+    from src import api, response_cache
+    from src.response_cache import ResponseCache
+    from tests.test_response_cache import DownRedis
+    monkeypatch.setattr(response_cache, "get_redis", lambda: DownRedis())
+    monkeypatch.setattr(api, "response_cache", ResponseCache("test:"))
+    monkeypatch.setattr(api, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(api, "schedule_coverage_check", lambda languages, topics: None)
+    searches, users, stored = [], [], []
+
+    async def fake_recommend(languages_topics):
+        searches.append(languages_topics)
+        return [{"full_name": "a/b", "distance": 0.1, "language": "Go"}]
+
+    async def fake_append_user(username):
+        users.append(username)
+
+    async def fake_cache(username, rec_id, recommendations):
+        pass
+
+    monkeypatch.setattr(api, "recommend", fake_recommend)
+    monkeypatch.setattr(api, "append_user_to_db", fake_append_user)
+    monkeypatch.setattr(api, "append_recommendations_to_db",
+                        lambda username, recommendations, name: stored.append(username) or f"rec-{len(stored)}")
+    monkeypatch.setattr(api, "cache_new_recommendation", fake_cache)
+
+    first = client.post("/api/recommendations_without_github", json={"username": "ann", "languages": ["Go"]}).json()
+    second = client.post("/api/recommendations_without_github", json={"username": "bob", "languages": ["go"]}).json()
+
+    assert len(searches) == 1
+    assert first["recommendations"] == second["recommendations"]
+    assert (first["recommendation_id"], second["recommendation_id"]) == ("rec-1", "rec-2")
+    assert [u[:3] for u in users] == ["ann", "bob"] and stored == users
@@ -0,0 +1,100 @@
+import time
+import asyncio
+from aiohttp import web
+from src import octokit, user_data
+from src.models import User
+from tests.test_octokit import start_server
+
+
+def make_repo(base_url, i):
+    return {"name": f"repo{i}", "fork": False, "description": f"project {i}", "language": "Python",
+            "topics": ["cli"], "languages_url": f"{base_url}/repos/someone/repo{i}/languages"}
+
+
+def test_get_repos_follows_pages_and_fetches_languages_concurrently(monkeypatch):
+    pages = []
+    state = {}
+
+    async def run():
+        async def repos(request):
+            base_url = state["base_url"]
+            page = int(request.query.get("page", 1))
+            pages.append(page)
+            if page == 1:
+                items = [make_repo(base_url, i) for i in range(10)] + [{**make_repo(base_url, 99), "fork": True}]
+                return web.json_response(items, headers={
+                    "Link": f'<{base_url}/users/someone/repos?per_page=100&page=2>; rel="next"'})
+            items = [make_repo(base_url, i) for i in range(10, 30)]
+            return web.json_response(items, headers={
+                "Link": f'<{base_url}/users/someone/repos?per_page=100&page=3>; rel="next"'})
+
+        async def languages(request):
+            await asyncio.sleep(0.1)
+            return web.json_response({"Python": 100, "Shell": 10})
+
+        app = web.Application()
+        app.router.add_get("/users/someone/repos", repos)
+        app.router.add_get("/repos/someone/{name}/languages", languages)
+        runner, base_url = await start_server(app)
+        state["base_url"] = base_url
+        monkeypatch.setattr(octokit, "GITHUB_API_URL", base_url)
+        monkeypatch.setattr(octokit, "get_response_cache", lambda: None)
+        try:
+            start = time.perf_counter()
+            result = await user_data.get_repos(User(username="someone", access_token="token"))
+            return result, time.perf_counter() - start
+        finally:
+            await runner.cleanup()
+
+    (user_details, language_topics), elapsed = asyncio.run(run())
+
+    assert [d["project_name"] for d in user_details] == [f"repo{i}" for i in range(15)]
+    assert language_topics == {"languages": ["Python", "Shell"], "topics": ["cli"]}
+    # page 3 is never needed
+    assert pages == [1, 2]
+    # 15 languages lookups at 0.1s each, 8 at a time
+    assert elapsed < 0.6
+
+
+def graphql_repo(i, fork=False):
+    return {
+        "name": f"repo{i}", "description": f"project {i}", "isFork": fork, "pushedAt": "2024-05-01T00:00:00Z",
+        "primaryLanguage": {"name": "Python"},
+        "languages": {"edges": [{"node": {"name": "Python"}}, {"node": {"name": "Shell"}}]},
+        "repositoryTopics": {"nodes": [{"topic": {"name": "cli"}}]},
+    }
+
+
+def test_get_repos_graphql_backend_matches_rest_shape(monkeypatch):
+    requests = []
+
+    async def graphql(request):
+        payload = await request.json()
+        requests.append(payload["variables"])
+        assert payload["variables"]["login"] == "someone"
+        if payload["variables"]["after"] is None:
+            nodes = [graphql_repo(i) for i in range(10)] + [graphql_repo(99, fork=True)]
+            page_info = {"hasNextPage": True, "endCursor": "cursor1"}
+        else:
+            nodes = [graphql_repo(i) for i in range(10, 30)]
+            page_info = {"hasNextPage": True, "endCursor": "cursor2"}
+        return web.json_response({"data": {"user": {"repositories": {"pageInfo": page_info, "nodes": nodes}}}})
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/graphql", graphql)
+        runner, base_url = await start_server(app)
+        monkeypatch.setattr(octokit, "GITHUB_API_URL", base_url)
+        try:
+            return await user_data.get_repos(User(username="someone", access_token="token"), backend="graphql")
+        finally:
+            await runner.cleanup()
+
+    user_details, language_topics = asyncio.run(run())
+
+    assert user_details[0] == {"project_name": "repo0", "description": "project 0",
+                               "related_language_or_topic": ["Python", "Shell"],
+                               "pushed_at": "2024-05-01T00:00:00Z"}
+    assert [d["project_name"] for d in user_details] == [f"repo{i}" for i in range(15)]
+    assert language_topics == {"languages": ["Python", "Shell"], "topics": ["cli"]}
+    assert [r["after"] for r in requests] == [None, "cursor1"]
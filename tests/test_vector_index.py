@@ -0,0 +1,143 @@
+import numpy as np
+from src import db
+from src.vector_index import NumpyClient, NumpyCollection
+
+
+def random_vectors(n, dim=32, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+
+
+def test_query_matches_brute_force_and_filters(tmp_path):
+    vectors = random_vectors(200)
+    collection = NumpyCollection(str(tmp_path / "projects"))
+    collection.add(ids=[str(i) for i in range(200)],
+                   embeddings=vectors.tolist(),
+                   documents=[f"doc {i}" for i in range(200)],
+                   metadatas=[{"language": "Python" if i % 2 else "Go", "stars": i} for i in range(200)])
+    assert collection.count() == 200
+
+    queries = random_vectors(3, seed=1)
+    result = collection.query(query_embeddings=queries.tolist(), n_results=5, include=["metadatas", "distances"])
+
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    for q, ids, distances in zip(queries, result["ids"], result["distances"]):
+        expected = 1 - normalized @ (q / np.linalg.norm(q))
+        assert ids == [str(i) for i in np.argsort(expected)[:5]]
+        assert np.allclose(distances, np.sort(expected)[:5], atol=1e-5)
+    assert "documents" not in result
+
+    filtered = collection.query(query_embeddings=queries[:1].tolist(), n_results=300,
+                                where={"$and": [{"language": {"$in": ["Go"]}}, {"stars": {"$lt": 10}}]},
+                                include=["metadatas"])
+    assert sorted(m["stars"] for m in filtered["metadatas"][0]) == [0, 2, 4, 6, 8]
+
+
+def test_writes_are_visible_to_other_instances(tmp_path):
+    path = str(tmp_path / "projects")
+    writer = NumpyCollection(path)
+    reader = NumpyCollection(path)
+    assert reader.count() == 0
+
+    writer.add(ids=["a", "b"], embeddings=[[1.0, 0.0], [0.0, 1.0]],
+               documents=["a", "b"], metadatas=[{"n": 1}, {"n": 2}])
+    # add leaves existing ids alone, upsert replaces them, update never inserts
+    writer.add(ids=["a"], embeddings=[[0.0, 1.0]], metadatas=[{"n": 10}])
+    writer.upsert(ids=["b", "c"], embeddings=[[1.0, 1.0], [-1.0, 0.0]], metadatas=[{"n": 20}, {"n": 3}])
+    writer.update(ids=["a", "missing"], metadatas=[{"n": 11}, {"n": 0}])
+
+    assert reader.count() == 3
+    assert isinstance(reader.matrix, np.memmap)
+    got = reader.get(ids=["a", "b", "c"], include=["metadatas", "embeddings"])
+    assert [m["n"] for m in got["metadatas"]] == [11, 20, 3]
+    assert np.allclose(got["embeddings"][1], [2 ** -0.5, 2 ** -0.5])
+    assert reader.get(where={"n": {"$gt": 5}}, include=[])["ids"] == ["a", "b"]
+    # the current matrix and the one it replaced, for readers about to map it
+    assert len([name for name in (tmp_path / "projects").iterdir() if name.suffix == ".npy"]) == 2
+
+
+def test_client_keeps_existing_collection_metadata(tmp_path):
+    client = NumpyClient(str(tmp_path))
+    assert client.list_collections() == []
+    created = db.open_collection(client, "projects", dimensions=256)
+    created.add(ids=["a"], embeddings=[[1.0, 0.0]])
+    assert client.list_collections() == ["projects"]
+
+    # a later get_or_create, or open_collection with another size, leaves the collection as it was
+    assert client.get_or_create_collection("projects", metadata={"hnsw:space": "l2"}).metadata["embedding_dimensions"] == 256
+    reopened = db.open_collection(NumpyClient(str(tmp_path)), "projects", dimensions=512)
+    assert reopened.metadata == {"hnsw:space": "cosine", "embedding_dimensions": 256}
+    assert reopened.count() == 1
+
+
+def test_readers_see_whole_generations_while_writes_land(tmp_path):
+    import threading
+    path = str(tmp_path / "projects")
+    writer = NumpyCollection(path)
+    reader = NumpyCollection(path)
+    writer.add(ids=["0"], embeddings=random_vectors(1, dim=8))
+    errors, done = [], threading.Event()
+
+    def read():
+        while not done.is_set():
+            try:
+                result = reader.query(query_embeddings=random_vectors(1, dim=8), n_results=1000,
+                                      include=["embeddings", "distances"])
+                assert len(result["ids"][0]) == len(result["embeddings"][0])
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for i in range(1, 30):
+        writer.add(ids=[str(i)], embeddings=random_vectors(1, dim=8, seed=i))
+    done.set()
+    for thread in threads:
+        thread.join()
+    assert errors == [] and reader.count() == 30
+
+
+def test_load_retries_when_files_vanish_under_it(tmp_path, monkeypatch):
+    path = str(tmp_path / "projects")
+    NumpyCollection(path).add(ids=["a"], embeddings=[[1.0, 0.0]])
+    reader = NumpyCollection(path)
+    NumpyCollection(path).add(ids=["b"], embeddings=[[0.0, 1.0]])
+
+    real, calls = reader._read_snapshot, []
+
+    def racing(version):
+        calls.append(version)
+        if len(calls) == 1:
+            raise FileNotFoundError("matrix-old.npy")
+        return real(version)
+
+    monkeypatch.setattr(reader, "_read_snapshot", racing)
+    assert reader.count() == 2 and len(calls) == 2
+
+
+def test_quantized_search_keeps_the_float32_ranking(tmp_path):
+    vectors = random_vectors(500, dim=64)
+    queries = vectors[:20] + 0.1 * random_vectors(20, dim=64, seed=2)
+    ids = [str(i) for i in range(500)]
+
+    exact = NumpyCollection(str(tmp_path / "none"))
+    exact.add(ids=ids, embeddings=vectors)
+    expected = exact.query(query_embeddings=queries, n_results=5, include=["distances"])
+
+    def disk_bytes(name):
+        return sum(f.stat().st_size for f in (tmp_path / name).iterdir() if f.suffix == ".npy")
+
+    for quantization in ("float16", "int8"):
+        collection = NumpyCollection(str(tmp_path / quantization), quantization=quantization)
+        collection.add(ids=ids, embeddings=vectors)
+        assert collection.codes.nbytes < exact.matrix.nbytes
+        # no float32 copy is kept next to the codes
+        assert disk_bytes(quantization) < 0.8 * disk_bytes("none")
+        result = collection.query(query_embeddings=queries, n_results=5, include=["distances"])
+        assert result["ids"] == expected["ids"]
+        # re-scoring runs on the float16 vectors, not float32: same ids, float16-accurate distances
+        assert np.allclose(result["distances"], expected["distances"], atol=1e-3)
+
+    # an index written without codes is quantized on load
+    reopened = NumpyCollection(str(tmp_path / "none"), quantization="int8")
+    assert reopened.codes.dtype == np.int8